@@ -0,0 +1,64 @@
+"""
+===========================================
+Benchmark the ways of computing the dipoles
+===========================================
+
+Simulate the networks of the bundled parameter files with the dipoles summed
+by the dipole mechanisms (dipole_method='mechanism') and projected from the
+membrane currents (dipole_method='imem'), and report the time of each and the
+error of the dipoles projected from the membrane currents.
+
+Usage::
+
+    python bench_dipole_method.py [param_name ...] [--tstop TSTOP]
+
+By default, default.json, N20.json and gamma_L5weak_L2weak.json are
+simulated with their own duration.
+"""
+
+import argparse
+import os.path as op
+import time
+
+import numpy as np
+
+import hnn_core
+from hnn_core import read_params, Network, simulate_dipole
+
+hnn_core_root = op.dirname(hnn_core.__file__)
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('param_names', nargs='*',
+                    default=['default', 'N20', 'gamma_L5weak_L2weak'])
+parser.add_argument('--tstop', type=float, default=None,
+                    help='duration (in ms), the one of each file if omitted')
+args = parser.parse_args()
+
+
+def simulate(params, dipole_method):
+    """Simulate one trial, return its dipole and the time it took."""
+    net = Network(params, add_drives_from_params=True)
+    start = time.perf_counter()
+    dpl = simulate_dipole(net, n_trials=1, postproc=False,
+                          dipole_method=dipole_method)[0]
+    return dpl, time.perf_counter() - start
+
+
+results = list()
+for param_name in args.param_names:
+    params = read_params(op.join(hnn_core_root, 'param',
+                                 param_name + '.json'))
+    if args.tstop is not None:
+        params['tstop'] = args.tstop
+    dpl_mechanism, time_mechanism = simulate(params, 'mechanism')
+    dpl_imem, time_imem = simulate(params, 'imem')
+    data = dpl_mechanism.data['agg']
+    error = np.abs(dpl_imem.data['agg'] - data).max() / np.abs(data).max()
+    results.append((param_name, time_mechanism, time_imem, error))
+
+print('\n%-20s %13s %9s %8s %14s'
+      % ('param', 'mechanism (s)', 'imem (s)', 'speedup', 'max err / max'))
+for param_name, time_mechanism, time_imem, error in results:
+    print('%-20s %13.2f %9.2f %8.2f %14.3g'
+          % (param_name, time_mechanism, time_imem,
+             time_mechanism / time_imem, error))
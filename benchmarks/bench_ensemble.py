@@ -0,0 +1,75 @@
+"""
+=================================================
+Benchmark the trials simulated as network replicas
+=================================================
+
+By default, each trial builds the network in NEURON, initializes it and runs
+the solver on its own. With ensemble_size > 1, the trials of a batch are
+disconnected replicas of the network that are built and simulated together.
+
+This script simulates the trials of a small network with several ensemble
+sizes and reports the time of the whole simulation and whether the dipoles
+are identical to those of the trials simulated one by one.
+
+Usage::
+
+    python bench_ensemble.py [param_name] [--n_pyr N_PYR] [--n_trials N_TRIALS]
+                             [--ensemble_sizes SIZE ...] [--tstop TSTOP]
+                             [--dipole_method {mechanism,imem}]
+
+By default, default.json is simulated with 3 x 3 pyramidal cells per layer
+for its own duration, 12 trials and ensemble sizes of 1, 4 and 12.
+"""
+
+import argparse
+import os.path as op
+import time
+
+import numpy as np
+
+import hnn_core
+from hnn_core import read_params, Network, simulate_dipole
+
+hnn_core_root = op.dirname(hnn_core.__file__)
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('param_name', nargs='?', default='default')
+parser.add_argument('--n_pyr', type=int, default=3,
+                    help='number of pyramidal cells along each side')
+parser.add_argument('--n_trials', type=int, default=12)
+parser.add_argument('--ensemble_sizes', type=int, nargs='+',
+                    default=[1, 4, 12])
+parser.add_argument('--tstop', type=float, default=None,
+                    help='duration (in ms), the one of the file if omitted')
+parser.add_argument('--dipole_method', default='mechanism',
+                    choices=['mechanism', 'imem'])
+args = parser.parse_args()
+
+params = read_params(op.join(hnn_core_root, 'param',
+                             args.param_name + '.json'))
+params.update({'N_pyr_x': args.n_pyr, 'N_pyr_y': args.n_pyr})
+if args.tstop is not None:
+    params['tstop'] = args.tstop
+
+lines = list()
+dpls_single = None
+for ensemble_size in args.ensemble_sizes:
+    net = Network(params, add_drives_from_params=True)
+    start = time.perf_counter()
+    dpls = simulate_dipole(net, n_trials=args.n_trials, postproc=False,
+                           dipole_method=args.dipole_method,
+                           ensemble_size=ensemble_size)
+    time_simulation = time.perf_counter() - start
+    if dpls_single is None:
+        dpls_single = dpls
+    identical = all(np.array_equal(dpl.data['agg'], dpl_single.data['agg'])
+                    for dpl, dpl_single in zip(dpls, dpls_single))
+    lines.append('%-14d %10.2f %14.3f %10s'
+                 % (ensemble_size, time_simulation,
+                    time_simulation / args.n_trials, identical))
+
+print('\n%d trials of %d x %d pyramidal cells per layer (%s)'
+      % (args.n_trials, args.n_pyr, args.n_pyr, args.dipole_method))
+print('%-14s %10s %14s %10s' % ('ensemble_size', 'total (s)',
+                                'per trial (s)', 'identical'))
+print('\n'.join(lines))
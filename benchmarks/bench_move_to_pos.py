@@ -0,0 +1,114 @@
+"""
+=========================================
+Benchmark moving the cells to their place
+=========================================
+
+The 3D points of each cell are created at the position of the cell in the
+network. Translating the points from the origin after the cell is created,
+as NetworkBuilder used to, costs a few calls into NEURON per point.
+
+This script creates pyramidal cells and places them in four ways, and reports
+the time of each (creating and moving the cells) and the largest difference
+(in um) of their 3D points from those of the cells created in place:
+
+- creating the points at the position of the cell (Cell)
+- Section.pt3dchange for each point
+- h.pt3dchange(..., sec=sect) for each point
+- translating the soma and letting h.define_shape() translate the sections
+  connected to it
+
+Usage::
+
+    python bench_move_to_pos.py [--n_cells N_CELLS]
+
+By default, 1000 L5 pyramidal cells are moved.
+"""
+
+import argparse
+import time
+
+import numpy as np
+from neuron import h
+
+from hnn_core.network_builder import load_custom_mechanisms
+from hnn_core.pyramidal import L5Pyr
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('--n_cells', type=int, default=1000)
+args = parser.parse_args()
+
+
+def _get_offset(cell):
+    soma = cell.soma
+    return (cell.pos[0] * 100 - soma.x3d(0), cell.pos[2] - soma.y3d(0),
+            cell.pos[1] * 100 - soma.z3d(0))
+
+
+def _translate(sect, dx, dy, dz):
+    for i in range(sect.n3d()):
+        h.pt3dchange(i, sect.x3d(i) + dx, sect.y3d(i) + dy,
+                     sect.z3d(i) + dz, sect.diam3d(i), sec=sect)
+
+
+def move_in_place(cells):
+    pass
+
+
+def move_with_section(cells):
+    for cell in cells:
+        dx, dy, dz = _get_offset(cell)
+        for sect in cell.get_sections():
+            for i in range(sect.n3d()):
+                sect.pt3dchange(i, sect.x3d(i) + dx, sect.y3d(i) + dy,
+                                sect.z3d(i) + dz, sect.diam3d(i))
+
+
+def move_with_h(cells):
+    for cell in cells:
+        dx, dy, dz = _get_offset(cell)
+        for sect in cell.get_sections():
+            _translate(sect, dx, dy, dz)
+
+
+def move_with_define_shape(cells):
+    for cell in cells:
+        _translate(cell.soma, *_get_offset(cell))
+    h.define_shape()
+
+
+def get_points(cells):
+    return np.array([[sect.x3d(i), sect.y3d(i), sect.z3d(i)]
+                     for cell in cells for sect in cell.get_sections()
+                     for i in range(sect.n3d())])
+
+
+load_custom_mechanisms()
+# the prototype of the cells is resolved once, before the timings
+L5Pyr()
+n_x = int(np.ceil(np.sqrt(args.n_cells)))
+positions = [(idx % n_x, idx // n_x, 0) for idx in range(args.n_cells)]
+print('\n%d L5 pyramidal cells' % args.n_cells)
+print('%-28s %9s %15s' % ('approach', 'time (s)', 'max diff (um)'))
+points = None
+# h.define_shape() translates the sections of all the cells, it goes last
+for name, move in [('created in place', move_in_place),
+                   ('Section.pt3dchange', move_with_section),
+                   ('h.pt3dchange', move_with_h),
+                   ('soma and h.define_shape', move_with_define_shape)]:
+    start = time.perf_counter()
+    if move is move_in_place:
+        cells = [L5Pyr(pos=pos, gid=idx)
+                 for idx, pos in enumerate(positions)]
+    else:
+        # the cells are created at the origin and moved to their position
+        cells = [L5Pyr(pos=(0, 0, 0), gid=idx)
+                 for idx in range(args.n_cells)]
+        for cell, pos in zip(cells, positions):
+            cell.pos = pos
+    move(cells)
+    duration = time.perf_counter() - start
+    if points is None:
+        points = get_points(cells)
+    diff = np.abs(get_points(cells) - points).max()
+    print('%-28s %9.3f %15.3g' % (name, duration, diff))
+    del cells
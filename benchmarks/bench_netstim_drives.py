@@ -0,0 +1,72 @@
+"""
+==========================================================
+Benchmark the Poisson drives whose events NEURON generates
+==========================================================
+
+By default, the events of a Poisson drive are drawn in Python for each drive
+cell and trial when the simulation starts, stored in the Network, pickled
+for the processes that simulate the trials and loaded into a VecStim per
+drive cell. With event_generator='netstim', each drive cell is a NetStim
+that draws its events during the simulation instead.
+
+This script adds a Poisson drive to all the cells of the network for the
+whole simulation and reports, for both event generators, the time spent
+creating the events, the size of the pickled Network and the time of the
+whole simulation.
+
+Usage::
+
+    python bench_netstim_drives.py [param_name] [--tstop TSTOP]
+                                   [--rate RATE] [--n_trials N_TRIALS]
+
+By default, default.json is simulated for 1000 ms with a rate of 100 Hz and
+one trial.
+"""
+
+import argparse
+import os.path as op
+import pickle
+import time
+
+import hnn_core
+from hnn_core import read_params, Network, simulate_dipole
+
+hnn_core_root = op.dirname(hnn_core.__file__)
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('param_name', nargs='?', default='default')
+parser.add_argument('--tstop', type=float, default=1000.,
+                    help='duration (in ms)')
+parser.add_argument('--rate', type=float, default=100.,
+                    help='rate (in Hz) of the events of each drive cell')
+parser.add_argument('--n_trials', type=int, default=1)
+args = parser.parse_args()
+
+params = read_params(op.join(hnn_core_root, 'param',
+                             args.param_name + '.json'))
+params['tstop'] = args.tstop
+
+lines = list()
+for event_generator in ('python', 'netstim'):
+    net = Network(params)
+    weights = {cell_type: 1e-5 for cell_type in net.cellname_list}
+    rates = {cell_type: args.rate for cell_type in net.cellname_list}
+    net.add_poisson_drive('poisson', rate_constant=rates,
+                          location='proximal', weights_ampa=weights,
+                          event_generator=event_generator)
+    start = time.perf_counter()
+    net._instantiate_drives(n_trials=args.n_trials)
+    time_events = time.perf_counter() - start
+    n_bytes = len(pickle.dumps(net))
+    start = time.perf_counter()
+    simulate_dipole(net, n_trials=args.n_trials, postproc=False)
+    time_simulation = time.perf_counter() - start
+    lines.append('%-10s %10.3f %12.2f %10.2f'
+                 % (event_generator, time_events, n_bytes / 1e6,
+                    time_simulation))
+
+print('\nEvent generation, pickled Network and simulation with a Poisson '
+      'drive at %s Hz' % args.rate)
+print('%-10s %10s %12s %10s' % ('generator', 'events (s)', 'pickle (MB)',
+                                'total (s)'))
+print('\n'.join(lines))
@@ -0,0 +1,94 @@
+"""
+=====================================================
+Benchmark the delivery of drive events by PatternStim
+=====================================================
+
+By default, each drive cell is an artificial cell with its own VecStim,
+NetCon and gid. With drive_method='patternstim', a single PatternStim per
+process delivers the events of all the drive cells instead.
+
+This script adds evoked drives to all the cells of the network and reports,
+for both methods, the number of gids, the time it takes to build the
+network in NEURON and the time of a short simulation.
+
+Usage::
+
+    python bench_pattern_drives.py [param_name] [--n_drives N_DRIVES]
+                                   [--tstop TSTOP] [--n_repeats N_REPEATS]
+
+By default, default.json is simulated for 20 ms with 12 drives and the
+network is built three times with each method.
+"""
+
+import argparse
+import os.path as op
+import time
+
+import numpy as np
+
+import hnn_core
+from hnn_core import read_params, Network, simulate_dipole
+from hnn_core.network_builder import NetworkBuilder, _DEFAULT_OPTIONS
+
+hnn_core_root = op.dirname(hnn_core.__file__)
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('param_name', nargs='?', default='default')
+parser.add_argument('--n_drives', type=int, default=12)
+parser.add_argument('--tstop', type=float, default=20.,
+                    help='duration (in ms)')
+parser.add_argument('--n_repeats', type=int, default=3,
+                    help='number of builds with each method')
+args = parser.parse_args()
+
+params = read_params(op.join(hnn_core_root, 'param',
+                             args.param_name + '.json'))
+params['tstop'] = args.tstop
+
+
+def make_net():
+    """Make the network with its drives and their events for one trial."""
+    net = Network(params)
+    weights = {cell_type: 1e-4 for cell_type in net.cellname_list}
+    for drive_idx in range(args.n_drives):
+        net.add_evoked_drive('evoked%d' % drive_idx,
+                             mu=args.tstop * drive_idx / args.n_drives,
+                             sigma=1., numspikes=1, location='proximal',
+                             weights_ampa=weights, seedcore=drive_idx)
+    net._instantiate_drives(n_trials=1)
+    net.params.update({'record_vsoma': False, 'record_isoma': False})
+    return net
+
+
+# the methods alternate as each build is slowed down by clearing the
+# previous network
+drive_methods = ('vecstim', 'patternstim')
+n_gids, times_build = dict(), {method: list() for method in drive_methods}
+for _ in range(args.n_repeats):
+    for drive_method in drive_methods:
+        net = make_net()
+        options = dict(_DEFAULT_OPTIONS, drive_method=drive_method)
+        start = time.perf_counter()
+        with NetworkBuilder(net, options=options) as neuron_net:
+            times_build[drive_method].append(time.perf_counter() - start)
+            n_gids[drive_method] = len(neuron_net._gid_list)
+
+lines = list()
+results = dict()
+for drive_method in drive_methods:
+    net = make_net()
+    start = time.perf_counter()
+    dpls = simulate_dipole(net, n_trials=1, postproc=False,
+                           drive_method=drive_method)
+    time_simulation = time.perf_counter() - start
+    results[drive_method] = dpls[0].data['agg']
+    lines.append('%-12s %8d %10.2f %10.2f'
+                 % (drive_method, n_gids[drive_method],
+                    min(times_build[drive_method]), time_simulation))
+
+print('\nGids, fastest of %d builds and simulation times with %d drives'
+      % (args.n_repeats, args.n_drives))
+print('%-12s %8s %10s %10s' % ('method', 'gids', 'build (s)', 'total (s)'))
+print('\n'.join(lines))
+print('max. abs. difference of the dipoles: %s'
+      % np.abs(results['vecstim'] - results['patternstim']).max())
@@ -0,0 +1,110 @@
+"""
+=========================================================
+Benchmark the pyramidal cells with collapsed dendrites
+=========================================================
+
+With pyramidal_model='reduced', the pyramidal cells are L2PyrReduced and
+L5PyrReduced, whose side branches are collapsed into the main paths of the
+apical and basal trees and whose dendrites have few segments. They trade
+fidelity for speed.
+
+This script reports the number of segments of the pyramidal cells, then
+simulates one trial of the bundled parameter files with the full and the
+reduced cells. It reports the time to build the network and the time of the
+time steps, the speedup of the time steps, the RMSE of the dipoles relative
+to the peak of the dipoles of the full cells and the number of spikes of the
+pyramidal cells.
+
+Usage::
+
+    python bench_reduced.py [param_name ...] [--d_lambda D_LAMBDA]
+                            [--tstop TSTOP]
+
+By default, default.json, N20.json and gamma_L5weak_L2weak.json are
+simulated with their own duration and the reduced cells have no segment
+longer than the length constant (d_lambda=1.).
+"""
+
+import argparse
+import os.path as op
+import time
+
+import numpy as np
+
+import hnn_core
+from hnn_core import (read_params, Network, L2Pyr, L5Pyr, L2PyrReduced,
+                      L5PyrReduced)
+from hnn_core.dipole import _get_sim_options
+from hnn_core.network_builder import (NetworkBuilder, _simulate_single_trial,
+                                      load_custom_mechanisms)
+
+hnn_core_root = op.dirname(hnn_core.__file__)
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('param_names', nargs='*',
+                    default=['default', 'N20', 'gamma_L5weak_L2weak'])
+parser.add_argument('--d_lambda', type=float, default=None,
+                    help='largest segment of the reduced cells as a '
+                    'fraction of the length constant')
+parser.add_argument('--tstop', type=float, default=None,
+                    help='duration (in ms), the one of each file if omitted')
+args = parser.parse_args()
+
+models = {'full': dict(),
+          'reduced': dict(pyramidal_model='reduced', d_lambda=args.d_lambda)}
+
+load_custom_mechanisms()
+print('\nSegments of each pyramidal cell')
+print('%-6s %-8s %s' % ('cell', 'model', 'segments'))
+for cell_classes in ((L2Pyr, L2PyrReduced), (L5Pyr, L5PyrReduced)):
+    for model_name, model in models.items():
+        PyramidalCell = cell_classes[model_name != 'full']
+        cell = PyramidalCell(d_lambda=model.get('d_lambda'))
+        print('%-6s %-8s %d' % (cell.name, model_name,
+                                sum(sect.nseg for sect in
+                                    cell.get_sections())))
+
+
+def simulate(params, model):
+    """Simulate one trial, return its Dipole, the number of spikes of each
+    pyramidal cell type and the times to build and to simulate."""
+    net = Network(params, add_drives_from_params=True)
+    _, options = _get_sim_options(net, n_trials=1, **model)
+    start = time.perf_counter()
+    neuron_net = NetworkBuilder(net, options=options)
+    time_build = time.perf_counter() - start
+    start = time.perf_counter()
+    dpl = _simulate_single_trial(neuron_net, 0)[0]
+    time_sim = time.perf_counter() - start
+    n_spikes = [np.isin(neuron_net._all_spike_gids,
+                        list(net.gid_ranges[cell_type])).sum()
+                for cell_type in ('L2_pyramidal', 'L5_pyramidal')]
+    return dpl, n_spikes, time_build, time_sim
+
+
+lines = list()
+for param_name in args.param_names:
+    params = read_params(op.join(hnn_core_root, 'param',
+                                 param_name + '.json'))
+    if args.tstop is not None:
+        params['tstop'] = args.tstop
+    dpls = dict()
+    for model_name, model in models.items():
+        dpl, n_spikes, time_build, time_sim = simulate(params, model)
+        dpls[model_name] = dpl
+        rmse = [np.sqrt(np.mean((dpl.data[layer] -
+                                 dpls['full'].data[layer]) ** 2)) /
+                np.abs(dpls['full'].data[layer]).max()
+                for layer in ('L2', 'L5', 'agg')]
+        if model_name == 'full':
+            time_full = time_sim
+        lines.append('%-20s %-8s %9.2f %9.2f %8.2f %6.3f %6.3f %6.3f %6d %6d'
+                     % tuple([param_name, model_name, time_build, time_sim,
+                              time_full / time_sim] + rmse + n_spikes))
+
+print('\nTimes, speedup of the time steps, RMSE / max of the dipoles against '
+      'the full cells and spikes of the pyramidal cells')
+print('%-20s %-8s %9s %9s %8s %6s %6s %6s %6s %6s'
+      % ('param', 'model', 'build (s)', 'steps (s)', 'speedup', 'L2', 'L5',
+         'agg', 'L2Pyr', 'L5Pyr'))
+print('\n'.join(lines))
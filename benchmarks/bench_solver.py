@@ -0,0 +1,71 @@
+"""
+=========================================
+Benchmark the variable time step solvers
+=========================================
+
+Simulate the networks of the bundled parameter files with the fixed time
+step and with NEURON's variable time step methods (solver='cvode' and
+solver='lvardt'), and report the speedup and the error of the dipoles of each
+variable time step solver against the fixed time step.
+
+Usage::
+
+    python bench_solver.py [param_name ...] [--atol ATOL] [--tstop TSTOP]
+
+By default, default.json, N20.json and gamma_L5weak_L2weak.json are
+simulated with their own duration.
+"""
+
+import argparse
+import os.path as op
+import time
+
+import numpy as np
+
+import hnn_core
+from hnn_core import read_params, Network, simulate_dipole
+
+hnn_core_root = op.dirname(hnn_core.__file__)
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('param_names', nargs='*',
+                    default=['default', 'N20', 'gamma_L5weak_L2weak'])
+parser.add_argument('--atol', type=float, default=1e-3,
+                    help='absolute tolerance of the variable time steps')
+parser.add_argument('--tstop', type=float, default=None,
+                    help='duration (in ms), the one of each file if omitted')
+args = parser.parse_args()
+
+
+def simulate(params, solver):
+    """Simulate one trial, return its dipole and the time it took."""
+    net = Network(params, add_drives_from_params=True)
+    start = time.perf_counter()
+    dpl = simulate_dipole(net, n_trials=1, postproc=False, solver=solver,
+                          cvode_atol=args.atol)[0]
+    return dpl, time.perf_counter() - start
+
+
+results = list()
+for param_name in args.param_names:
+    params = read_params(op.join(hnn_core_root, 'param',
+                                 param_name + '.json'))
+    if args.tstop is not None:
+        params['tstop'] = args.tstop
+    dpl_fixed, time_fixed = simulate(params, 'fixed')
+    for solver in ('cvode', 'lvardt'):
+        dpl, time_solver = simulate(params, solver)
+        for layer in ('L2', 'L5', 'agg'):
+            data = dpl_fixed.data[layer]
+            rmse = np.sqrt(np.mean((dpl.data[layer] - data) ** 2))
+            results.append((param_name, solver, layer, time_fixed,
+                            time_solver, rmse, np.abs(data).max()))
+
+print('\n%-20s %-7s %-4s %9s %9s %8s %10s %10s'
+      % ('param', 'solver', 'dpl', 'fixed (s)', 'var. (s)', 'speedup',
+         'RMSE', 'RMSE / max'))
+for (param_name, solver, layer, time_fixed, time_solver, rmse,
+        data_max) in results:
+    print('%-20s %-7s %-4s %9.2f %9.2f %8.2f %10.4g %10.3f'
+          % (param_name, solver, layer, time_fixed, time_solver,
+             time_fixed / time_solver, rmse, rmse / data_max))
@@ -0,0 +1,77 @@
+"""
+==========================
+Benchmark parameter sweeps
+==========================
+
+A sweep over the parameters of a network is often a Python loop that
+creates each candidate Network and calls simulate_dipole, so the trials of
+one candidate must all finish before those of the next one start. With
+simulate_sweep, the trials of all the candidates are scheduled over the
+backend in a single workload.
+
+This script sweeps the grid size and the timing of a drive of a small
+network with both approaches and reports the time of the whole sweep and
+whether the dipoles are identical.
+
+Usage::
+
+    python bench_sweep.py [param_name] [--n_trials N_TRIALS]
+                          [--n_jobs N_JOBS] [--tstop TSTOP]
+
+By default, default.json is simulated for 40 ms with 2 trials of each of
+the 4 candidates on one core.
+"""
+
+import argparse
+import os.path as op
+import time
+
+import numpy as np
+
+import hnn_core
+from hnn_core import (read_params, Network, simulate_dipole, simulate_sweep,
+                      JoblibBackend)
+
+hnn_core_root = op.dirname(hnn_core.__file__)
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('param_name', nargs='?', default='default')
+parser.add_argument('--n_trials', type=int, default=2)
+parser.add_argument('--n_jobs', type=int, default=1)
+parser.add_argument('--tstop', type=float, default=40.,
+                    help='duration (in ms)')
+args = parser.parse_args()
+
+params = read_params(op.join(hnn_core_root, 'param',
+                             args.param_name + '.json'))
+params.update({'N_pyr_x': 3, 'N_pyr_y': 3, 'tstop': args.tstop})
+overrides = {'N_pyr_x': [3, 4], 'evprox1': [{'mu': 5.}, {'mu': 15.}]}
+
+with JoblibBackend(n_jobs=args.n_jobs):
+    start = time.perf_counter()
+    dpls_loop = list()
+    for n_pyr_x in overrides['N_pyr_x']:
+        for drive_overrides in overrides['evprox1']:
+            candidate_params = params.copy()
+            candidate_params['N_pyr_x'] = n_pyr_x
+            net = Network(candidate_params, add_drives_from_params=True)
+            net.external_drives['evprox1']['dynamics'].update(
+                drive_overrides)
+            dpls_loop.extend(simulate_dipole(net, n_trials=args.n_trials,
+                                             postproc=False))
+    time_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    net = Network(params.copy(), add_drives_from_params=True)
+    sweep = simulate_sweep(net, overrides, n_trials=args.n_trials,
+                           postproc=False)
+    time_sweep = time.perf_counter() - start
+
+identical = all(np.array_equal(dpl.data['agg'], dpl_sweep)
+                for dpl, dpl_sweep in zip(dpls_loop, sweep['dipole.agg']))
+print('\n%d candidates x %d trials on %d cores'
+      % (len(dpls_loop) // args.n_trials, args.n_trials, args.n_jobs))
+print('%-16s %10s' % ('approach', 'total (s)'))
+print('%-16s %10.2f' % ('loop', time_loop))
+print('%-16s %10.2f' % ('simulate_sweep', time_sweep))
+print('identical dipoles: %s' % identical)
@@ -0,0 +1,85 @@
+"""
+===================================================
+Benchmark the in-place update of connection weights
+===================================================
+
+Candidates that differ only in the weights of the connections between cells
+('gbar_*' parameters) need not build the network in NEURON again: the
+weights and delays of the NetCons of a built network are updated in place
+and the trial is simulated again.
+
+This script simulates one trial of a few candidates with different weights,
+once building the network for each candidate and once updating the
+connections of a single build, and reports the time per candidate and
+whether the dipoles are identical.
+
+Usage::
+
+    python bench_update_connections.py [param_name] [--n_pyr N_PYR]
+                                       [--n_candidates N_CANDIDATES]
+                                       [--tstop TSTOP]
+
+By default, default.json is simulated for 20 ms with 10 x 10 pyramidal
+cells per layer and 4 candidates.
+"""
+
+import argparse
+import os.path as op
+import time
+
+import numpy as np
+
+import hnn_core
+from hnn_core import read_params, Network
+from hnn_core.network_builder import NetworkBuilder, _simulate_single_trial
+
+hnn_core_root = op.dirname(hnn_core.__file__)
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('param_name', nargs='?', default='default')
+parser.add_argument('--n_pyr', type=int, default=10,
+                    help='number of pyramidal cells along each side')
+parser.add_argument('--n_candidates', type=int, default=4)
+parser.add_argument('--tstop', type=float, default=20.,
+                    help='duration (in ms)')
+args = parser.parse_args()
+
+params = read_params(op.join(hnn_core_root, 'param',
+                             args.param_name + '.json'))
+params.update({'N_pyr_x': args.n_pyr, 'N_pyr_y': args.n_pyr,
+               'tstop': args.tstop, 'record_vsoma': False,
+               'record_isoma': False})
+net = Network(params, add_drives_from_params=True)
+net._instantiate_drives(n_trials=1)
+gbar = net.params['gbar_L2Pyr_L2Pyr_ampa']
+candidates = [{'gbar_L2Pyr_L2Pyr_ampa': gbar * factor}
+              for factor in np.linspace(0.5, 2., args.n_candidates)]
+
+start = time.perf_counter()
+dpls_build = list()
+for candidate in candidates:
+    net.params.update(candidate)
+    neuron_net = NetworkBuilder(net)
+    dpls_build.append(_simulate_single_trial(neuron_net, 0)[0])
+time_build = (time.perf_counter() - start) / len(candidates)
+
+start = time.perf_counter()
+dpls_update = list()
+for candidate_idx, candidate in enumerate(candidates):
+    if candidate_idx == 0:
+        net.params.update(candidate)
+        neuron_net = NetworkBuilder(net)
+    else:
+        neuron_net.update_connections(candidate)
+        neuron_net.state_init()
+    dpls_update.append(_simulate_single_trial(neuron_net, 0)[0])
+time_update = (time.perf_counter() - start) / len(candidates)
+
+identical = all(np.array_equal(dpl.data['agg'], dpl_update.data['agg'])
+                for dpl, dpl_update in zip(dpls_build, dpls_update))
+print('\n%d candidates of %d x %d pyramidal cells per layer'
+      % (len(candidates), args.n_pyr, args.n_pyr))
+print('%-24s %16s' % ('approach', 'per candidate (s)'))
+print('%-24s %16.2f' % ('build each candidate', time_build))
+print('%-24s %16.2f' % ('update the connections', time_update))
+print('identical dipoles: %s' % identical)
@@ -0,0 +1,101 @@
+"""
+=====================================================
+Report the segments and dipoles of the d_lambda rule
+=====================================================
+
+By default, the dendrites of the pyramidal cells longer than 100 um have one
+segment per 50 um. The d_lambda rule instead limits each segment to a
+fraction (d_lambda) of the AC length constant of its dendrite at a given
+frequency, which accounts for the diameter and the membrane properties.
+
+This script reports the number of segments of L2Pyr and L5Pyr and of all
+their cells in the network with both rules, which drives the cost of each
+time step. It then simulates the bundled parameter files with both rules and
+reports the speedup and the RMSE of the dipoles of the d_lambda rule
+relative to the peak of the default dipoles.
+
+Usage::
+
+    python report_d_lambda.py [param_name ...] [--d_lambda D_LAMBDA]
+                              [--freq FREQ] [--tstop TSTOP]
+
+By default, default.json, N20.json and gamma_L5weak_L2weak.json are
+simulated with their own duration, d_lambda=0.1 and a frequency of 100 Hz.
+"""
+
+import argparse
+import os.path as op
+import time
+
+import numpy as np
+
+import hnn_core
+from hnn_core import read_params, Network, simulate_dipole, L2Pyr, L5Pyr
+from hnn_core.network_builder import load_custom_mechanisms
+
+hnn_core_root = op.dirname(hnn_core.__file__)
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('param_names', nargs='*',
+                    default=['default', 'N20', 'gamma_L5weak_L2weak'])
+parser.add_argument('--d_lambda', type=float, default=0.1,
+                    help='largest segment as a fraction of the length '
+                    'constant')
+parser.add_argument('--freq', type=float, default=100.,
+                    help='frequency (in Hz) of the length constant')
+parser.add_argument('--tstop', type=float, default=None,
+                    help='duration (in ms), the one of each file if omitted')
+args = parser.parse_args()
+
+load_custom_mechanisms()
+rules = {'default': dict(),
+         'd_lambda': dict(d_lambda=args.d_lambda, d_lambda_freq=args.freq)}
+n_segs = dict()
+print('\nSegments of each pyramidal cell (d_lambda=%s at %s Hz)'
+      % (args.d_lambda, args.freq))
+print('%-6s %-10s %s' % ('cell', 'rule', 'segments (total, per dendrite)'))
+for PyramidalCell in (L2Pyr, L5Pyr):
+    for rule_name, rule in rules.items():
+        cell = PyramidalCell(**rule)
+        n_seg = sum(sect.nseg for sect in cell.get_sections())
+        n_segs[(cell.name, rule_name)] = n_seg
+        print('%-6s %-10s %d, %s'
+              % (cell.name, rule_name, n_seg,
+                 {name: dend.nseg for name, dend in cell.dends.items()}))
+
+
+def simulate(params, rule):
+    """Simulate one trial, return its Dipole and the time it took."""
+    net = Network(params, add_drives_from_params=True)
+    start = time.perf_counter()
+    dpl = simulate_dipole(net, n_trials=1, postproc=False, **rule)[0]
+    return dpl, time.perf_counter() - start
+
+
+lines = list()
+for param_name in args.param_names:
+    params = read_params(op.join(hnn_core_root, 'param',
+                                 param_name + '.json'))
+    if args.tstop is not None:
+        params['tstop'] = args.tstop
+    n_cells = params['N_pyr_x'] * params['N_pyr_y']
+    n_net_segs = [n_cells * (n_segs[('L2Pyr', rule_name)] +
+                             n_segs[('L5Pyr', rule_name)])
+                  for rule_name in rules]
+    dpl_default, time_default = simulate(params, rules['default'])
+    dpl, time_d_lambda = simulate(params, rules['d_lambda'])
+    rmse = [np.sqrt(np.mean((dpl.data[layer] -
+                             dpl_default.data[layer]) ** 2)) /
+            np.abs(dpl_default.data[layer]).max()
+            for layer in ('L2', 'L5', 'agg')]
+    lines.append('%-20s %8d %9d %8.2f %8.2f %8.2f %8.4f %8.4f %8.4f'
+                 % tuple([param_name] + n_net_segs +
+                         [time_default, time_d_lambda,
+                          time_default / time_d_lambda] + rmse))
+
+print('\nSegments of the pyramidal cells of the network, simulation times and '
+      'RMSE / max of the dipoles of the d_lambda rule')
+print('%-20s %8s %9s %8s %8s %8s %8s %8s %8s'
+      % ('param', 'segs', 'segs d_l', 'time (s)', 'time d_l', 'speedup',
+         'L2', 'L5', 'agg'))
+print('\n'.join(lines))
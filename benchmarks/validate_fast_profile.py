@@ -0,0 +1,140 @@
+"""
+====================================================
+Validate the second-order integration with larger dt
+====================================================
+
+The default integration uses backward Euler with dt=0.025 ms. The fast
+profile integrates with Crank-Nicolson, which is accurate to second order in
+the time step, with twice the time step::
+
+    params.update({'dt': 0.05, 'secondorder': 2})
+    simulate_dipole(net)
+
+This script simulates the bundled parameter files with both settings and
+reports the wall-clock speedup, the RMSE of the dipoles and the differences
+of the spike times of the cells (median and maximum). The RMSE is given for
+the dipoles as integrated, in which Crank-Nicolson oscillates with a period
+of two time steps, and after the smoothing window of the post-processing
+(params['dipole_smooth_win']). The spikes of each cell are paired in order,
+the cells with a different number of spikes are counted as mismatches
+instead. With --reference, both settings are also compared to backward Euler
+with a ten times smaller time step, which shows which of them is closer to
+the exact solution. With --d_lambda, the fast profile also segments the
+dendrites by the d_lambda rule.
+
+Usage::
+
+    python validate_fast_profile.py [param_name ...] [--tstop TSTOP]
+                                    [--d_lambda D_LAMBDA] [--reference]
+
+By default, default.json, N20.json and gamma_L5weak_L2weak.json are
+simulated with their own duration and the fast profile keeps the segments
+of the default integration. Against the default integration, it is 1.3 to
+1.8 times faster, the RMSE of the dipoles as integrated is 13 to 28% of
+their peak, and 2 to 10% after the smoothing windows of default.json and
+N20.json (gamma_L5weak_L2weak.json has none). The dipoles mostly differ
+after the spikes of the cells, which shift by 0.1 ms (median).
+"""
+
+import argparse
+import os.path as op
+import time
+
+import numpy as np
+
+import hnn_core
+from hnn_core import read_params, Network, simulate_dipole
+
+hnn_core_root = op.dirname(hnn_core.__file__)
+
+fast_profile = {'dt': 0.05, 'secondorder': 2}
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+parser.add_argument('param_names', nargs='*',
+                    default=['default', 'N20', 'gamma_L5weak_L2weak'])
+parser.add_argument('--tstop', type=float, default=None,
+                    help='duration (in ms), the one of each file if omitted')
+parser.add_argument('--d_lambda', type=float, default=None,
+                    help='d_lambda rule of the segments of the fast '
+                    'profile, the segments of the default if omitted')
+parser.add_argument('--reference', action='store_true',
+                    help='compare to backward Euler with dt / 10')
+args = parser.parse_args()
+
+
+def simulate(params, profile, d_lambda=None):
+    """Simulate one trial, return its dipole as integrated and smoothed, its
+    spikes and the time it took."""
+    params = params.copy()
+    params.update(profile)
+    net = Network(params, add_drives_from_params=True)
+    start = time.perf_counter()
+    dpl = simulate_dipole(net, n_trials=1, postproc=False,
+                          d_lambda=d_lambda)[0]
+    duration = time.perf_counter() - start
+    data = dpl.data['agg']
+    dpl.smooth(params['dipole_smooth_win'] / params['dt'])
+    # the spikes of the drives are the same for both settings
+    spike_times = np.array(net.cell_response.spike_times[0])
+    spike_gids = np.array(net.cell_response.spike_gids[0])
+    cell_gids = [gid for name in net.cellname_list
+                 for gid in net.gid_ranges[name]]
+    is_cell = np.in1d(spike_gids, cell_gids)
+    return ((data, dpl.data['agg']), (spike_times[is_cell],
+                                      spike_gids[is_cell]), duration)
+
+
+def compare(sim, sim_ref):
+    """Compare a simulation to a reference on the times they share."""
+    (dpl_data, (spike_times, spike_gids), _) = sim
+    (dpl_data_ref, (spike_times_ref, spike_gids_ref), _) = sim_ref
+    # the time step of the reference divides the one of the simulation
+    step = (dpl_data_ref[0].size - 1) // (dpl_data[0].size - 1)
+    rmses = list()
+    for data, data_ref in zip(dpl_data, dpl_data_ref):
+        data_ref = data_ref[::step]
+        rmses.append(np.sqrt(np.mean((data - data_ref) ** 2)) /
+                     np.abs(data_ref).max())
+
+    time_diffs, n_mismatched = list(), 0
+    for gid in np.union1d(spike_gids, spike_gids_ref):
+        times = np.sort(spike_times[spike_gids == gid])
+        times_ref = np.sort(spike_times_ref[spike_gids_ref == gid])
+        if times.size != times_ref.size:
+            n_mismatched += 1
+            continue
+        time_diffs.extend(np.abs(times - times_ref))
+    time_diffs = np.array(time_diffs) if time_diffs else np.array([np.nan])
+    return tuple(rmses) + (np.median(time_diffs), np.max(time_diffs),
+                           n_mismatched)
+
+
+header = ('%-20s %-12s %9s %8s %10s %10s %10s %10s %10s'
+          % ('param', 'compared', 'time (s)', 'speedup', 'RMSE raw',
+             'RMSE smth', 'spike med.', 'spike max', 'mismatch'))
+row = '%-20s %-12s %9.2f %8.2f %10.4f %10.4f %10.4f %10.4f %10d'
+lines = list()
+for param_name in args.param_names:
+    params = read_params(op.join(hnn_core_root, 'param',
+                                 param_name + '.json'))
+    if args.tstop is not None:
+        params['tstop'] = args.tstop
+    sim_default = simulate(params, {'secondorder': 0})
+    sim_fast = simulate(params, fast_profile, d_lambda=args.d_lambda)
+    lines.append(row % ((param_name, 'fast', sim_fast[2],
+                         sim_default[2] / sim_fast[2]) +
+                        compare(sim_fast, sim_default)))
+    if args.reference:
+        sim_ref = simulate(params, {'dt': params['dt'] / 10.,
+                                    'secondorder': 0})
+        for name, sim in (('default', sim_default), ('fast', sim_fast)):
+            lines.append(row % ((param_name, name + '/ref', sim[2],
+                                 sim_ref[2] / sim[2]) +
+                                compare(sim, sim_ref)))
+
+print('\nSpeedups and differences of the fast profile (d_lambda=%s) against '
+      'the default integration (fast) and of both against the reference '
+      '(*/ref), the RMSE is relative to the peak of the dipole'
+      % args.d_lambda)
+print(header)
+print('\n'.join(lines))
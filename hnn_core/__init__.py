@@ -1,7 +1,10 @@
-from .dipole import simulate_dipole, read_dipole, average_dipoles
+from .dipole import (simulate_dipole, simulate_branches, simulate_sweep,
+                     read_dipole, average_dipoles)
 from .feed import feed_event_times
 from .params import Params, read_params
 from .network import Network, CellResponse, read_spikes
-from .pyramidal import L2Pyr, L5Pyr
+from .run_control import RunControl
+from .extracellular import ExtracellularArray
+from .pyramidal import L2Pyr, L5Pyr, L2PyrReduced, L5PyrReduced
 from .basket import L2Basket, L5Basket
 from .parallel_backends import MPIBackend, JoblibBackend
\ No newline at end of file
@@ -12,6 +12,14 @@ from neuron import h, nrn
 # Units for gbar: S/cm^2
 
 
+def _set_weight_and_delay(nc, nc_dict, distance):
+    """Set the weight and delay of a NetCon from nc_dict, they decay and
+    grow with the distance between the cells over a length of lamtha."""
+    decay = np.exp(-(distance**2) / (nc_dict['lamtha']**2))
+    nc.weight[0] = nc_dict['A_weight'] * decay
+    nc.delay = nc_dict['A_delay'] / decay
+
+
 class _ArtificialCell:
     """The ArtificialCell class for initializing a NEURON feed source.
 
@@ -71,6 +79,65 @@ class _ArtificialCell:
             raise RuntimeError('Global ID for this cell already assigned!')
 
 
+class _NetStimCell(_ArtificialCell):
+    """A feed source whose Poisson events are generated by NEURON.
+
+    Parameters
+    ----------
+    rate : float
+        The rate (in Hz) of the events, there are no events if 0.
+    tstart : float
+        The start time (in ms) of the events.
+    tstop : float
+        The end time (in ms) of the events.
+    seeds : tuple of int
+        The three identifiers of the Random123 stream of the events.
+    threshold : float
+        Membrane potential threshold that demarks a spike.
+    gid : int or None (optional)
+        Each cell in a network is uniquely identified by it's "global ID": GID.
+
+    Attributes
+    ----------
+    nrn_netstim : instance of h.NetStim()
+        NEURON h.NetStim() object that generates the events.
+    nrn_netcon : instance of h.NetCon()
+        NEURON h.NetCon() object that creates the spike
+        source-to-target references for nrn_netstim.
+    tstop : float
+        The end time (in ms) of the events.
+    gid : int
+        GID of the cell in a network (or None if not yet assigned)
+    """
+    def __init__(self, rate, tstart, tstop, seeds, threshold, gid=None):
+        self.nrn_netstim = h.NetStim()
+        self.nrn_netstim.start = tstart
+        self.nrn_netstim.noise = 1
+        self.nrn_netstim.number = 0
+        if rate > 0:
+            self.nrn_netstim.interval = 1000. / rate
+            self.nrn_netstim.number = 1e9
+        # the stream starts over at each h.finitialize()
+        self.nrn_netstim.noiseFromRandom123(*seeds)
+        self.tstop = tstop
+
+        # a NetStim stops when it receives an event with a negative weight
+        self._nrn_stop_netcon = h.NetCon(None, self.nrn_netstim)
+        self._nrn_stop_netcon.weight[0] = -1
+
+        self.nrn_netcon = h.NetCon(self.nrn_netstim, None)
+        self.nrn_netcon.threshold = threshold
+
+        self._gid = None
+        if gid is not None:
+            self.gid = gid
+
+    def queue_stop(self):
+        """Stop the events at tstop, call after h.finitialize()."""
+        if self.tstop < h.tstop:
+            self._nrn_stop_netcon.event(self.tstop)
+
+
 class _Cell(ABC):
     """Create a cell object.
 
@@ -158,26 +225,31 @@ class _Cell(ABC):
         self.soma.Ra = soma_props['Ra']
         self.soma.cm = soma_props['cm']
 
-    def move_to_pos(self):
-        """Move cell to position."""
-        x0 = self.soma.x3d(0)
-        y0 = self.soma.y3d(0)
-        z0 = self.soma.z3d(0)
-        dx = self.pos[0] * 100 - x0
-        dy = self.pos[2] - y0
-        dz = self.pos[1] * 100 - z0
+    def _get_offset(self, pt0):
+        """Get the translation of the 3D points to the position of the cell.
+
+        Parameters
+        ----------
+        pt0 : tuple of float
+            The first 3D point (x, y, z) of the soma before the translation.
 
-        for s in self.get_sections():
-            for i in range(s.n3d()):
-                h.pt3dchange(i, s.x3d(i) + dx, s.y3d(i) + dy,
-                             s.z3d(i) + dz, s.diam3d(i), sec=s)
+        Returns
+        -------
+        offset : tuple of float
+            The translation (dx, dy, dz) of the 3D points, zero if the cell
+            has no position.
+        """
+        if self.pos is None:
+            return (0., 0., 0.)
+        return (self.pos[0] * 100 - pt0[0], self.pos[2] - pt0[1],
+                self.pos[1] * 100 - pt0[2])
 
     # two things need to happen here for h:
     # 1. dipole needs to be inserted into each section
     # 2. a list needs to be created with a Dipole (Point Process) in each
     #    section at position 1
     # In Cell() and not Pyr() for future possibilities
-    def insert_dipole(self, yscale):
+    def insert_dipole(self, yscale, method='mechanism'):
         """Insert dipole into each section of this cell.
 
         Parameters
@@ -185,7 +257,21 @@ class _Cell(ABC):
         yscale : dict
             Dictionary of length scales to calculate dipole without
             3d shape.
+        method : 'mechanism' | 'imem'
+            If 'mechanism', the dipole is summed from the axial currents of
+            each segment by the dipole mechanisms during the simulation. If
+            'imem', no mechanisms are inserted and only the position of each
+            segment along the dipole axis is stored. The dipole is then
+            computed from the membrane currents by NetworkBuilder.
         """
+        if method == 'imem':
+            self._set_dipole_axis(yscale)
+            self.dipole = h.Vector()
+            return
+        elif method != 'mechanism':
+            raise ValueError("method must be 'mechanism' or 'imem', got %s"
+                             % method)
+
         self.dpl_vec = h.Vector(1)
         self.dpl_ref = self.dpl_vec._ref_x[0]
 
@@ -218,23 +304,49 @@ class _Cell(ABC):
             # doing range to index multiple values of the same
             # np.array simultaneously
             for idx, pos in enumerate(pos_all[1:-1]):
+                dipole = sect(pos).dipole
                 # assign the ri value to the dipole
                 # ri not defined at 0 and L
-                sect(pos).dipole.ri = h.ri(pos, sec=sect)
+                dipole.ri = h.ri(pos, sec=sect)
                 # range variable 'dipole'
                 # set pointers to previous segment's voltage, with
                 # boundary condition
-                sect(pos).dipole._ref_pv = sect(pos_all[idx])._ref_v
+                dipole._ref_pv = sect(pos_all[idx])._ref_v
 
                 # set aggregate pointers
-                sect(pos).dipole._ref_Qsum = dpp._ref_Qsum
-                sect(pos).dipole._ref_Qtotal = self.dpl_ref
+                dipole._ref_Qsum = dpp._ref_Qsum
+                dipole._ref_Qtotal = self.dpl_ref
                 # add ztan values
-                sect(pos).dipole.ztan = y_diff[idx]
+                dipole.ztan = y_diff[idx]
             # set the pp dipole's ztan value to the last value from y_diff
             dpp.ztan = y_diff[-1]
         self.dipole = h.Vector().record(self.dpl_ref)
 
+    def _set_dipole_axis(self, yscale):
+        """Store where each section lies along the dipole axis.
+
+        The dipole mechanisms integrate the axial currents along each
+        section scaled by yscale. The same dipole is the sum of the membrane
+        currents of the segments times their position along the axis, with
+        sections starting where they connect to their parent.
+        """
+        self._dipole_axis = dict()
+        sec_list = h.SectionList()
+        sec_list.wholetree(sec=self.soma)
+        # wholetree lists parents before their children
+        for sect in sec_list:
+            sect_name = sect.name().split('_', 1)[1]
+            parent_seg = sect.parentseg()
+            z0 = 0.
+            if parent_seg is not None:
+                z0 = self._get_dipole_z(parent_seg)
+            self._dipole_axis[sect.name()] = (z0, yscale[sect_name] * sect.L)
+
+    def _get_dipole_z(self, seg):
+        """Get the position (in um) of a segment along the dipole axis."""
+        z0, z_len = self._dipole_axis[seg.sec.name()]
+        return z0 + z_len * seg.x
+
     def create_tonic_bias(self, amplitude, t0, T, loc=0.5):
         """Create tonic bias at the soma.
 
@@ -255,7 +367,8 @@ class _Cell(ABC):
         stim.amp = amplitude
         self.tonic_biases.append(stim)
 
-    def record_soma(self, record_vsoma=False, record_isoma=False):
+    def record_soma(self, record_vsoma=False, record_isoma=False,
+                    record_dt=None):
         """Record current and voltage at soma.
 
         Parameters
@@ -264,8 +377,13 @@ class _Cell(ABC):
             Option to record somatic voltages from cells
         record_isoma : bool
             Option to record somatic currents from cells
-
+        record_dt : float | None
+            The sampling interval (in ms) of the recordings. If None,
+            record at every time step.
         """
+        # h.Vector.record() only samples at intervals of Dt if one is given
+        record_args = tuple() if record_dt is None else (record_dt,)
+
         # a soma exists at self.soma
         if record_isoma:
             # assumes that self.synapses is a dict that exists
@@ -276,10 +394,14 @@ class _Cell(ABC):
             # iterate through keys and record currents appropriately
             for key in self.rec_i:
                 self.rec_i[key] = h.Vector()
-                self.rec_i[key].record(self.synapses[key]._ref_i)
+                self.rec_i[key].record(self.synapses[key]._ref_i,
+                                       *record_args, sec=self.soma)
 
+        # the section tells the local variable time step method which cell
+        # the recordings follow
         if record_vsoma:
-            self.rec_v.record(self.soma(0.5)._ref_v)
+            self.rec_v.record(self.soma(0.5)._ref_v, *record_args,
+                              sec=self.soma)
 
     def syn_create(self, secloc, e, tau1, tau2):
         """Create an h.Exp2Syn synapse.
@@ -347,10 +469,7 @@ class _Cell(ABC):
         d = self._pardistance(nc_dict['pos_src'])
         # set props here
         nc.threshold = nc_dict['threshold']
-        nc.weight[0] = nc_dict['A_weight'] * \
-            np.exp(-(d**2) / (nc_dict['lamtha']**2))
-        nc.delay = nc_dict['A_delay'] / \
-            (np.exp(-(d**2) / (nc_dict['lamtha']**2)))
+        _set_weight_and_delay(nc, nc_dict, d)
 
         return nc
 
@@ -370,5 +489,6 @@ class _Cell(ABC):
         h.pt3dclear(sec=self.soma)
         # h.ptdadd(x, y, z, diam) -- if this function is run, clobbers
         # self.soma.diam set above
-        h.pt3dadd(0, 0, 0, self.diam, sec=self.soma)
-        h.pt3dadd(0, self.L, 0, self.diam, sec=self.soma)
+        dx, dy, dz = self._get_offset((0, 0, 0))
+        h.pt3dadd(dx, dy, dz, self.diam, sec=self.soma)
+        h.pt3dadd(dx, self.L + dy, dz, self.diam, sec=self.soma)
@@ -3,10 +3,18 @@
 # Authors: Mainak Jas <mainak.jas@telecom-paristech.fr>
 #          Sam Neymotin <samnemo@gmail.com>
 
+import os
+import os.path as op
 import warnings
+from copy import deepcopy
+from fnmatch import fnmatch
+from itertools import product
 import numpy as np
 from numpy import convolve, hamming
 
+from .network import Network, _get_record_gids
+from .network_builder import _CONNECTION_PARAMS, _DEFAULT_OPTIONS
+from .run_control import RunControl
 from .viz import plot_dipole
 
 
@@ -17,8 +25,17 @@ def _hammfilt(x, winsz):
     return convolve(x, win, 'same')
 
 
+def _check_chunk_interval(interval, name, sampling_interval):
+    """Check that the recordings are sampled at the end of each chunk."""
+    n_steps = interval / sampling_interval
+    if n_steps < 1 or not np.isclose(n_steps, round(n_steps)):
+        raise ValueError("%s must be an integer multiple of the sampling "
+                         "interval of the recordings (%s ms), got %s"
+                         % (name, sampling_interval, interval))
+
+
 def simulate_dipole(net, n_trials=None, record_vsoma=False,
-                    record_isoma=False, postproc=True):
+                    record_isoma=False, postproc=True, **options):
     """Simulate a dipole given the experiment parameters.
 
     Parameters
@@ -35,17 +52,188 @@ def simulate_dipole(net, n_trials=None, record_vsoma=False,
         Option to record somatic currents from cells
     postproc : bool
         If False, no postprocessing applied to the dipole
+    **options : dict
+        The options of the simulation that are not parameters of the
+        network, see Other Parameters. The options that are not passed
+        take their defaults.
 
     Returns
     -------
     dpls: list
-        List of dipole objects for each trials
+        List of dipole objects for each trials, empty if record_dipole is
+        False.
+
+    Other Parameters
+    ----------------
+    record_gids : None | str | list of str | list of int | dict, default None
+        The cells whose somatic voltages and currents are recorded (if
+        record_vsoma or record_isoma is True). If None, all cells are
+        recorded. A cell type (e.g., 'L5_pyramidal') or a list of cell types
+        selects all cells of those types, while a list of int selects
+        individual gids. A dict with cell types as keys and int values
+        (e.g., {'L5_pyramidal': 10}) selects a reproducible random sample of
+        that many cells from each cell type.
+    record_dt : float | None, default None
+        The sampling interval (in ms) of the somatic recordings. Must be an
+        integer multiple of net.params['dt']. If None, the recordings are
+        sampled at every time step.
+    record_cell_dipoles : bool, default False
+        Option to record the dipole of each pyramidal cell. The dipoles are
+        stored in net.cell_response.cell_dipoles.
+    dipole_method : 'mechanism' | 'imem', default 'mechanism'
+        How the dipoles are computed. If 'mechanism', the dipole mechanisms
+        inserted in every section sum the axial currents at each time step.
+        If 'imem', the membrane currents of all segments (NEURON's fast
+        i_membrane_) are gathered after each time step and projected onto
+        the dipoles by a sparse matrix computed once. Both give the same
+        dipoles up to round-off. 'imem' saves the mechanisms and point
+        processes of every section: the bundled parameter files simulate
+        1.3 to 1.5 times faster with it (see
+        benchmarks/bench_dipole_method.py). It is also the method of the
+        extracellular arrays, which project the same currents.
+    warmup : float | None, default None
+        The duration (in ms) of a simulation of the network without its
+        external drives that is run before the trials. Each trial starts from
+        the state at the end of the warm-up instead of the initial membrane
+        potentials, so the cells no longer drift towards their resting state
+        during the trial, and the post-processing of the dipoles only
+        subtracts the constant offset of the L5 dipole at the end of the
+        warm-up (see Dipole.baseline_renormalize). The cells of the bundled
+        networks take about 1000 ms to settle. If None, there is no warm-up.
+    warmup_dir : str | None, default None
+        The directory where the warm-up states are cached, to be reused by
+        later trials and simulations of the same network with the same
+        mechanisms and version of NEURON. If None, the warm-up is simulated
+        for each trial and not cached.
+    run_control : RunControl | None, default None
+        How the trials are run in chunks: saving their state to resume a
+        killed simulation, streaming their recordings to the disk or
+        stopping them early (see RunControl). If None, the solver runs each
+        trial at once, unless the recordings of the variable time step
+        solvers are emptied every 10 ms.
+    solver : 'fixed' | 'cvode' | 'lvardt', default 'fixed'
+        The integration method. If 'fixed', the network is integrated with
+        the fixed time step net.params['dt']. If 'cvode', NEURON's variable
+        time step method adapts a single time step for the whole network,
+        while 'lvardt' adapts a separate time step for each cell. The
+        variable time steps are large when the cells are at rest, which
+        speeds up networks with sparse activity. The dipoles and somatic
+        recordings are sampled at every variable step and linearly
+        interpolated at the times of the fixed time step, or of record_dt,
+        so that the results have the same shape for all solvers. Requires
+        dipole_method='mechanism' and no extracellular arrays, and cannot
+        be combined with the checkpoints, streaming or stop criteria of
+        run_control.
+    cvode_atol : float, default 1e-3
+        The absolute error tolerance of the variable time step methods.
+    cvode_rtol : float, default 0.
+        The relative error tolerance of the variable time step methods.
+    d_lambda : float | None, default None
+        If not None, the number of segments of the dendrites of the
+        pyramidal cells follows the d_lambda rule: no segment is longer than
+        d_lambda times the AC length constant of its dendrite at
+        d_lambda_freq (0.1 is common). If None, the dendrites longer than
+        100 um have one segment per 50 um, or d_lambda is 1. with
+        pyramidal_model='reduced'. Fewer segments make each time step
+        cheaper.
+    d_lambda_freq : float, default 100.
+        The frequency (in Hz) of the length constant of the d_lambda rule.
+    pyramidal_model : 'full' | 'reduced', default 'full'
+        If 'full', the pyramidal cells are L2Pyr and L5Pyr. If 'reduced',
+        they are L2PyrReduced and L5PyrReduced, whose dendritic trees are
+        collapsed and which have 5 and 10 segments instead of 32 and 55
+        (with d_lambda=None). They trade fidelity for speed: the time steps
+        are about 3 to 5 times faster, the RMSE of the dipoles is 8 to 18%
+        of their peak and the numbers of spikes of the pyramidal cells
+        differ by up to 30% (see L2PyrReduced). The build of the network is
+        not faster.
+    record_dipole : bool, default True
+        If False, only the spikes and somatic recordings are simulated: the
+        pyramidal cells get no dipole mechanisms, point processes or
+        recordings, which makes both the build and each time step cheaper,
+        and no Dipole is returned. The stop criteria of run_control then
+        get None as their Dipole. Cannot be combined with
+        record_cell_dipoles or dipole_method='imem'.
+    record_drive_spikes : bool, default True
+        If False, only the spikes of the cells are recorded and gathered,
+        not the spikes of the drives, which are their event times. This
+        reduces the spikes communicated between processes and stored in
+        net.cell_response. The spikes of the drives can be added later with
+        net.cell_response.add_drive_spikes(). The stop criteria of
+        run_control only get the spikes of the cells.
+    drive_method : 'vecstim' | 'patternstim', default 'vecstim'
+        How the events of the drives reach the cells. If 'vecstim', each
+        drive cell is an artificial cell with its own VecStim, NetCon and
+        gid on the process of its targets. If 'patternstim', the drive cells
+        are not created: a single PatternStim on each process delivers the
+        events of all the drive cells that target its cells, which saves the
+        objects and gids of thousands of drive cells in networks with many
+        drives. The spikes of the drives are then added from their events.
+        Both give the same results. The drives whose events are generated by
+        NEURON (event_generator='netstim') are always artificial cells.
+    ensemble_size : int, default 1
+        The number of trials that are simulated together in one NEURON
+        model. The trials of a batch are disconnected replicas of the
+        network, with their own gids and drive events, that are built at
+        once and integrated by a single run of the solver, which saves the
+        fixed costs of building, initializing and stepping each trial for
+        small networks. Each job or set of MPI processes simulates one batch
+        at a time. The results are identical to those of trials simulated
+        one by one. Cannot be combined with the checkpoints, streaming or
+        stop criteria of run_control, with branches, extracellular arrays or
+        solver='cvode', whose single time step would follow the activity of
+        all the replicas.
+
+    Notes
+    -----
+    With net.params['secondorder'] = 2, the fixed time steps are integrated
+    with Crank-Nicolson. Its dipoles are returned as integrated: they
+    oscillate with a period of two time steps after each change of the
+    inputs, which the smoothing window of the post-processing
+    (net.params['dipole_smooth_win']) removes. With twice the time step
+    of backward Euler (dt=0.05), the bundled parameter files simulate 1.3
+    to 1.8 times faster, the RMSE of the dipoles as integrated is 13 to 28%
+    of their peak and 2 to 10% after smoothing (see
+    benchmarks/validate_fast_profile.py).
     """
 
+    n_trials, options = _get_sim_options(net, n_trials, record_vsoma,
+                                         record_isoma, **options)
+    dpls = _get_backend().simulate(net, n_trials, postproc, options)
+
+    return dpls
+
+
+def _get_backend():
+    """Get the active backend, a JoblibBackend with one job by default."""
     from .parallel_backends import _BACKEND, JoblibBackend
 
     if _BACKEND is None:
         _BACKEND = JoblibBackend(n_jobs=1)
+    return _BACKEND
+
+
+def _get_sim_options(net, n_trials=None, record_vsoma=False,
+                     record_isoma=False, **kwargs):
+    """Check the arguments of simulate_dipole and instantiate the drives.
+
+    The somatic recordings are parameters of the network and are set in
+    net.params, the other arguments are options of this simulation only,
+    whose defaults are those of _DEFAULT_OPTIONS.
+
+    Returns
+    -------
+    n_trials : int
+        The number of trials to simulate.
+    options : dict
+        The options of the simulation that are passed to NetworkBuilder.
+    """
+    for key in kwargs:
+        # the branches and sweeps are set by their own functions
+        if key not in _DEFAULT_OPTIONS or key in ('branches', 'sweep'):
+            raise TypeError("simulate_dipole() got an unexpected keyword "
+                            "argument %r" % (key,))
+    options = dict(_DEFAULT_OPTIONS, **kwargs)
 
     if n_trials is None:
         n_trials = net.params['N_trials']
@@ -68,9 +256,609 @@ def simulate_dipole(net, n_trials=None, record_vsoma=False,
         raise TypeError("record_isoma must be bool, got %s"
                         % type(record_isoma).__name__)
 
-    dpls = _BACKEND.simulate(net, n_trials, postproc)
+    for key in ('record_cell_dipoles', 'record_dipole',
+                'record_drive_spikes'):
+        if not isinstance(options[key], bool):
+            raise TypeError("%s must be bool, got %s"
+                            % (key, type(options[key]).__name__))
 
-    return dpls
+    dipole_method = options['dipole_method']
+    if dipole_method not in ('mechanism', 'imem'):
+        raise ValueError("dipole_method must be 'mechanism' or 'imem', got "
+                         "%s" % (dipole_method,))
+    if not options['record_dipole'] and (options['record_cell_dipoles'] or
+                                         dipole_method != 'mechanism'):
+        raise ValueError("record_dipole=False cannot be combined with "
+                         "record_cell_dipoles=True or dipole_method='imem'")
+
+    if options['drive_method'] not in ('vecstim', 'patternstim'):
+        raise ValueError("drive_method must be 'vecstim' or 'patternstim', "
+                         "got %s" % (options['drive_method'],))
+
+    run_control = options['run_control']
+    if run_control is None:
+        run_control = RunControl()
+    elif not isinstance(run_control, RunControl):
+        raise TypeError("run_control must be RunControl or None, got %s"
+                        % type(run_control).__name__)
+    # the chunks of a plain run only print the progress
+    chunked = len(run_control._get_intervals()) > 0
+
+    # the events of these drives only exist in NEURON
+    warmup = options['warmup']
+    netstim_drives = [name for name, drive in net.external_drives.items()
+                      if drive.get('event_generator') == 'netstim']
+    if netstim_drives and (not options['record_drive_spikes'] or
+                           warmup is not None or
+                           run_control.checkpoint_dir is not None):
+        raise ValueError("The drives with event_generator='netstim' (%s) "
+                         "cannot be combined with record_drive_spikes=False, "
+                         "warmup or the checkpoints of run_control"
+                         % ', '.join(netstim_drives))
+
+    if warmup is not None:
+        if not isinstance(warmup, (int, float)):
+            raise TypeError("warmup must be float or None, got %s"
+                            % type(warmup).__name__)
+        if warmup <= 0:
+            raise ValueError("warmup must be positive, got %s" % warmup)
+    warmup_dir = options['warmup_dir']
+    if warmup_dir is not None and not isinstance(warmup_dir, str):
+        raise TypeError("warmup_dir must be str or None, got %s"
+                        % type(warmup_dir).__name__)
+
+    options['record_gids'] = _get_record_gids(options['record_gids'],
+                                              net.gid_ranges,
+                                              net.cellname_list)
+
+    soma_decim = 1
+    record_dt = options['record_dt']
+    if record_dt is not None:
+        if not isinstance(record_dt, (int, float)):
+            raise TypeError("record_dt must be float or None, got %s"
+                            % type(record_dt).__name__)
+        soma_decim = record_dt / net.params['dt']
+        if soma_decim < 1 or not np.isclose(soma_decim, round(soma_decim)):
+            raise ValueError("record_dt must be an integer multiple of the "
+                             "simulation time step (%s ms), got %s"
+                             % (net.params['dt'], record_dt))
+        soma_decim = int(round(soma_decim))
+    net.cell_response._soma_times = net.cell_response.times[::soma_decim]
+
+    if run_control.checkpoint_dir is not None:
+        _check_chunk_interval(run_control.checkpoint_interval,
+                              'checkpoint_interval',
+                              soma_decim * net.params['dt'])
+    if run_control.stream_dir is not None:
+        _check_chunk_interval(run_control.stream_interval, 'stream_interval',
+                              soma_decim * net.params['dt'])
+        if dipole_method != 'mechanism' or net.rec_arrays:
+            raise ValueError("stream_dir requires dipole_method='mechanism' "
+                             "and no extracellular arrays")
+
+    solver = options['solver']
+    if solver not in ('fixed', 'cvode', 'lvardt'):
+        raise ValueError("solver must be 'fixed', 'cvode' or 'lvardt', got "
+                         "%s" % (solver,))
+    for name in ('cvode_atol', 'cvode_rtol'):
+        tol = options[name]
+        if not isinstance(tol, (int, float)):
+            raise TypeError("%s must be float, got %s"
+                            % (name, type(tol).__name__))
+        if tol < 0:
+            raise ValueError("%s must be non-negative, got %s" % (name, tol))
+    if options['cvode_atol'] == 0 and options['cvode_rtol'] == 0:
+        raise ValueError("cvode_atol and cvode_rtol cannot both be zero")
+    if solver != 'fixed':
+        if dipole_method != 'mechanism' or net.rec_arrays:
+            raise ValueError("solver=%r requires dipole_method='mechanism' "
+                             "and no extracellular arrays" % solver)
+        if chunked:
+            raise ValueError("solver=%r cannot be combined with the "
+                             "checkpoints, streaming or stop criteria of "
+                             "run_control" % solver)
+
+    for name in ('d_lambda', 'd_lambda_freq'):
+        value = options[name]
+        if value is None and name == 'd_lambda':
+            continue
+        if not isinstance(value, (int, float)):
+            raise TypeError("%s must be float, got %s"
+                            % (name, type(value).__name__))
+        if value <= 0:
+            raise ValueError("%s must be positive, got %s" % (name, value))
+
+    if options['pyramidal_model'] not in ('full', 'reduced'):
+        raise ValueError("pyramidal_model must be 'full' or 'reduced', got "
+                         "%s" % (options['pyramidal_model'],))
+
+    ensemble_size = options['ensemble_size']
+    if not isinstance(ensemble_size, (int, np.integer)):
+        raise TypeError("ensemble_size must be int, got %s"
+                        % type(ensemble_size).__name__)
+    if ensemble_size < 1:
+        raise ValueError("ensemble_size must be positive, got %s"
+                         % ensemble_size)
+    if ensemble_size > 1 and (chunked or net.rec_arrays or
+                              solver == 'cvode'):
+        raise ValueError("ensemble_size > 1 cannot be combined with the "
+                         "checkpoints, streaming or stop criteria of "
+                         "run_control, extracellular arrays or "
+                         "solver='cvode'")
+    options['ensemble_size'] = int(ensemble_size)
+
+    # the variable time step solvers have their own order
+    secondorder = net.params.get('secondorder', 0)
+    if secondorder not in (0, 1, 2):
+        raise ValueError("params['secondorder'] must be 0, 1 or 2, got %s"
+                         % (secondorder,))
+    if secondorder and solver != 'fixed':
+        raise ValueError("params['secondorder']=%d requires solver='fixed'"
+                         % secondorder)
+
+    return n_trials, options
+
+
+def simulate_branches(net, branches, n_trials=None, postproc=True,
+                      **kwargs):
+    """Simulate variants of a network that differ in the timing of drives.
+
+    The variants (branches) share the simulation of the network up to the
+    first event of the drives that differ between them. This shared prefix
+    is simulated once, then each branch continues from its saved state. For
+    drives that start late in the trial, this saves most of the simulation
+    time of each branch.
+
+    Parameters
+    ----------
+    net : Network object
+        The Network object specifying how cells are connected.
+    branches : list of dict
+        The changes to the drive dynamics in each branch, e.g.
+        ``[{'evprox2': {'mu': 120.}}, {'evprox2': {'mu': 140.}}]``. The keys
+        of each dict are drive names and the values dicts of the new values
+        of the drive dynamics. The shared prefix ends at the first event of
+        the drives changed in any branch.
+    n_trials : int | None
+        The number of trials to simulate. If None, the value in
+        net.params['N_trials'] is used (must be >0)
+    postproc : bool
+        If False, no postprocessing applied to the dipole
+    **kwargs : dict
+        Further arguments passed to simulate_dipole.
+
+    Returns
+    -------
+    branch_nets : list of Network
+        The copy of net with the drive dynamics of each branch. The spiking
+        of each branch is stored in its cell_response.
+    dpls : list of list
+        List of dipole objects for each trial of each branch.
+    """
+    if not isinstance(branches, list):
+        raise TypeError("branches must be list of dict, got %s"
+                        % type(branches).__name__)
+    if len(branches) == 0:
+        raise ValueError("branches must contain at least one branch")
+    for branch in branches:
+        if not isinstance(branch, dict):
+            raise TypeError("branches must be list of dict, got list of %s"
+                            % type(branch).__name__)
+        for drive_name, dynamics in branch.items():
+            if drive_name not in net.external_drives:
+                raise ValueError("Unknown drive %s in branches, got %s"
+                                 % (drive_name,
+                                    list(net.external_drives.keys())))
+            drive_dynamics = net.external_drives[drive_name]['dynamics']
+            for key in dynamics:
+                if key not in drive_dynamics:
+                    raise ValueError("Unknown dynamics %s of drive %s, "
+                                     "got %s" % (key, drive_name,
+                                                 list(drive_dynamics.keys())))
+
+    if any(drive.get('event_generator') == 'netstim'
+           for drive in net.external_drives.values()):
+        raise ValueError("The drives with event_generator='netstim' are not "
+                         "supported with branches")
+
+    n_trials, options = _get_sim_options(net, n_trials, **kwargs)
+    run_control = options['run_control']
+    if run_control is not None and run_control._get_intervals():
+        raise ValueError("The checkpoints, streaming and stop criteria of "
+                         "run_control are not supported with branches")
+    for key, default in (('solver', 'fixed'), ('ensemble_size', 1)):
+        if options[key] != default:
+            raise ValueError("%s=%r is not supported with branches"
+                             % (key, options[key]))
+
+    # every branch instantiates the events of all the drives that change in
+    # any branch, the other drives are identical by their seeds
+    drive_names = sorted(set(name for branch in branches for name in branch))
+    branch_nets = list()
+    for branch in branches:
+        branch_net = net.copy()
+        for drive_name, dynamics in branch.items():
+            branch_net.external_drives[drive_name]['dynamics'].update(
+                dynamics)
+        branch_net._instantiate_drives(n_trials=n_trials)
+        branch_nets.append(branch_net)
+
+    options['branches'] = [
+        {drive_name: branch_net.external_drives[drive_name]['events']
+         for drive_name in drive_names} for branch_net in branch_nets]
+    branch_data = _get_backend().simulate(net, n_trials, postproc, options)
+
+    from .parallel_backends import _gather_trial_data
+
+    del options['branches']
+    dpls = list()
+    for branch_net, sim_data in zip(branch_nets, branch_data):
+        branch_net.params = deepcopy(net.params)
+        branch_net.cell_response._soma_times = net.cell_response._soma_times
+        dpls.append(_gather_trial_data(sim_data, branch_net, n_trials,
+                                       postproc, options))
+    return branch_nets, dpls
+
+
+# the parameters of the network whose change requires a new Network,
+# every other parameter is read when the network is built in NEURON
+_SWEEP_GRID_PARAMS = ('N_pyr_x', 'N_pyr_y')
+# the parameters that can be swept, the others (e.g., those of the cells or
+# of the drives) are only read when the Network and its drives are created
+_SWEEP_PARAMS = _SWEEP_GRID_PARAMS + _CONNECTION_PARAMS + (
+    '*_v_init', 'celsius', 'threshold', 'secondorder', 'dipole_scalefctr',
+    'dipole_smooth_win')
+# the parameters of the pyramidal cells and of their synapses, the cells are
+# built from their default parameters rather than from those of the Network
+_SWEEP_CELL_PARAMS = ('L2Pyr_*', 'L5Pyr_*')
+
+
+def _get_sweep_candidates(net, overrides):
+    """Get the list of overrides of each candidate of a sweep."""
+    if isinstance(overrides, dict):
+        for values in overrides.values():
+            if not isinstance(values, list):
+                raise TypeError("overrides must be dict of list or list of "
+                                "dict, got dict of %s"
+                                % type(values).__name__)
+        candidates = [dict(zip(overrides.keys(), values))
+                      for values in product(*overrides.values())]
+    elif isinstance(overrides, list):
+        for candidate in overrides:
+            if not isinstance(candidate, dict):
+                raise TypeError("overrides must be dict of list or list of "
+                                "dict, got list of %s"
+                                % type(candidate).__name__)
+        candidates = [dict(candidate) for candidate in overrides]
+    else:
+        raise TypeError("overrides must be dict of list or list of dict, "
+                        "got %s" % type(overrides).__name__)
+    if len(candidates) == 0:
+        raise ValueError("overrides must contain at least one candidate")
+
+    for candidate in candidates:
+        for key, value in candidate.items():
+            if key in net.external_drives:
+                if not isinstance(value, dict):
+                    raise TypeError("The overrides of drive %s must be dict, "
+                                    "got %s" % (key, type(value).__name__))
+                drive_keys = (list(net.external_drives[key]['dynamics']) +
+                              ['seedcore'])
+                for drive_key in value:
+                    if drive_key not in drive_keys:
+                        raise ValueError("Unknown dynamics %s of drive %s, "
+                                         "got %s" % (drive_key, key,
+                                                     drive_keys))
+            elif key in ('tstop', 'dt'):
+                raise ValueError("%s cannot be swept, all the candidates "
+                                 "share the times of their recordings" % key)
+            elif key not in net.params:
+                raise ValueError("Unknown parameter or drive %s in overrides"
+                                 % key)
+            elif any(fnmatch(key, pattern) for pattern in _SWEEP_PARAMS):
+                continue
+            elif (any(fnmatch(key, pattern) for pattern in
+                      _SWEEP_CELL_PARAMS) and '_Pois_' not in key):
+                raise ValueError("%s cannot be swept, the cells are built "
+                                 "from their default parameters rather than "
+                                 "from those of the Network" % key)
+            else:
+                raise ValueError("%s cannot be swept, it is only read when "
+                                 "the Network and its drives are created, "
+                                 "override the drives by name instead" % key)
+    return candidates
+
+
+def _get_sweep_columns(net, candidates):
+    """Get the value of each override in each candidate of a sweep.
+
+    The overrides of a drive are stored in the columns '<drive>.<key>'.
+    Candidates that do not override a value get the one of net.
+    """
+    columns = dict()
+    for candidate in candidates:
+        for key, value in candidate.items():
+            if key in net.external_drives:
+                for drive_key in value:
+                    columns['%s.%s' % (key, drive_key)] = (key, drive_key)
+            else:
+                columns[key] = (key, None)
+
+    values = dict()
+    for column, (key, drive_key) in columns.items():
+        if drive_key is None:
+            values[column] = [candidate.get(key, net.params[key])
+                              for candidate in candidates]
+            continue
+        drive = net.external_drives[key]
+        default = (drive['seedcore'] if drive_key == 'seedcore' else
+                   drive['dynamics'][drive_key])
+        values[column] = [candidate.get(key, dict()).get(drive_key, default)
+                          for candidate in candidates]
+    return values
+
+
+def _rebuild_network(net, params):
+    """Make a new Network from params with the drives, biases and
+    extracellular arrays of net."""
+    new_net = Network(params, legacy_mode=net._legacy_mode)
+    for name, drive in net.external_drives.items():
+        new_drive = deepcopy(drive)
+        new_drive['events'] = list()
+        new_net._attach_drive(name, new_drive,
+                              **deepcopy(drive['attach_args']))
+    new_net.external_biases = deepcopy(net.external_biases)
+    for name, rec_array in net.rec_arrays.items():
+        new_net.add_electrode_array(name, rec_array.positions,
+                                    conductivity=rec_array.conductivity,
+                                    method=rec_array.method,
+                                    min_distance=rec_array.min_distance)
+    return new_net
+
+
+def _is_swept_in_place(net, key):
+    """Whether an override of a sweep is applied to the network built in
+    NEURON: the weights of the connections between cells ('gbar_*') and the
+    drives whose events are drawn in Python."""
+    if key in net.external_drives:
+        return net.external_drives[key].get('event_generator') != 'netstim'
+    return key.startswith('gbar_')
+
+
+def _get_sweep_groups(net, candidates):
+    """Group the candidates of a sweep that differ only in the overrides
+    applied in place.
+
+    The candidates of a group share the build of their network in NEURON,
+    whose connections and drives are updated for each of them.
+
+    Returns
+    -------
+    groups : list of list of tuple
+        The index of each candidate of each group, its values of the
+        'gbar_*' parameters and its overrides of the drives that differ in
+        the group.
+    """
+    groups = list()
+    for candidate_idx, candidate in enumerate(candidates):
+        shared = {key: value for key, value in candidate.items()
+                  if not _is_swept_in_place(net, key)}
+        for group_shared, group in groups:
+            if group_shared == shared:
+                group.append(candidate_idx)
+                break
+        else:
+            groups.append((shared, [candidate_idx]))
+
+    sweep_groups = list()
+    for _, group in groups:
+        keys = sorted(set(key for candidate_idx in group
+                          for key in candidates[candidate_idx]
+                          if _is_swept_in_place(net, key)))
+        sweep_groups.append([
+            (candidate_idx,
+             {key: candidates[candidate_idx].get(key, net.params[key])
+              for key in keys if key not in net.external_drives},
+             {key: candidates[candidate_idx].get(key, dict())
+              for key in keys if key in net.external_drives})
+            for candidate_idx in group])
+    return sweep_groups
+
+
+def _make_candidate_net(net, candidate, n_trials):
+    """Make the network of a candidate of a sweep with its drive events.
+
+    Only a change of the grid of pyramidal cells requires a new Network,
+    the other parameters and the drives are changed in a copy of net.
+    """
+    params = {key: value for key, value in candidate.items()
+              if key not in net.external_drives}
+    if any(key in _SWEEP_GRID_PARAMS for key in params):
+        candidate_params = net.params.copy()
+        candidate_params.update(params)
+        candidate_net = _rebuild_network(net, candidate_params)
+    else:
+        candidate_net = net.copy()
+        candidate_net.params.update(params)
+    candidate_net.cell_response._soma_times = net.cell_response._soma_times
+
+    for drive_name, drive_overrides in candidate.items():
+        if drive_name not in net.external_drives:
+            continue
+        drive = candidate_net.external_drives[drive_name]
+        for key, value in drive_overrides.items():
+            if key == 'seedcore':
+                drive['seedcore'] = value
+            else:
+                drive['dynamics'][key] = value
+    candidate_net._instantiate_drives(n_trials=n_trials)
+    return candidate_net
+
+
+def _get_sweep_nets(net, candidates, n_trials):
+    """Make the network of each group of candidates of a sweep, from the
+    overrides that the candidates of the group share.
+
+    Returns
+    -------
+    sweep_nets : list of tuple
+        The network of each group and the group, as in _get_sweep_groups.
+    """
+    sweep_nets = list()
+    for sweep_group in _get_sweep_groups(net, candidates):
+        shared = {key: value for key, value in
+                  candidates[sweep_group[0][0]].items()
+                  if not _is_swept_in_place(net, key)}
+        sweep_nets.append((_make_candidate_net(net, shared, n_trials),
+                           sweep_group))
+    return sweep_nets
+
+
+def simulate_sweep(net, overrides, n_trials=None, postproc=True,
+                   sweep_dir=None, **kwargs):
+    """Simulate the trials of variants of a network in one workload.
+
+    Each candidate of the sweep is the network with some of its parameters
+    or drives overridden. The trials of all the candidates are scheduled
+    together over the active backend, instead of one call to
+    simulate_dipole per candidate. A change of the grid of pyramidal cells
+    (``'N_pyr_x'``, ``'N_pyr_y'``) creates a new Network with the drives,
+    biases and extracellular arrays of net. The other overrides are applied
+    to a copy of net. The candidates that differ only in the weights of the
+    connections between cells (``'gbar_*'`` parameters) and in the dynamics
+    or seeds of their drives share the build of the network in NEURON, the
+    weights and the events of the drives are updated in place for each.
+    Drives whose events are generated by NEURON (``'netstim'``) are the
+    exception, a change of them builds the network again.
+
+    Parameters
+    ----------
+    net : Network object
+        The Network object specifying how cells are connected.
+    overrides : dict of list | list of dict
+        The overrides of each candidate. A dict of lists is a grid of
+        candidates with every combination of the values, e.g.,
+        ``{'N_pyr_x': [5, 10], 'evprox1': [{'mu': 20.}, {'mu': 30.}]}``,
+        while a list of dicts gives the overrides of each candidate. The
+        keys are names of drives or of the parameters read when the network
+        is built: ``'N_pyr_x'``, ``'N_pyr_y'``, the weights of the
+        connections between cells (``'gbar_L2*'``, ``'gbar_L5*'``), the
+        initial potentials (``'*_v_init'``), ``'celsius'``,
+        ``'threshold'``, ``'secondorder'``, ``'dipole_scalefctr'`` and
+        ``'dipole_smooth_win'``. The overrides of a drive are a dict of new
+        values of its dynamics or of its ``'seedcore'``. The weights of the
+        drives cannot be swept. Neither can the geometry, biophysics and
+        synapses of the pyramidal cells (``'L2Pyr_*'`` and ``'L5Pyr_*'``
+        except ``'*_v_init'``): the cells are built from their default
+        parameters, not from those of net.
+    n_trials : int | None
+        The number of trials of each candidate. If None, the value in
+        net.params['N_trials'] is used (must be >0)
+    postproc : bool
+        If False, no postprocessing applied to the dipoles
+    sweep_dir : str | None
+        The directory where the columns of the results are saved, one .npy
+        file per column. The dipoles are memory-mapped from their files. If
+        None, the results are kept in memory. Either way, the data of each
+        candidate is stored as soon as all its trials are simulated and
+        then released. With MPIBackend, the data of all the candidates is
+        received at the end of the simulation.
+    **kwargs : dict
+        Further arguments passed to simulate_dipole.
+
+    Returns
+    -------
+    sweep : dict of array
+        The results by column with one row per trial of each candidate,
+        ordered by candidate then trial. The columns are ``'candidate'``
+        and ``'trial'``, one column per overridden parameter or
+        ``'<drive>.<key>'`` with the value of each candidate,
+        ``'n_spikes.<cell_type>'`` with the number of spikes of each cell
+        type and, if the dipoles are recorded, ``'dipole.agg'``,
+        ``'dipole.L2'`` and ``'dipole.L5'`` of shape (n_rows, n_times),
+        padded with NaN after trials that stopped early.
+    """
+    candidates = _get_sweep_candidates(net, overrides)
+    if kwargs.get('record_gids') is not None and any(
+            key in _SWEEP_GRID_PARAMS for candidate in candidates
+            for key in candidate):
+        raise ValueError("record_gids cannot be combined with overrides of "
+                         "%s" % ' or '.join(_SWEEP_GRID_PARAMS))
+    if sweep_dir is not None and not isinstance(sweep_dir, str):
+        raise TypeError("sweep_dir must be str or None, got %s"
+                        % type(sweep_dir).__name__)
+
+    n_trials, options = _get_sim_options(net, n_trials, **kwargs)
+    run_control = options['run_control']
+    if run_control is not None and (run_control.checkpoint_dir is not None or
+                                    run_control.stream_dir is not None):
+        raise ValueError("The checkpoints and streaming of run_control are "
+                         "not supported with sweeps")
+    sweep_nets = _get_sweep_nets(net, candidates, n_trials)
+    candidate_nets = dict()
+    for candidate_net, sweep_group in sweep_nets:
+        for candidate_idx, _, _ in sweep_group:
+            candidate_nets[candidate_idx] = candidate_net
+    options['sweep'] = sweep_nets
+
+    from .parallel_backends import _post_proc_dipole
+
+    n_rows = len(candidates) * n_trials
+
+    def _new_column(name, values=None, shape=(), dtype=float):
+        if values is not None:
+            column = np.array(values)
+            if sweep_dir is not None:
+                np.save(op.join(sweep_dir, name + '.npy'), column)
+        elif sweep_dir is not None:
+            column = np.lib.format.open_memmap(
+                op.join(sweep_dir, name + '.npy'), mode='w+', dtype=dtype,
+                shape=(n_rows,) + shape)
+        else:
+            column = np.zeros((n_rows,) + shape, dtype=dtype)
+        return column
+
+    if sweep_dir is not None and not op.isdir(sweep_dir):
+        os.makedirs(sweep_dir)
+    sweep = dict()
+    sweep['candidate'] = _new_column(
+        'candidate', np.repeat(np.arange(len(candidates)), n_trials))
+    sweep['trial'] = _new_column('trial',
+                                 np.tile(np.arange(n_trials), len(candidates)))
+    for column, values in _get_sweep_columns(net, candidates).items():
+        sweep[column] = _new_column(column, np.repeat(values, n_trials,
+                                                      axis=0))
+    for cell_type in net.cellname_list:
+        sweep['n_spikes.%s' % cell_type] = _new_column(
+            'n_spikes.%s' % cell_type, dtype=int)
+
+    # the backend yields the data of each candidate once all its trials are
+    # simulated
+    n_times = net.cell_response.times.size
+    for candidate_idx, candidate_data in _get_backend().simulate(
+            net, n_trials, postproc, options):
+        candidate_net = candidate_nets[candidate_idx]
+        for trial_idx, (dpl, spikedata) in enumerate(candidate_data):
+            row = candidate_idx * n_trials + trial_idx
+            for cell_type in net.cellname_list:
+                sweep['n_spikes.%s' % cell_type][row] = np.count_nonzero(
+                    np.isin(spikedata[1], candidate_net.gid_ranges[cell_type]))
+            if dpl is None:
+                continue
+            if postproc:
+                _post_proc_dipole(dpl, candidate_net.params,
+                                  options['warmup'])
+            for layer in ('agg', 'L2', 'L5'):
+                name = 'dipole.%s' % layer
+                if name not in sweep:
+                    sweep[name] = _new_column(name, shape=(n_times,))
+                data = dpl.data[layer]
+                sweep[name][row, :data.size] = data
+                sweep[name][row, data.size:] = np.nan
+    for column in sweep.values():
+        if isinstance(column, np.memmap):
+            column.flush()
+    return sweep
 
 
 def read_dipole(fname, units='nAm'):
@@ -159,6 +947,9 @@ class Dipole(object):
         The dipole with keys 'agg', 'L2' and 'L5'
     nave : int
         Number of trials that were averaged to produce this Dipole
+    stopped_early : bool
+        Whether the simulation was stopped before tstop by one of the
+        stop_criteria of simulate_dipole
     """
 
     def __init__(self, times, data, nave=1):  # noqa: D102
@@ -167,9 +958,10 @@ class Dipole(object):
         self.times = times
         self.data = {'agg': data[:, 0], 'L2': data[:, 1], 'L5': data[:, 2]}
         self.nave = nave
+        self.stopped_early = False
         self.sfreq = 1000. / (times[1] - times[0])  # NB assumes len > 1
 
-    def post_proc(self, N_pyr_x, N_pyr_y, winsz, fctr):
+    def post_proc(self, N_pyr_x, N_pyr_y, winsz, fctr, warmup=None):
         """ Apply baseline, unit conversion, scaling and smoothing
 
        Parameters
@@ -182,8 +974,11 @@ class Dipole(object):
             Smoothing window
         fctr : int
             Scaling factor
+        warmup : float | None
+            The duration (in ms) of the warm-up the trial started from, if
+            any (see baseline_renormalize).
         """
-        self.baseline_renormalize(N_pyr_x, N_pyr_y)
+        self.baseline_renormalize(N_pyr_x, N_pyr_y, warmup)
         self.convert_fAm_to_nAm()
         self.scale(fctr)
         self.smooth(winsz)
@@ -235,7 +1030,7 @@ class Dipole(object):
         return plot_dipole(dpl=self, tmin=tmin, tmax=tmax, ax=ax, layer=layer,
                            decim=decim, show=show)
 
-    def baseline_renormalize(self, N_pyr_x, N_pyr_y):
+    def baseline_renormalize(self, N_pyr_x, N_pyr_y, warmup=None):
         """Only baseline renormalize if the units are fAm.
 
         Parameters
@@ -244,6 +1039,12 @@ class Dipole(object):
             Nr of cells (x)
         N_pyr_y : int
             Nr of cells (y)
+        warmup : float | None
+            The duration (in ms) of the warm-up the trial started from. If
+            None, the drift of the L5 dipole from the initial membrane
+            potentials is subtracted. Otherwise, the trial starts from the
+            state at the end of the warm-up, so only the constant offset of
+            the L5 dipole at that time is subtracted.
         """
         if self.units != 'fAm':
             print("Warning, no dipole renormalization done because units"
@@ -282,12 +1083,18 @@ class Dipole(object):
         t1 = 750.
         m1 = 1.01e-4
         b1 = -48.412078
+        # the time since the initial membrane potentials, which is the end of
+        # the warm-up for all samples of a trial that starts from it
+        if warmup is None:
+            times = self.times
+        else:
+            times = np.full_like(self.times, warmup)
         # piecewise normalization
-        self.data['L5'][self.times <= 37.] -= dpl_offset['L5']
-        self.data['L5'][(self.times > 37.) & (self.times < t1)] -= N_pyr * \
-            (m * self.times[(self.times > 37.) & (self.times < t1)] + b)
-        self.data['L5'][self.times >= t1] -= N_pyr * \
-            (m1 * self.times[self.times >= t1] + b1)
+        self.data['L5'][times <= 37.] -= dpl_offset['L5']
+        self.data['L5'][(times > 37.) & (times < t1)] -= N_pyr * \
+            (m * times[(times > 37.) & (times < t1)] + b)
+        self.data['L5'][times >= t1] -= N_pyr * \
+            (m1 * times[times >= t1] + b1)
         # recalculate the aggregate dipole based on the baseline
         # normalized ones
         self.data['agg'] = self.data['L2'] + self.data['L5']
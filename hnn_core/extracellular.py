@@ -0,0 +1,184 @@
+"""Extracellular electrode arrays."""
+
+import numpy as np
+
+
+def _get_segment_ends(sect):
+    """Get the 3D start and end points of each segment of a section.
+
+    The segments are placed along the 3D points of the section by their
+    arc length, which requires at least two 3D points and a positive length.
+    """
+    n_pts = int(sect.n3d())
+    if n_pts < 2 or sect.arc3d(n_pts - 1) <= 0.:
+        raise ValueError("The segments of section %s cannot be placed, it "
+                         "needs at least 2 3D points and a positive length, "
+                         "got %d points" % (sect.name(), n_pts))
+    pts = np.array([[sect.x3d(idx), sect.y3d(idx), sect.z3d(idx)]
+                    for idx in range(n_pts)])
+    arc = np.array([sect.arc3d(idx) for idx in range(n_pts)])
+    arc /= arc[-1]
+    x = np.linspace(0., 1., sect.nseg + 1)
+    ends = np.array([np.interp(x, arc, pts[:, dim]) for dim in range(3)]).T
+    return ends[:-1], ends[1:]
+
+
+def _transfer_resistance(seg_starts, seg_ends, positions, conductivity,
+                         method, min_distance):
+    """Get the potential at each contact per unit current of each segment.
+
+    Parameters
+    ----------
+    seg_starts : array, shape (n_segs, 3)
+        The start points (in um) of the segments.
+    seg_ends : array, shape (n_segs, 3)
+        The end points (in um) of the segments.
+    positions : array, shape (n_contacts, 3)
+        The positions (in um) of the contacts.
+    conductivity : float
+        The conductivity (in S/m) of the extracellular medium.
+    method : 'psa' | 'lsa'
+        The point source or line source approximation.
+    min_distance : float
+        The distance (in um) below which the contacts are assumed to lie on
+        the membrane surface of a segment.
+
+    Returns
+    -------
+    r_transfer : array, shape (n_contacts, n_segs)
+        The transfer resistance in uV/nA (kOhm). The matrix is dense, every
+        segment contributes to the potential at every contact.
+    """
+    # 1 nA / (S/m * um) = 1 mV
+    scale = 1e3 / (4. * np.pi * conductivity)
+    if method == 'psa':
+        centers = (seg_starts + seg_ends) / 2.
+        dist = np.linalg.norm(positions[:, None, :] - centers[None, :, :],
+                              axis=-1)
+        return scale / np.maximum(dist, min_distance)
+
+    # the current is spread uniformly along each segment, its potential is
+    # the integral of point sources (Holt and Koch, 1999)
+    seg_vec = seg_ends - seg_starts
+    seg_len = np.linalg.norm(seg_vec, axis=-1)
+    seg_dir = seg_vec / seg_len[:, None]
+    rel_pos = positions[:, None, :] - seg_starts[None, :, :]
+    # distances along and perpendicular to each segment
+    dist_long = np.sum(rel_pos * seg_dir[None, :, :], axis=-1)
+    dist_perp = np.sqrt(np.maximum(
+        np.sum(rel_pos ** 2, axis=-1) - dist_long ** 2, 0.))
+    dist_perp = np.maximum(dist_perp, min_distance)
+    return scale / seg_len * (np.arcsinh(dist_long / dist_perp) -
+                              np.arcsinh((dist_long - seg_len) / dist_perp))
+
+
+class ExtracellularArray(object):
+    """Array of extracellular electrode contacts.
+
+    Parameters
+    ----------
+    positions : array-like, shape (n_contacts, 3)
+        The positions (in um) of the contacts in the coordinates of the
+        cells, where the y-axis points along the apical dendrites.
+    conductivity : float
+        The conductivity (in S/m) of the extracellular medium.
+    method : 'psa' | 'lsa'
+        Approximate each segment of the cells as a point source at its center
+        ('psa') or as a line source ('lsa').
+    min_distance : float
+        The minimal distance (in um) of a contact to a segment. Avoids the
+        singularity of the potential of contacts too close to a segment.
+    times : array | None
+        The time points (in ms) of the simulation.
+
+    Attributes
+    ----------
+    positions : array, shape (n_contacts, 3)
+        The positions (in um) of the contacts.
+    conductivity : float
+        The conductivity (in S/m) of the extracellular medium.
+    method : str
+        The approximation used, 'psa' or 'lsa'.
+    min_distance : float
+        The minimal distance (in um) of a contact to a segment.
+    times : array
+        The time points (in ms) of the recordings.
+    voltages : list (n_trials,) of array, shape (n_contacts, n_times)
+        Each element of the list is a trial. The array contains the
+        extracellular potentials (in uV) at each contact.
+
+    Notes
+    -----
+    The transfer resistances between all contacts and the segments of the
+    cells are computed once after the cells are placed. They form a dense
+    (n_contacts, n_segments) matrix on each MPI process, whose size grows
+    with both the number of contacts and the number of segments. The
+    potentials at each time step are then a single matrix product with the
+    membrane currents of all segments.
+    """
+
+    def __init__(self, positions, conductivity=0.3, method='psa',
+                 min_distance=0.5, times=None):
+        positions = np.array(positions, dtype=float)
+        if positions.ndim == 1:
+            positions = positions[None, :]
+        if positions.ndim != 2 or positions.shape[1] != 3:
+            raise ValueError("positions must be of shape (n_contacts, 3), "
+                             "got %s" % (positions.shape,))
+        if not isinstance(conductivity, (int, float)) or conductivity <= 0:
+            raise ValueError("conductivity must be a positive number, got %s"
+                             % (conductivity,))
+        if method not in ('psa', 'lsa'):
+            raise ValueError("method must be 'psa' or 'lsa', got %s"
+                             % (method,))
+        if not isinstance(min_distance, (int, float)) or min_distance <= 0:
+            raise ValueError("min_distance must be a positive number, got %s"
+                             % (min_distance,))
+
+        self.positions = positions
+        self.conductivity = float(conductivity)
+        self.method = method
+        self.min_distance = float(min_distance)
+        self._times = times
+        self._voltages = list()
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return '<%s | %d contacts, %s, %d simulation trials>' % (
+            class_name, len(self.positions), self.method,
+            len(self._voltages))
+
+    @property
+    def times(self):
+        return self._times
+
+    @property
+    def voltages(self):
+        return self._voltages
+
+    def csd(self):
+        """Compute the current source density along a laminar array.
+
+        The CSD is the negative second spatial derivative of the potential
+        times the conductivity. The contacts must be evenly spaced on a
+        line, the CSD of the first and last contact is not defined.
+
+        Returns
+        -------
+        csd : list (n_trials,) of array, shape (n_contacts - 2, n_times)
+            Each element of the list is a trial. The array contains the
+            current source density (in uA/mm^3) at the inner contacts.
+        """
+        if len(self.positions) < 3:
+            raise ValueError("The CSD needs at least 3 contacts, got %d"
+                             % len(self.positions))
+        steps = np.diff(self.positions, axis=0)
+        if not np.allclose(steps, steps[0]):
+            raise ValueError("The contacts must be evenly spaced on a line "
+                             "to compute the CSD")
+        spacing = np.linalg.norm(steps[0])
+
+        # S/m * uV / um^2 = 1e3 uA/mm^3
+        scale = -1e3 * self.conductivity / spacing ** 2
+        return [scale * (voltages[:-2] - 2 * voltages[1:-1] + voltages[2:])
+                for voltages in self._voltages]
@@ -55,19 +55,21 @@ class MPISimulation(object):
             MPI.Finalize()
 
     def _read_net(self):
-        """Read net broadcasted to all ranks on stdin"""
+        """Read net and the options of the simulation broadcasted to all
+        ranks on stdin"""
 
         # get parameters from stdin
         if self.rank == 0:
             input_bytes = _read_all_bytes(sys.stdin.buffer)
             sys.stdin.close()
 
-            net = pickle.loads(base64.b64decode(input_bytes, validate=True))
+            net, options = pickle.loads(base64.b64decode(input_bytes,
+                                                         validate=True))
         else:
-            net = None
+            net, options = None, None
 
-        net = self.comm.bcast(net, root=0)
-        return net
+        net, options = self.comm.bcast((net, options), root=0)
+        return net, options
 
     def _pickle_data(self, sim_data):
         # pickle the data and encode as base64 before sending to stderr
@@ -94,18 +96,22 @@ class MPISimulation(object):
         sys.stderr.write('@end_of_data:%d@' % len(pickled_bytes))
         sys.stderr.flush()  # flush to ensure signal is not buffered
 
-    def run(self, net):
+    def run(self, net, options=None):
         """Run MPI simulation(s) and write results to stderr"""
 
-        from hnn_core.parallel_backends import _clone_and_simulate
+        from hnn_core.network_builder import _DEFAULT_OPTIONS
+        from hnn_core.parallel_backends import (_clone_and_simulate,
+                                                _get_sim_jobs)
 
+        if options is None:
+            options = _DEFAULT_OPTIONS
         sim_data = []
-        for trial_idx in range(net.params['N_trials']):
-            single_sim_data = _clone_and_simulate(net, trial_idx)
+        for job in _get_sim_jobs(net, net.params['N_trials'], options):
+            batch_sim_data = _clone_and_simulate(*job)
 
             # go ahead and append trial data for each rank, though
             # only rank 0 has data that should be sent back to MPIBackend
-            sim_data.append(single_sim_data)
+            sim_data.extend(batch_sim_data)
 
         # flush output buffers from all ranks (any errors or status mesages)
         sys.stdout.flush()
@@ -128,8 +134,8 @@ if __name__ == '__main__':
 
     try:
         with MPISimulation() as mpi_sim:
-            net = mpi_sim._read_net()
-            sim_data = mpi_sim.run(net)
+            net, options = mpi_sim._read_net()
+            sim_data = mpi_sim.run(net, options)
             mpi_sim._write_data_stderr(sim_data)
     except Exception:
         # This can be useful to indicate the problem to the
@@ -12,6 +12,7 @@ from copy import deepcopy
 from warnings import warn
 
 from .feed import _drive_cell_event_times
+from .extracellular import ExtracellularArray
 from .drives import _get_target_populations
 from .drives import _check_drive_parameter_values, _check_poisson_rates
 from .params import _extract_bias_specs_from_hnn_params
@@ -145,6 +146,75 @@ def _create_cell_coords(n_pyr_x, n_pyr_y, zdiff=1307.4):
     return pos_dict
 
 
+def _get_record_gids(record_gids, gid_ranges, cellname_list):
+    """Resolve a selection of cells to record from into a list of gids.
+
+    Parameters
+    ----------
+    record_gids : None | str | list of str | list of int | dict
+        If None, all cells are selected. A cell type or a list of cell types
+        selects all cells of those types, a list of int selects individual
+        gids. A dict maps cell types to the number of cells to randomly
+        sample from each type.
+    gid_ranges : dict
+        The gid ranges of the network (see Network.gid_ranges).
+    cellname_list : list of str
+        The names of the real cell types in the network.
+
+    Returns
+    -------
+    gids : list of int | None
+        The sorted gids of the selected cells. None if all cells are selected.
+    """
+    if record_gids is None:
+        return None
+
+    cell_gids = set()
+    for cell_type in cellname_list:
+        cell_gids.update(gid_ranges[cell_type])
+
+    gids = list()
+    if isinstance(record_gids, str):
+        record_gids = [record_gids]
+    if isinstance(record_gids, dict):
+        # fixed seed so that all ranks and trials record the same cells
+        prng = np.random.RandomState(0)
+        for cell_type, n_cells in record_gids.items():
+            if cell_type not in cellname_list:
+                raise ValueError('cell type must be one of %s. Got %s'
+                                 % (cellname_list, cell_type))
+            if not isinstance(n_cells, (int, np.integer)):
+                raise TypeError('number of cells to record from must be '
+                                'int, got %s' % type(n_cells).__name__)
+            n_type = len(gid_ranges[cell_type])
+            if not 0 < n_cells <= n_type:
+                raise ValueError('number of cells to record from must be '
+                                 'between 1 and %d for %s. Got %s'
+                                 % (n_type, cell_type, n_cells))
+            gids.extend(prng.choice(gid_ranges[cell_type], n_cells,
+                                    replace=False))
+    elif isinstance(record_gids, (list, tuple, range, np.ndarray)):
+        for item in record_gids:
+            if isinstance(item, str):
+                if item not in cellname_list:
+                    raise ValueError('cell type must be one of %s. Got %s'
+                                     % (cellname_list, item))
+                gids.extend(gid_ranges[item])
+            elif isinstance(item, (int, np.integer)):
+                if item not in cell_gids:
+                    raise ValueError('gid %d does not belong to a cell of '
+                                     'the network' % item)
+                gids.append(item)
+            else:
+                raise TypeError('record_gids must contain cell types or '
+                                'gids, got %s' % type(item).__name__)
+    else:
+        raise TypeError('record_gids must be None, str, list or dict, got %s'
+                        % type(record_gids).__name__)
+
+    return sorted(set(int(gid) for gid in gids))
+
+
 class Network(object):
     """The Network class.
 
@@ -186,6 +256,9 @@ class Network(object):
         index for trials, second for event time lists for each drive cell).
     external_biases : dict of dict (bias parameters for each cell type)
         The parameters of bias inputs to cell somata, e.g., tonic current clamp
+    rec_arrays : dict of ExtracellularArray
+        The extracellular electrode arrays (keys: array names) at which the
+        potentials are recorded during simulation.
     """
 
     def __init__(self, params, add_drives_from_params=False,
@@ -223,6 +296,9 @@ class Network(object):
         self.external_drives = dict()
         self.external_biases = dict()
 
+        # extracellular recordings
+        self.rec_arrays = dict()
+
         # contents of pos_dict determines all downstream inferences of
         # cell counts, real and artificial
         self.pos_dict = _create_cell_coords(n_pyr_x=self.params['N_pyr_x'],
@@ -330,6 +406,8 @@ class Network(object):
         net_copy = deepcopy(self)
         net_copy.cell_response = CellResponse(times=self.cell_response._times)
         net_copy._reset_drives()
+        for rec_array in net_copy.rec_arrays.values():
+            rec_array._voltages = list()
         return net_copy
 
     def add_evoked_drive(self, name, *, mu, sigma, numspikes,
@@ -391,7 +469,7 @@ class Network(object):
     def add_poisson_drive(self, name, *, tstart=0, tstop=None, rate_constant,
                           location, weights_ampa=None, weights_nmda=None,
                           space_constant=100., synaptic_delays=0.1,
-                          seedcore=2):
+                          seedcore=2, event_generator='python'):
         """Add a Poisson-distributed external drive to the network
 
         Parameters
@@ -426,10 +504,25 @@ class Network(object):
             weigths and delays within the simulated column
         seedcore : int
             Optional initial seed for random number generator (default: 2).
+        event_generator : str
+            If 'python' (default), the event times of each trial are drawn
+            in Python when the simulation starts and stored in the drive. If
+            'netstim', each drive cell is a NEURON NetStim that draws its
+            events during the simulation from the Random123 stream of its
+            gid, the trial and seedcore, so the events cost nothing to set
+            up or to send to the processes, but they are not stored. Such
+            drives cannot be combined with the warm-up, checkpoints,
+            branches or record_drive_spikes=False of simulate_dipole.
         """
         sim_end_time = self.cell_response.times[-1]
         if tstop is None:
             tstop = sim_end_time
+        if event_generator not in ('python', 'netstim'):
+            raise ValueError("event_generator must be 'python' or 'netstim', "
+                             f"got {event_generator}")
+        if event_generator == 'netstim' and seedcore < 0:
+            raise ValueError("seedcore must be non-negative with "
+                             f"event_generator='netstim', got {seedcore}")
 
         if not self._legacy_mode:
             _check_drive_parameter_values('Poisson', tstart=tstart,
@@ -444,6 +537,7 @@ class Network(object):
         drive['type'] = 'poisson'
         drive['cell_specific'] = True
         drive['seedcore'] = seedcore
+        drive['event_generator'] = event_generator
 
         drive['dynamics'] = dict(tstart=tstart, tstop=tstop,
                                  rate_constant=rate_constant)
@@ -602,6 +696,11 @@ class Network(object):
 
         drive['name'] = name  # for easier for-looping later
         drive['target_types'] = target_populations  # for _connect_celltypes
+        # to attach the drive to a network with another grid of cells
+        drive['attach_args'] = dict(
+            weights_ampa=weights_ampa, weights_nmda=weights_nmda,
+            location=location, space_constant=space_constant,
+            synaptic_delays=synaptic_delays, cell_specific=cell_specific)
 
         drive['conn'], src_gid_ran = self._create_drive_conns(
             target_populations, weights_by_receptor, location,
@@ -706,6 +805,38 @@ class Network(object):
 
         return drive_conn_by_cell, range(src_gid_ran_begin, self._n_gids)
 
+    def add_electrode_array(self, name, positions, *, conductivity=0.3,
+                            method='psa', min_distance=0.5):
+        """Add an extracellular electrode array to record potentials.
+
+        Parameters
+        ----------
+        name : str
+            Unique name of the array.
+        positions : array-like, shape (n_contacts, 3)
+            The positions (in um) of the contacts in the coordinates of the
+            cells, where the y-axis points along the apical dendrites.
+        conductivity : float
+            The conductivity (in S/m) of the extracellular medium.
+        method : 'psa' | 'lsa'
+            Approximate each segment of the cells as a point source at its
+            center ('psa') or as a line source ('lsa').
+        min_distance : float
+            The minimal distance (in um) of a contact to a segment.
+
+        Notes
+        -----
+        The potentials of each trial are stored in
+        ``net.rec_arrays[name].voltages`` after simulation.
+        """
+        if not isinstance(name, str):
+            raise TypeError("name must be str, got %s" % type(name).__name__)
+        if name in self.rec_arrays:
+            raise ValueError(f"Electrode array {name} already defined")
+        self.rec_arrays[name] = ExtracellularArray(
+            positions, conductivity=conductivity, method=method,
+            min_distance=min_distance, times=self.cell_response.times)
+
     def _reset_drives(self):
         # reset every time called again, e.g., from dipole.py or in self.copy()
         for drive_name in self.external_drives.keys():
@@ -729,24 +860,45 @@ class Network(object):
         # each trial needs unique event time vectors
         for trial_idx in range(n_trials):
             for drive in self.external_drives.values():
-                event_times = list()  # new list for each trial and drive
-
-                # loop over drive 'cells' and create event times for each
-                for this_cell_drive_conn in drive['conn'].values():
-                    for drive_cell_gid in this_cell_drive_conn['src_gids']:
-                        event_times.append(_drive_cell_event_times(
-                            drive['type'], this_cell_drive_conn,
-                            drive['dynamics'], trial_idx=trial_idx,
-                            drive_cell_gid=drive_cell_gid,
-                            seedcore=drive['seedcore'])
-                        )
-                    # only create one event_times list for globals
-                    if not drive['cell_specific']:
-                        break  # loop over drive['conn'].values
-
                 # 'events': list (trials) of list (cells) of list (events)
-                self.external_drives[
-                    drive['name']]['events'].append(event_times)
+                self.external_drives[drive['name']]['events'].append(
+                    self._get_drive_events(drive, trial_idx))
+
+    def _get_drive_events(self, drive, trial_idx):
+        """Get the event times of each drive cell of a drive in a trial.
+
+        Parameters
+        ----------
+        drive : dict
+            The drive, as in self.external_drives, whose dynamics and
+            seedcore give the event times.
+        trial_idx : int
+            The index of the trial.
+
+        Returns
+        -------
+        event_times : list of list
+            The event times of each drive cell, in the order of its gids.
+        """
+        event_times = list()  # new list for each trial and drive
+
+        # loop over drive 'cells' and create event times for each
+        for this_cell_drive_conn in drive['conn'].values():
+            for drive_cell_gid in this_cell_drive_conn['src_gids']:
+                # NEURON generates the events during the simulation
+                if drive.get('event_generator') == 'netstim':
+                    event_times.append(list())
+                    continue
+                event_times.append(_drive_cell_event_times(
+                    drive['type'], this_cell_drive_conn,
+                    drive['dynamics'], trial_idx=trial_idx,
+                    drive_cell_gid=drive_cell_gid,
+                    seedcore=drive['seedcore'])
+                )
+            # only create one event_times list for globals
+            if not drive['cell_specific']:
+                break  # loop over drive['conn'].values
+        return event_times
 
     def add_tonic_bias(self, *, cell_type=None, amplitude=None,
                        t0=None, T=None):
@@ -871,6 +1023,9 @@ class _NetworkDrive(dict):
     seedcore : int
         Optional initial seed for random number generator
         Each artificial drive cell has seed = seedcore + gid
+    event_generator : str
+        Only for 'poisson' drives: 'python' if the events are stored in
+        events, 'netstim' if NEURON generates them (events are then empty).
     target_types : set or list of str
         Names of cell types targeted by this drive (must be subset of
         net.cellname_list).
@@ -941,14 +1096,23 @@ class CellResponse(object):
         Each gid corresponds to a type via Network::gid_ranges.
     vsoma : list (n_trials,) of dict, shape
         Each element of the outer list is a trial.
-        Dictionary indexed by gids containing somatic voltages.
+        Dictionary indexed by gids containing arrays of somatic voltages.
     isoma : list (n_trials,) of dict, shape
         Each element of the outer list is a trial.
-        Dictionary indexed by gids containing somatic currents.
+        Dictionary indexed by gids containing dictionaries of arrays of
+        somatic currents (keys are synapse types, e.g. soma_gabaa).
 
     times : numpy array
         Array of time points for samples in continuous data.
-        This includes vsoma and isoma.
+    soma_times : numpy array
+        Array of time points of the somatic recordings (vsoma and isoma).
+        Identical to times unless the recordings were decimated.
+    cell_dipoles : list (n_trials,) of array, shape (n_cells, n_times)
+        Each element of the list is a trial. The float32 array contains the
+        unprocessed dipole (in fAm) of each pyramidal cell. Must be enabled
+        by running simulate_dipole(net, record_cell_dipoles=True)
+    cell_dipole_gids : numpy array, shape (n_cells,)
+        The gids of the pyramidal cells, one for each row of cell_dipoles.
 
     Methods
     -------
@@ -962,6 +1126,10 @@ class CellResponse(object):
         averaging method with mean_type argument.
     write(fname)
         Write spiking activity to a collection of spike trial files.
+    sum_cell_dipoles(groups)
+        Sum the dipoles of groups of pyramidal cells.
+    add_drive_spikes()
+        Add the spikes of the drives that were not recorded.
     """
 
     def __init__(self, spike_times=None, spike_gids=None, spike_types=None,
@@ -997,10 +1165,16 @@ class CellResponse(object):
         self._spike_types = spike_types
         self._vsoma = list()
         self._isoma = list()
+        self._cell_dipoles = list()
+        self._cell_dipole_gids = np.array([], dtype=int)
+        # for each trial, None or the event times of the drives that were not
+        # recorded by drive name, as (gids, events), and the end of the trial
+        self._drive_events = list()
         if times is not None:
             if not isinstance(times, np.ndarray):
                 raise TypeError("'times' is an np.ndarray of simulation times")
         self._times = times
+        self._soma_times = times
 
     def __repr__(self):
         class_name = self.__class__.__name__
@@ -1058,6 +1232,8 @@ class CellResponse(object):
         types_slice = list()
         vsoma_slice = list()
         isoma_slice = list()
+        cell_dipoles_slice = list()
+        cell_dipole_mask = np.in1d(self._cell_dipole_gids, gid_item)
         for trial_idx in range(n_trials):
             gid_mask = np.in1d(self._spike_gids[trial_idx], gid_item)
             times_trial = np.array(
@@ -1078,12 +1254,18 @@ class CellResponse(object):
             types_slice.append(types_trial)
             vsoma_slice.append(vsoma_trial)
             isoma_slice.append(isoma_trial)
+            if trial_idx < len(self._cell_dipoles):
+                cell_dipoles_slice.append(
+                    self._cell_dipoles[trial_idx][cell_dipole_mask])
 
         cell_response_slice = CellResponse(spike_times=times_slice,
                                            spike_gids=gids_slice,
                                            spike_types=types_slice)
         cell_response_slice._vsoma = vsoma_slice
         cell_response_slice._isoma = isoma_slice
+        cell_response_slice._cell_dipoles = cell_dipoles_slice
+        cell_response_slice._cell_dipole_gids = \
+            self._cell_dipole_gids[cell_dipole_mask]
 
         return cell_response_slice
 
@@ -1107,10 +1289,22 @@ class CellResponse(object):
     def isoma(self):
         return self._isoma
 
+    @property
+    def cell_dipoles(self):
+        return self._cell_dipoles
+
+    @property
+    def cell_dipole_gids(self):
+        return self._cell_dipole_gids
+
     @property
     def times(self):
         return self._times
 
+    @property
+    def soma_times(self):
+        return self._soma_times
+
     def update_types(self, gid_ranges):
         """Update spike types in the current instance of CellResponse.
 
@@ -1142,6 +1336,78 @@ class CellResponse(object):
             spike_types += [list(spike_types_trial)]
         self._spike_types = spike_types
 
+    def sum_cell_dipoles(self, groups):
+        """Sum the dipoles of groups of pyramidal cells.
+
+        Parameters
+        ----------
+        groups : dict of list of int
+            Dictionary with a name for each group as keys and the gids of
+            the pyramidal cells in the group as values, e.g., the cells of a
+            spatial patch selected by their positions in Network.pos_dict.
+
+        Returns
+        -------
+        group_dipoles : dict of array, shape (n_trials, n_times)
+            Dictionary with the same keys as groups containing the summed
+            dipoles (in fAm) of each trial.
+        """
+        if not isinstance(groups, dict):
+            raise TypeError("groups must be dict, got %s"
+                            % type(groups).__name__)
+        if self._cell_dipole_gids.size == 0:
+            raise ValueError("No cell dipoles were recorded. Run "
+                             "simulate_dipole(net, record_cell_dipoles=True)")
+
+        row_idx = {gid: idx for idx, gid in
+                   enumerate(self._cell_dipole_gids.tolist())}
+        group_dipoles = dict()
+        for name, gids in groups.items():
+            rows = list()
+            for gid in gids:
+                if gid not in row_idx:
+                    raise ValueError("gid %s of group %s is not a recorded "
+                                     "pyramidal cell" % (gid, name))
+                rows.append(row_idx[gid])
+            # accumulate in float64 to not lose precision over many cells
+            group_dipoles[name] = np.array(
+                [cell_dipoles[rows].sum(axis=0, dtype=np.float64)
+                 for cell_dipoles in self._cell_dipoles])
+        return group_dipoles
+
+    def add_drive_spikes(self):
+        """Add the spikes of the drives that were not recorded.
+
+        With simulate_dipole(..., record_drive_spikes=False), only the
+        spikes of the cells are recorded. The spikes of the drives are
+        reconstructed from their event times up to the end of each trial and
+        merged with the spikes of the cells in time order.
+        """
+        for trial_idx, drive_events in enumerate(self._drive_events):
+            if drive_events is None:
+                continue
+            events, t_end = drive_events
+            spike_times = [np.array(self._spike_times[trial_idx])]
+            spike_gids = [np.array(self._spike_gids[trial_idx], dtype=int)]
+            spike_types = [np.array(self._spike_types[trial_idx],
+                                    dtype='<U36')]
+            for drive_name, (gids, drive_events) in events.items():
+                for gid, event_times in zip(gids, drive_events):
+                    event_times = np.array(event_times, dtype=float)
+                    event_times = event_times[event_times <= t_end]
+                    spike_times.append(event_times)
+                    spike_gids.append(np.full(event_times.size, gid))
+                    spike_types.append(np.full(event_times.size, drive_name,
+                                               dtype='<U36'))
+            spike_times = np.concatenate(spike_times)
+            order = np.argsort(spike_times, kind='stable')
+            self._spike_times[trial_idx] = spike_times[order].tolist()
+            self._spike_gids[trial_idx] = \
+                np.concatenate(spike_gids)[order].tolist()
+            self._spike_types[trial_idx] = \
+                list(np.concatenate(spike_types)[order])
+            self._drive_events[trial_idx] = None
+
     def mean_rates(self, tstart, tstop, gid_ranges, mean_type='all'):
         """Mean spike rates (Hz) by cell type.
 
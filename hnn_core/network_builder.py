@@ -4,18 +4,64 @@
 #          Sam Neymotin <samnemo@gmail.com>
 #          Blake Caldwell <blake_caldwell@brown.edu>
 
+import gc
+import os
+import os.path as op
+import shutil
+import tempfile
+import json
+import hashlib
+import fnmatch
+
 import numpy as np
 from neuron import h
 
-from .cell import _ArtificialCell
-from .pyramidal import L2Pyr, L5Pyr
+from .cell import _ArtificialCell, _NetStimCell, _set_weight_and_delay
+from .pyramidal import L2Pyr, L5Pyr, L2PyrReduced, L5PyrReduced
 from .basket import L2Basket, L5Basket
 from .params import _long_name
+from .extracellular import _get_segment_ends, _transfer_resistance
 
 # a few globals
 _PC = None
 _CVODE = None
 
+# The options of a simulation that are not parameters of the network and
+# their defaults. simulate_dipole checks them and completes its keyword
+# arguments with the defaults, the options then reach NetworkBuilder as a
+# whole. The branches and sweeps are set by their own functions.
+_DEFAULT_OPTIONS = {'record_gids': None, 'record_dt': None,
+                    'record_cell_dipoles': False, 'record_dipole': True,
+                    'record_drive_spikes': True, 'dipole_method': 'mechanism',
+                    'drive_method': 'vecstim', 'warmup': None,
+                    'warmup_dir': None, 'run_control': None, 'solver': 'fixed',
+                    'cvode_atol': 1e-3, 'cvode_rtol': 0., 'd_lambda': None,
+                    'd_lambda_freq': 100., 'pyramidal_model': 'full',
+                    'ensemble_size': 1, 'branches': None, 'sweep': None}
+
+# the params and options that determine the state of a network without its
+# external drives, the warm-up states are cached under a hash of their
+# values. The recordings are part of the state saved by NEURON.
+_WARMUP_PARAMS = ('L2Pyr_*', 'L5Pyr_*', 'L2Basket_*', 'L5Basket_*', 'gbar_*',
+                  'N_pyr_*', 'celsius', 'dt', 'secondorder', 'threshold',
+                  'record_*')
+_WARMUP_OPTIONS = ('record_*', 'dipole_method', 'drive_method', 'd_lambda*',
+                   'pyramidal_model')
+
+# the params of the weights of the connections between cells, those of the
+# drives are read when the drives are added to the Network
+_CONNECTION_PARAMS = ('gbar_L2*', 'gbar_L5*')
+
+# The largest count of elements in a message of MPI, whose counts are C ints
+_MPI_MAX_COUNT = 2 ** 31 - 1
+
+# The time (in ms) between interpolations of the recordings with variable
+# time steps, which bounds the memory used by the samples of all steps.
+_GRID_FLUSH_INTERVAL = 10.
+
+# The time (in ms) between the messages of the progress of a simulation
+_PROGRESS_INTERVAL = 10.
+
 # We need to maintain a reference to the last
 # NetworkBuilder instance that ran pc.gid_clear(). Even if
 # pc is global, if pc.gid_clear() is called within a new
@@ -24,9 +70,175 @@ _LAST_NETWORK = None
 
 
 def _simulate_single_trial(neuron_net, trial_idx):
-    """Simulate one trial."""
+    """Simulate one trial, or one trial per replica of the network.
+
+    With a RunControl, the solver runs in chunks. At the end of each chunk,
+    the progress is printed and, as set by the RunControl, the state of the
+    trial is saved, its recordings are streamed to the disk or the stop
+    criteria are checked. Without it, the solver runs up to tstop at once.
+
+    Returns
+    -------
+    dpls : list of Dipole | list of None
+        The Dipole of each replica, None if rank > 0 or without dipoles.
+    """
+    run_control = neuron_net._options['run_control']
+    if run_control is None:
+        _initialize_trial(neuron_net, trial_idx)
+        _add_progress_events()
+        _PC.barrier()
+        _psolve_in_chunks(neuron_net, h.tstop)
+        return _finish_trial(neuron_net)
+
+    # continue from the last checkpoint of an interrupted simulation, the
+    # drives deliver their remaining events after it is restored
+    n_checkpoints = 0
+    if run_control.resume_from is not None:
+        n_checkpoints = neuron_net._find_checkpoint(run_control.resume_from,
+                                                    trial_idx)
+    if n_checkpoints > 0:
+        neuron_net._silence_drives(list(neuron_net.net.external_drives))
+        if neuron_net._options['record_dt'] is not None:
+            neuron_net._stop_soma_recordings()
+    _initialize_trial(neuron_net, trial_idx)
+    if n_checkpoints > 0:
+        neuron_net._read_checkpoint(run_control.resume_from, trial_idx,
+                                    n_checkpoints)
+    if run_control.stream_dir is not None:
+        neuron_net._start_stream(run_control.stream_dir, trial_idx)
+    if run_control.stop_criteria:
+        neuron_net._start_stop_checks()
+
+    # initialization complete, but wait for all procs to start the solver
+    _PC.barrier()
+
+    # the actions run between the chunks instead of from events of the
+    # solver, which could not be saved in a checkpoint
+    intervals = run_control._get_intervals()
+    intervals['progress'] = _PROGRESS_INTERVAL
+    if neuron_net._grid_cells is not None:
+        intervals['grid'] = _GRID_FLUSH_INTERVAL
+    if _get_rank() == 0:
+        _print_simulation_time()
+    for t_end, actions in _get_chunk_ends(h.t, h.tstop, intervals):
+        _PC.psolve(t_end)
+        if 'grid' in actions:
+            neuron_net._flush_grid_recordings()
+        if 'stream' in actions:
+            neuron_net._flush_recordings()
+        if 'stop' in actions and neuron_net._check_stop_criteria(
+                run_control.stop_criteria):
+            break
+        if 'checkpoint' in actions:
+            n_checkpoints += 1
+            neuron_net._write_checkpoint(run_control.checkpoint_dir,
+                                         trial_idx, n_checkpoints)
+        if 'progress' in actions and _get_rank() == 0:
+            _print_simulation_time()
+
+    return _finish_trial(neuron_net)
+
+
+def _get_chunk_ends(t_start, t_stop, intervals):
+    """Get the ends of the chunks of a trial from t_start on.
+
+    Each action is due every interval ms from 0 ms on. The chunks end where
+    any action is due and at t_stop, where none is.
+
+    Parameters
+    ----------
+    t_start : float
+        The time (in ms) the trial continues from.
+    t_stop : float
+        The time (in ms) the trial ends at.
+    intervals : dict
+        The interval (in ms) of each action.
+
+    Returns
+    -------
+    chunk_ends : list of tuple
+        The end (in ms) of each chunk and the set of actions due at its end.
+    """
+    actions = dict()
+    for action, interval in intervals.items():
+        # the rounding keeps the ends that several actions share together
+        first_idx = int(np.floor(round(t_start / interval, 6))) + 1
+        n_ends = int(np.ceil(round(t_stop / interval, 6)))
+        for end_idx in range(first_idx, n_ends):
+            actions.setdefault(round(end_idx * interval, 9),
+                               set()).add(action)
+    return sorted(actions.items()) + [(t_stop, set())]
 
-    from .dipole import Dipole
+
+def _simulate_branches(neuron_net, trial_idx):
+    """Simulate the branches of one trial from their shared prefix.
+
+    The drives that differ between the branches are silenced while the
+    network is simulated up to their earliest event in any branch. The state
+    at that time is saved and each branch continues from it with the events
+    of its own drives.
+
+    Returns
+    -------
+    branch_data : list of tuple
+        The Dipole (None if rank > 0 or without dipoles) and the output of
+        NetworkBuilder.get_data_from_neuron() of each branch.
+    """
+    branch_events = [{name: events[trial_idx] for name, events in
+                      branch.items()}
+                     for branch in neuron_net._options['branches']]
+    drive_names = sorted(branch_events[0])
+
+    neuron_net._silence_drives(drive_names)
+    # SaveState cannot restore the events that a PatternStim has sent, the
+    # events of the other drives are then queued for their targets instead
+    other_events = dict()
+    if neuron_net._pattern_stim is not None:
+        other_events = {name: drive['events'][trial_idx] for name, drive in
+                        neuron_net.net.external_drives.items()
+                        if name not in drive_names}
+        neuron_net._silence_drives(list(other_events))
+    _initialize_trial(neuron_net, trial_idx)
+    if other_events:
+        neuron_net._inject_drive_events(other_events)
+    _add_progress_events()
+    t_branch = min([event_time for events in branch_events
+                    for name in drive_names for cell_events in events[name]
+                    for event_time in cell_events] + [h.tstop])
+
+    _PC.barrier()
+    _psolve_in_chunks(neuron_net, t_branch)
+    checkpoint = neuron_net._save_checkpoint()
+
+    branch_data = list()
+    for branch_idx, events in enumerate(branch_events):
+        if branch_idx > 0:
+            neuron_net._restore_checkpoint(checkpoint)
+        neuron_net._inject_drive_events(events)
+        _psolve_in_chunks(neuron_net, h.tstop)
+        dpl = _finish_trial(neuron_net)[0]
+        branch_data.append((dpl, neuron_net.get_data_from_neuron()))
+    return branch_data
+
+
+def _psolve_in_chunks(neuron_net, t_stop):
+    """Run the solver up to t_stop.
+
+    The steps of the variable time step solvers are interpolated on their
+    grid every _GRID_FLUSH_INTERVAL ms, so that their recordings stay short.
+    Otherwise, the solver runs up to t_stop at once.
+    """
+    intervals = dict()
+    if neuron_net._grid_cells is not None:
+        intervals['grid'] = _GRID_FLUSH_INTERVAL
+    for t_end, actions in _get_chunk_ends(h.t, t_stop, intervals):
+        _PC.psolve(t_end)
+        if 'grid' in actions:
+            neuron_net._flush_grid_recordings()
+
+
+def _initialize_trial(neuron_net, trial_idx):
+    """Set up the simulation of one trial and initialize the cells."""
 
     global _PC, _CVODE
 
@@ -38,76 +250,188 @@ def _simulate_single_trial(neuron_net, trial_idx):
     # Now let's simulate the dipole
 
     _PC.barrier()  # sync for output to screen
-    if rank == 0:
+    if rank == 0 and neuron_net._n_replicas > 1:
+        print("running trials %d to %d on %d cores" %
+              (trial_idx + 1, trial_idx + neuron_net._n_replicas, nhosts))
+    elif rank == 0:
         print("running trial %d on %d cores" %
               (trial_idx + 1, nhosts))
 
     # Set tstop before instantiating any classes
     h.tstop = neuron_net.net.params['tstop']
     h.dt = neuron_net.net.params['dt']  # simulation duration and time-step
+    h.secondorder = neuron_net.net.params.get('secondorder', 0)
     h.celsius = neuron_net.net.params['celsius']  # 37.0 - set temperature
 
-    times = neuron_net.net.cell_response.times
-
     # sets the default max solver step in ms (purposefully large)
     _PC.set_maxstep(10)
 
+    options = neuron_net._options
+    _CVODE.use_local_dt(int(options['solver'] == 'lvardt'))
+    _CVODE.active(int(options['solver'] != 'fixed'))
+    if options['solver'] != 'fixed':
+        _CVODE.atol(options['cvode_atol'])
+        _CVODE.rtol(options['cvode_rtol'])
+
+    warmup_state = None
+    if options['warmup'] is not None:
+        warmup_state = neuron_net._get_warmup_state(options['warmup'],
+                                                    options['warmup_dir'])
+
     # initialize cells to -65 mV, after all the NetCon
     # delays have been specified
     h.finitialize()
+    # the NetStims of the drives run until the end of their drive
+    for drive_cell in neuron_net._drive_cells:
+        if isinstance(drive_cell, _NetStimCell):
+            drive_cell.queue_stop()
+    if warmup_state is not None:
+        # start from the end of the warm-up, keeping the events of the
+        # drives that finitialize has queued
+        warmup_state.restore(1)
+        h.t = 0.
+        h.fcurrent()
+        if _CVODE.active():
+            _CVODE.re_init()
+        h.frecord_init()
+    if neuron_net._use_imem:
+        neuron_net._start_imem()
+    if neuron_net._grid_cells is not None:
+        neuron_net._start_grid_recordings()
 
-    def simulation_time():
-        print('Simulation time: {0} ms...'.format(round(h.t, 2)))
+    h.fcurrent()
 
-    if rank == 0:
-        for tt in range(0, int(h.tstop), 10):
-            _CVODE.event(tt, simulation_time)
 
-    h.fcurrent()
+def _print_simulation_time():
+    print('Simulation time: {0} ms...'.format(round(h.t, 2)))
 
-    # initialization complete, but wait for all procs to start the solver
-    _PC.barrier()
 
-    # actual simulation - run the solver
-    _PC.psolve(h.tstop)
+def _add_progress_events():
+    """Print the simulation time every 10 ms from the current time on."""
+    if _get_rank() == 0:
+        for tt in range(int(np.ceil(h.t / 10.)) * 10, int(h.tstop), 10):
+            _CVODE.event(tt, _print_simulation_time)
 
-    _PC.barrier()
 
-    # these calls aggregate data across procs/nodes
-    neuron_net.aggregate_data()
-    _PC.allreduce(neuron_net.dipoles['L5_pyramidal'], 1)
-    _PC.allreduce(neuron_net.dipoles['L2_pyramidal'], 1)
+def _finish_trial(neuron_net):
+    """Collect the results of one trial, the Dipole of each replica is None
+    if rank > 0 or if the dipoles are not recorded."""
 
-    # aggregate the currents and voltages independently on each proc
-    vsoma_list = _PC.py_gather(neuron_net._vsoma, 0)
-    isoma_list = _PC.py_gather(neuron_net._isoma, 0)
+    from .dipole import Dipole
+
+    if neuron_net._use_imem:
+        neuron_net._stop_imem()
+    if neuron_net._grid_cells is not None:
+        neuron_net._stop_grid_recordings()
+    if neuron_net._pattern_stim is not None:
+        neuron_net._record_pattern_spikes()
+
+    # these calls aggregate data across procs/nodes, the collective
+    # operations synchronize the ranks so no barrier is needed
+    if neuron_net._stream is not None:
+        neuron_net._stop_stream()
+    else:
+        neuron_net.aggregate_data()
+    dpl_data = neuron_net._gather_data()
+
+    # the events after a stop are still queued, they are cleared while the
+    # objects they are delivered to exist
+    if neuron_net._stop_time is not None:
+        h.finitialize()
+
+    # only rank 0 has the complete data
+    if _get_rank() != 0 or dpl_data is None:
+        return [None] * neuron_net._n_replicas
 
-    # combine spiking data from each proc
-    spike_times_list = _PC.py_gather(neuron_net._spike_times, 0)
-    spike_gids_list = _PC.py_gather(neuron_net._spike_gids, 0)
+    dpls = list()
+    for dpl_L2, dpl_L5 in dpl_data:
+        times = neuron_net.net.cell_response.times[:len(dpl_L2)]
+        dpl = Dipole(times, np.c_[dpl_L2 + dpl_L5, dpl_L2, dpl_L5])
+        dpl.stopped_early = neuron_net._stop_time is not None
+        dpls.append(dpl)
 
-    # only rank 0's lists are complete
+    return dpls
 
-    if rank == 0:
-        for spike_vec in spike_times_list:
-            neuron_net._all_spike_times.append(spike_vec)
-        for spike_vec in spike_gids_list:
-            neuron_net._all_spike_gids.append(spike_vec)
-        for vsoma in vsoma_list:
-            neuron_net._vsoma.update(vsoma)
-        for isoma in isoma_list:
-            neuron_net._isoma.update(isoma)
 
-    _PC.barrier()  # get all nodes to this place before continuing
+def _get_mpi_comm():
+    """Get the MPI communicator NEURON runs on, None for a single process."""
+    if _get_nhosts() == 1:
+        return None
+    from mpi4py import MPI
+    return MPI.COMM_WORLD
 
-    dpl_data = np.c_[np.array(neuron_net.dipoles['L2_pyramidal'].to_python()) +
-                     np.array(neuron_net.dipoles['L5_pyramidal'].to_python()),
-                     np.array(neuron_net.dipoles['L2_pyramidal'].to_python()),
-                     np.array(neuron_net.dipoles['L5_pyramidal'].to_python())]
 
-    dpl = Dipole(times, dpl_data)
+def _reduce_to_root(arr):
+    """Sum an array over all ranks, the result is only returned on rank 0."""
+    comm = _get_mpi_comm()
+    if comm is None:
+        return arr
 
-    return dpl
+    from mpi4py import MPI
+    total = np.empty_like(arr) if comm.Get_rank() == 0 else None
+    comm.Reduce(arr, total, op=MPI.SUM, root=0)
+    return total
+
+
+def _gather_rows_to_root(rows):
+    """Concatenate the rows of a 2D array of each rank in rank order.
+
+    The rows are received with Gatherv into an array preallocated on rank 0,
+    the other ranks get None. The counts and displacements of MPI are C
+    ints, so larger arrays are gathered in rounds of fewer rows per rank.
+    """
+    comm = _get_mpi_comm()
+    if comm is None:
+        return rows
+
+    rows = np.ascontiguousarray(rows)
+    n_cols = rows.shape[1]
+    # Python ints, which cannot overflow
+    all_n_rows = comm.allgather(rows.shape[0])
+    is_root = comm.Get_rank() == 0
+    all_rows = None
+    if is_root:
+        all_rows = np.empty((sum(all_n_rows), n_cols), dtype=rows.dtype)
+    if n_cols == 0:
+        return all_rows
+
+    # the elements received in a round fit in a C int
+    round_rows = max(1, _MPI_MAX_COUNT // (n_cols * comm.Get_size()))
+    n_rounds = -(-max(all_n_rows) // round_rows)
+    row_offsets = np.cumsum([0] + all_n_rows[:-1])
+    for round_idx in range(n_rounds):
+        start = round_idx * round_rows
+        counts = [min(max(n_rows - start, 0), round_rows) * n_cols
+                  for n_rows in all_n_rows]
+        send_rows = rows[start:start + round_rows]
+        if not is_root:
+            comm.Gatherv(send_rows, None, root=0)
+            continue
+        if n_rounds == 1:
+            comm.Gatherv(send_rows, (all_rows, counts), root=0)
+            break
+        round_data = np.empty((sum(counts) // n_cols, n_cols),
+                              dtype=rows.dtype)
+        comm.Gatherv(send_rows, (round_data, counts), root=0)
+        round_row = 0
+        for row_offset, count in zip(row_offsets, counts):
+            n_rows = count // n_cols
+            all_rows[row_offset + start:row_offset + start + n_rows] = \
+                round_data[round_row:round_row + n_rows]
+            round_row += n_rows
+    return all_rows
+
+
+def _gather_labels_to_root(labels):
+    """Concatenate the lists of row labels of each rank in rank order."""
+    comm = _get_mpi_comm()
+    if comm is None:
+        return labels
+
+    labels_list = comm.gather(labels, root=0)
+    if comm.Get_rank() != 0:
+        return None
+    return [label for labels in labels_list for label in labels]
 
 
 def _is_loaded_mechanisms():
@@ -147,6 +471,33 @@ def load_custom_mechanisms():
         raise ValueError('The custom mechanisms could not be loaded')
 
 
+def _get_mod_hash():
+    """Hash the sources of the custom mechanisms."""
+    mod_dir = op.join(op.dirname(__file__), 'mod')
+    mod_hash = hashlib.md5()
+    for fname in sorted(os.listdir(mod_dir)):
+        if fname.endswith('.mod'):
+            with open(op.join(mod_dir, fname), 'rb') as mod_file:
+                mod_hash.update(mod_file.read())
+    return mod_hash.hexdigest()
+
+
+def _pop_samples(vecs, n_samples):
+    """Remove the first n_samples of each vector.
+
+    Returns
+    -------
+    samples : array, shape (n_samples, n_vectors)
+        The samples that were removed, one column per vector.
+    """
+    samples = np.empty((n_samples, len(vecs)))
+    for col, vec in enumerate(vecs):
+        samples[:, col] = vec.as_numpy()[:n_samples]
+        if n_samples > 0:
+            vec.remove(0, n_samples - 1)
+    return samples
+
+
 def _get_nhosts():
     """Return the number of processors used by ParallelContext
 
@@ -217,6 +568,15 @@ class NetworkBuilder(object):
     trial_idx : int (optional)
         Index number of the trial being processed (different event statistics).
         Defaults to 0.
+    n_replicas : int (optional)
+        The number of disconnected replicas of the network that are built
+        together, replica r simulates the trial trial_idx + r. The gids of
+        replica r are those of the network offset by r times the number of
+        gids of the network. Defaults to 1.
+    options : dict | None
+        The options of the simulation that are not parameters of the
+        network, with a value for each key of _DEFAULT_OPTIONS, as checked
+        by simulate_dipole. If None, the defaults of all the options.
 
     Attributes
     ----------
@@ -247,9 +607,15 @@ class NetworkBuilder(object):
     `self.net.params` and the network is ready for another simulation.
     """
 
-    def __init__(self, net, trial_idx=0):
+    def __init__(self, net, trial_idx=0, n_replicas=1, options=None):
         self.net = net
+        if options is None:
+            options = _DEFAULT_OPTIONS
+        self._options = options
         self.trial_idx = trial_idx
+        self._n_replicas = n_replicas
+        self._trial_idxs = [trial_idx + replica for replica in
+                            range(n_replicas)]
 
         # When computing the network dynamics in parallel, the nodes of the
         # network (real and artificial cells) potentially get distributed
@@ -271,7 +637,19 @@ class NetworkBuilder(object):
         # initialized by _ArtificialCell()
         self._drive_cells = list()
 
+        # with drive_method='patternstim', the drive cells whose spikes are
+        # recorded on this host instead, and the events of all the drive
+        # cells that target its cells by gid
+        self._pattern_gids = list()
+        self._pattern_events = dict()
+
+        # gids of the cells on this host whose soma is being recorded
+        self._record_gids = list()
+
         self.ncs = dict()
+        # the distance between the positions of the cells of each NetCon,
+        # by connection like self.ncs, to set its weight and delay again
+        self._nc_distances = dict()
 
         self._build()
 
@@ -287,37 +665,89 @@ class NetworkBuilder(object):
             print('Building the NEURON model')
 
         self._clear_last_network_objects()
+        self._drive_method = self._options['drive_method']
 
-        # Create a h.Vector() with size 1xself.N_t, zero'd
-        self.dipoles = {
+        # Create a h.Vector() with size 1xself.N_t, zero'd for each replica,
+        # dipoles are those of the first replica
+        self._replica_dipoles = [{
             'L5_pyramidal': h.Vector(self.net.cell_response.times.size, 0),
             'L2_pyramidal': h.Vector(self.net.cell_response.times.size, 0),
-        }
+        } for _ in range(self._n_replicas)]
+        self.dipoles = self._replica_dipoles[0]
 
         self._gid_assign()
 
         record_vsoma = self.net.params['record_vsoma']
         record_isoma = self.net.params['record_isoma']
+        record_gids = self._options['record_gids']
+        record_dt = self._options['record_dt']
+        dipole_method = self._options['dipole_method']
+        # without dipoles, the pyramidal cells get no dipole mechanisms
+        self._record_dipole = self._options['record_dipole']
+        solver = self._options['solver']
+        # with variable time steps, the recordings are sampled at every step
+        # and interpolated at the times of the cell response
+        if solver != 'fixed':
+            record_dt = None
         self._create_cells_and_feeds(threshold=self.net.params['threshold'],
                                      record_vsoma=record_vsoma,
-                                     record_isoma=record_isoma)
+                                     record_isoma=record_isoma,
+                                     record_gids=record_gids,
+                                     record_dt=record_dt,
+                                     dipole_method=(dipole_method if
+                                                    self._record_dipole else
+                                                    None),
+                                     d_lambda=self._options['d_lambda'],
+                                     d_lambda_freq=self._options[
+                                         'd_lambda_freq'],
+                                     pyramidal_model=self._options[
+                                         'pyramidal_model'])
+
+        self._use_imem = dipole_method == 'imem' or bool(self.net.rec_arrays)
+        _CVODE.use_fast_imem(int(self._use_imem))
+        # NEURON can allocate the state of the cells of all the replicas in
+        # contiguous order, but it would not update the pointers between
+        # the dipole mechanisms
+        _CVODE.cache_efficient(int(self._n_replicas > 1 and not (
+            self._record_dipole and dipole_method == 'mechanism')))
+        self._imem_dipoles = None
+        self._rec_array_voltages = None
+        self._rec_arrays = dict()
+        self._stream = None
+        self._stop_time = None
+        self._stop_checks = None
+        self._grid_cells = None
+        # the potentials of the nodes at the ends of the sections of each
+        # cell type before they are initialized, see state_init()
+        self._v_ends = dict()
 
         self.state_init()
         self._parnet_connect()
+        self._pattern_stim = None
+        if self._drive_method == 'patternstim':
+            self._create_pattern_stim()
 
         # set to record spikes and somatic voltages
         self._spike_times = h.Vector()
         self._spike_gids = h.Vector()
         self._vsoma = dict()
         self._isoma = dict()
+        self._cell_dipoles = np.empty((0, self.net.cell_response.times.size),
+                                      dtype=np.float32)
+        self._cell_dipole_gids = np.array([], dtype=int)
 
         # used by rank 0 for spikes across all procs (MPI)
-        self._all_spike_times = h.Vector()
-        self._all_spike_gids = h.Vector()
+        self._all_spike_times = np.array([])
+        self._all_spike_gids = np.array([], dtype=int)
 
         self._record_spikes()
 
-        self.move_cells_to_pos()  # position cells in 2D grid
+        # the cells are created at their positions in the 2D grid, which the
+        # extracellular arrays need
+        if self._use_imem:
+            self._setup_imem(dipole_method)
+        if solver != 'fixed':
+            self._setup_grid_recordings()
 
         if _get_rank() == 0:
             print('[Done]')
@@ -339,30 +769,54 @@ class NetworkBuilder(object):
 
         rank = _get_rank()
         nhosts = _get_nhosts()
+        n_gids = self.net._n_gids
 
-        # round robin assignment of gids
-        for gid in range(rank, self.net.n_cells, nhosts):
+        # round robin assignment of gids, over the cells of all replicas
+        cell_gids = [gid + replica * n_gids
+                     for replica in range(self._n_replicas)
+                     for gid in range(self.net.n_cells)]
+        for gid in cell_gids[rank::nhosts]:
             # set the cell gid
             _PC.set_gid2node(gid, rank)
             self._gid_list.append(gid)
+        gids = set(self._gid_list)
 
-        # loop over all drives, then all cell types, then all artificial cells
+        # loop over all replicas, then all drives, then all cell types, then
+        # all artificial cells
         # only assign a "source" artificial cell to this rank if its target
-        # exists in _gid_list. "Global" drives get placed on different ranks
-        for drive in self.net.external_drives.values():
-            for conn in drive['conn'].values():  # all cell types
-                for src_gid, target_gid in zip(conn['src_gids'],
-                                               conn['target_gids']):
-                    if (target_gid in self._gid_list and
-                            src_gid not in self._gid_list):
+        # exists in _gid_list. "Global" drives get placed on different ranks.
+        # The drive cells played by a PatternStim get no gid, this rank only
+        # records their spikes.
+        for replica in range(self._n_replicas):
+            offset = replica * n_gids
+            for drive in self.net.external_drives.values():
+                in_pattern = (self._drive_method == 'patternstim' and
+                              drive.get('event_generator') != 'netstim')
+                for conn in drive['conn'].values():  # all cell types
+                    for src_gid, target_gid in zip(conn['src_gids'],
+                                                   conn['target_gids']):
+                        src_gid += offset
+                        target_gid += offset
+                        if target_gid not in gids or src_gid in gids:
+                            continue
+                        if in_pattern:
+                            # the drives that are not cell-specific share
+                            # their connection across the cell types
+                            if src_gid not in self._pattern_gids:
+                                self._pattern_gids.append(src_gid)
+                            continue
                         _PC.set_gid2node(src_gid, rank)
                         self._gid_list.append(src_gid)
+                        gids.add(src_gid)
 
         # extremely important to get the gids in the right order
         self._gid_list.sort()
 
     def _create_cells_and_feeds(self, threshold, record_vsoma=False,
-                                record_isoma=False):
+                                record_isoma=False, record_gids=None,
+                                record_dt=None, dipole_method='mechanism',
+                                d_lambda=None, d_lambda_freq=100.,
+                                pyramidal_model='full'):
         """Parallel create cells AND external inputs (feeds)
 
         NB: _Cell.__init__ calls h.Section -> non-picklable!
@@ -370,15 +824,29 @@ class NetworkBuilder(object):
 
         These feeds are spike SOURCES but cells are also targets.
         External inputs are not targets.
+
+        Somatic recordings are only set up for the cells in record_gids (all
+        cells if None), sampled every record_dt ms (every time step if None).
+        The pyramidal cells have no dipole if dipole_method is None.
+        The dendrites of the pyramidal cells are segmented by the d_lambda
+        rule if d_lambda is not None (see Pyr). If pyramidal_model is
+        'reduced', the pyramidal cells have collapsed dendrites.
         """
+        if record_gids is not None:
+            record_gids = set(record_gids)
         type2class = {'L2_pyramidal': L2Pyr, 'L5_pyramidal': L5Pyr,
                       'L2_basket': L2Basket, 'L5_basket': L5Basket}
+        if pyramidal_model == 'reduced':
+            type2class.update({'L2_pyramidal': L2PyrReduced,
+                               'L5_pyramidal': L5PyrReduced})
         # loop through ALL gids
         # have to loop over self._gid_list, since this is what we got
         # on this rank (MPI)
 
         for gid in self._gid_list:
-            src_type, src_pos, is_cell = self.net._get_src_type_and_pos(gid)
+            replica, net_gid = self._split_gid(gid)
+            src_type, src_pos, is_cell = self.net._get_src_type_and_pos(
+                net_gid)
 
             if is_cell:  # not a feed
                 # figure out which cell type is assoc with the gid
@@ -388,7 +856,9 @@ class NetworkBuilder(object):
                     # XXX Why doesn't a _Cell have a .threshold? Would make a
                     # lot of sense to include it, as _ArtificialCells do.
                     cell = PyramidalCell(src_pos, override_params=None,
-                                         gid=gid)
+                                         gid=gid, dipole_method=dipole_method,
+                                         d_lambda=d_lambda,
+                                         d_lambda_freq=d_lambda_freq)
                 else:
                     BasketCell = type2class[src_type]
                     cell = BasketCell(src_pos, gid=gid)
@@ -396,7 +866,9 @@ class NetworkBuilder(object):
                         src_type in self.net.external_biases['tonic']):
                     cell.create_tonic_bias(**self.net.external_biases
                                            ['tonic'][src_type])
-                cell.record_soma(record_vsoma, record_isoma)
+                if record_gids is None or net_gid in record_gids:
+                    cell.record_soma(record_vsoma, record_isoma, record_dt)
+                    self._record_gids.append(gid)
 
                 # this call could belong in init of a _Cell (with threshold)?
                 nrn_netcon = cell.setup_source_netcon(threshold)
@@ -408,13 +880,100 @@ class NetworkBuilder(object):
             # events. NB: cell types can still have different weights for
             # how such 'common' spikes influence them
             else:
-                gid_idx = gid - self.net.gid_ranges[src_type][0]
-                event_times = self.net.external_drives[
-                    src_type]['events'][self.trial_idx][gid_idx]
-                drive_cell = _ArtificialCell(event_times, threshold, gid=gid)
+                if self.net.external_drives[src_type].get(
+                        'event_generator') == 'netstim':
+                    drive_cell = self._create_netstim_cell(src_type, gid,
+                                                           threshold)
+                else:
+                    gid_idx = net_gid - self.net.gid_ranges[src_type][0]
+                    event_times = self.net.external_drives[src_type][
+                        'events'][self._trial_idxs[replica]][gid_idx]
+                    drive_cell = _ArtificialCell(event_times, threshold,
+                                                 gid=gid)
                 _PC.cell(drive_cell.gid, drive_cell.nrn_netcon)
                 self._drive_cells.append(drive_cell)
 
+    def _create_netstim_cell(self, drive_name, gid, threshold):
+        """Create a drive cell of a Poisson drive whose events are
+        generated by NEURON from the seeds of its gid and trial."""
+        drive = self.net.external_drives[drive_name]
+        replica, net_gid = self._split_gid(gid)
+        drive_conn = [conn for conn in drive['conn'].values()
+                      if net_gid in conn['src_gids']][0]
+        # like _drive_cell_event_times, no events without weights
+        rate = 0.
+        if len(drive_conn['ampa']) + len(drive_conn['nmda']) > 0:
+            rate = drive['dynamics']['rate_constant'][
+                drive_conn['target_type']]
+        return _NetStimCell(rate, drive['dynamics']['tstart'],
+                            drive['dynamics']['tstop'],
+                            (net_gid, self._trial_idxs[replica],
+                             drive['seedcore']),
+                            threshold, gid=gid)
+
+    def _split_gid(self, gid):
+        """Get the replica of a gid and the gid in the network."""
+        return divmod(gid, self.net._n_gids)
+
+    def _create_pattern_stim(self):
+        """Play the events of the drive cells connected to the cells on
+        this rank with a single PatternStim.
+
+        The drive cells have no gid on any rank, the PatternStim delivers
+        their events to the NetCons of their gids on this rank only. Their
+        spikes are added from their events at the end of the trial.
+        """
+        for name, drive in self.net.external_drives.items():
+            if drive.get('event_generator') == 'netstim':
+                continue
+            src_gids = set(int(nc.srcgid()) for target_type in drive['conn']
+                           for receptor in ('ampa', 'nmda') for nc in
+                           self.ncs.get(f'{name}_{target_type}_{receptor}',
+                                        []))
+            gid_range = self.net.gid_ranges[name]
+            for replica, trial_idx in enumerate(self._trial_idxs):
+                offset = replica * self.net._n_gids
+                for gid_idx, cell_events in enumerate(
+                        drive['events'][trial_idx]):
+                    gid = gid_range[gid_idx] + offset
+                    if gid in src_gids:
+                        self._pattern_events[gid] = cell_events
+        if not self._options['record_drive_spikes']:
+            self._pattern_gids = list()
+        self._pattern_stim = h.PatternStim()
+        self._pattern_silenced = set()
+        self._play_pattern()
+
+    def _play_pattern(self, silence_all=False):
+        """Load the events of the drive cells into the PatternStim, except
+        those of the silenced drive cells."""
+        events = list()
+        if not silence_all:
+            events = [(event_time, gid) for gid, cell_events in
+                      self._pattern_events.items()
+                      if gid not in self._pattern_silenced
+                      for event_time in cell_events]
+        # the PatternStim needs the events in time order
+        events.sort(key=lambda event: event[0])
+        self._pattern_vecs = (h.Vector([event[0] for event in events]),
+                              h.Vector([event[1] for event in events]))
+        self._pattern_stim.play(*self._pattern_vecs)
+
+    def _get_pattern_spikes(self, t_end, t_start=-np.inf):
+        """Get the spikes after t_start up to t_end of the drive cells played
+        by the PatternStim that are recorded on this rank."""
+        spikes = [(event_time, gid) for gid in self._pattern_gids
+                  for event_time in self._pattern_events.get(gid, [])
+                  if t_start < event_time <= t_end]
+        return np.array(spikes, dtype=float).reshape(-1, 2)
+
+    def _record_pattern_spikes(self):
+        """Add the spikes of the drive cells played by the PatternStim up
+        to the current time to the recorded spikes."""
+        spikes = self._get_pattern_spikes(h.t)
+        self._spike_times.append(h.Vector(spikes[:, 0]))
+        self._spike_gids.append(h.Vector(spikes[:, 1]))
+
     def _connect_celltypes(self, src_type, target_type, loc,
                            receptor, nc_dict, unique=False,
                            allow_autapses=True):
@@ -446,12 +1005,15 @@ class NetworkBuilder(object):
         connection_name = f'{src_type}_{target_type}_{receptor}'
         if connection_name not in self.ncs:
             self.ncs[connection_name] = list()
+            self._nc_distances[connection_name] = list()
         assert len(self.cells) == len(self._gid_list) - len(self._drive_cells)
-        # NB this assumes that REAL cells are first in the _gid_list
-        for gid_target, target_cell in zip(self._gid_list, self.cells):
+        for target_cell in self.cells:
+            # the sources are in the replica of the target
+            replica, gid_target = self._split_gid(target_cell.gid)
+            offset = replica * net._n_gids
             is_target_gid = (gid_target in
                              self.net.gid_ranges[_long_name(target_type)])
-            if _PC.gid_exists(gid_target) and is_target_gid:
+            if _PC.gid_exists(target_cell.gid) and is_target_gid:
                 gid_srcs = net.gid_ranges[_long_name(src_type)]
                 if unique:
                     gid_srcs = [gid_target + net.gid_ranges[src_type][0]]
@@ -473,10 +1035,13 @@ class NetworkBuilder(object):
                     else:
                         syn_keys = [f'{loc}_{receptor}']
 
+                    distance = target_cell._pardistance(nc_dict['pos_src'])
                     for syn_key in syn_keys:
                         nc = target_cell.parconnect_from_src(
-                            gid_src, nc_dict, target_cell.synapses[syn_key])
+                            gid_src + offset, nc_dict,
+                            target_cell.synapses[syn_key])
                         self.ncs[connection_name].append(nc)
+                        self._nc_distances[connection_name].append(distance)
 
     # connections:
     # this NODE is aware of its cells as targets
@@ -484,7 +1049,23 @@ class NetworkBuilder(object):
     # for each item in the list, do a:
     # nc = pc.gid_connect(source_gid, target_syn), weight,delay
     # Both for synapses AND for external inputs
-    def _parnet_connect(self):
+    def _get_connections(self):
+        """Get the connections between the cell types and from the drives.
+
+        Returns
+        -------
+        connections : list of dict
+            The arguments of _connect_celltypes for each connection.
+        """
+        connections = list()
+
+        def connect(src_type, target_type, loc, receptor, nc_dict,
+                    unique=False, allow_autapses=True):
+            connections.append(dict(
+                src_type=src_type, target_type=target_type, loc=loc,
+                receptor=receptor, nc_dict=nc_dict.copy(), unique=unique,
+                allow_autapses=allow_autapses))
+
         params = self.net.params
         nc_dict = {
             'A_delay': 1.,
@@ -500,17 +1081,15 @@ class NetworkBuilder(object):
             for receptor in ['nmda', 'ampa']:
                 key = f'gbar_{target_cell}_{target_cell}_{receptor}'
                 nc_dict['A_weight'] = params[key]
-                self._connect_celltypes(target_cell, target_cell, 'proximal',
-                                        receptor, nc_dict,
-                                        allow_autapses=False)
+                connect(target_cell, target_cell, 'proximal', receptor,
+                        nc_dict, allow_autapses=False)
 
         # layer2 Basket -> layer2 Pyr
         target_cell = 'L2Pyr'
         nc_dict['lamtha'] = 50.
         for receptor in ['gabaa', 'gabab']:
             nc_dict['A_weight'] = params[f'gbar_L2Basket_L2Pyr_{receptor}']
-            self._connect_celltypes('L2Basket', target_cell, 'soma', receptor,
-                                    nc_dict)
+            connect('L2Basket', target_cell, 'soma', receptor, nc_dict)
 
         # layer5 Basket -> layer5 Pyr
         target_cell = 'L5Pyr'
@@ -518,47 +1097,40 @@ class NetworkBuilder(object):
         for receptor in ['gabaa', 'gabab']:
             key = f'gbar_L5Basket_{target_cell}_{receptor}'
             nc_dict['A_weight'] = params[key]
-            self._connect_celltypes('L5Basket', target_cell, 'soma', receptor,
-                                    nc_dict)
+            connect('L5Basket', target_cell, 'soma', receptor, nc_dict)
 
         # layer2 Pyr -> layer5 Pyr
         nc_dict['lamtha'] = 3.
         for loc in ['proximal', 'distal']:
             nc_dict['A_weight'] = params[f'gbar_L2Pyr_{target_cell}']
-            self._connect_celltypes('L2Pyr', target_cell, loc, 'ampa',
-                                    nc_dict)
+            connect('L2Pyr', target_cell, loc, 'ampa', nc_dict)
         # layer2 Basket -> layer5 Pyr
         nc_dict['lamtha'] = 50.
         nc_dict['A_weight'] = params[f'gbar_L2Basket_{target_cell}']
-        self._connect_celltypes('L2Basket', target_cell, 'distal', 'gabaa',
-                                nc_dict)
+        connect('L2Basket', target_cell, 'distal', 'gabaa', nc_dict)
 
         # xx -> layer2 Basket
         target_cell = 'L2Basket'
         nc_dict['lamtha'] = 3.
         nc_dict['A_weight'] = params[f'gbar_L2Pyr_{target_cell}']
-        self._connect_celltypes('L2Pyr', target_cell, 'soma', 'ampa',
-                                nc_dict)
+        connect('L2Pyr', target_cell, 'soma', 'ampa', nc_dict)
         nc_dict['lamtha'] = 20.
         nc_dict['A_weight'] = params[f'gbar_L2Basket_{target_cell}']
-        self._connect_celltypes('L2Basket', target_cell, 'soma', 'gabaa',
-                                nc_dict)
+        connect('L2Basket', target_cell, 'soma', 'gabaa', nc_dict)
 
         # xx -> layer5 Basket
         target_cell = 'L5Basket'
         nc_dict['lamtha'] = 20.
         nc_dict['A_weight'] = params[f'gbar_L5Basket_{target_cell}']
-        self._connect_celltypes('L5Basket', target_cell, 'soma', 'gabaa',
-                                nc_dict, allow_autapses=False)
+        connect('L5Basket', target_cell, 'soma', 'gabaa', nc_dict,
+                allow_autapses=False)
         nc_dict['lamtha'] = 3.
         nc_dict['A_weight'] = params[f'gbar_L5Pyr_{target_cell}']
-        self._connect_celltypes('L5Pyr', target_cell, 'soma', 'ampa',
-                                nc_dict)
+        connect('L5Pyr', target_cell, 'soma', 'ampa', nc_dict)
         nc_dict['A_weight'] = params[f'gbar_L2Pyr_{target_cell}']
-        self._connect_celltypes('L2Pyr', target_cell, 'soma', 'ampa',
-                                nc_dict)
+        connect('L2Pyr', target_cell, 'soma', 'ampa', nc_dict)
 
-        # loop over _all_ drives, _connect_celltypes picks ones on this rank
+        # all the drives, _connect_celltypes picks the cells on this rank
         for drive in self.net.external_drives.values():
 
             receptors = ['ampa', 'nmda']
@@ -574,59 +1146,1152 @@ class NetworkBuilder(object):
                             receptor]['A_delay']
                         nc_dict['A_weight'] = drive_conn[
                             receptor]['A_weight']
-                        self._connect_celltypes(
-                            drive['name'], target_cell_type,
-                            drive_conn['location'], receptor, nc_dict,
-                            unique=drive['cell_specific'])
+                        connect(drive['name'], target_cell_type,
+                                drive_conn['location'], receptor, nc_dict,
+                                unique=drive['cell_specific'])
+        return connections
+
+    def _parnet_connect(self):
+        """Connect the cell types and the drives."""
+        for connection in self._get_connections():
+            self._connect_celltypes(**connection)
+
+    def update_connections(self, params=None):
+        """Update the weights and delays of the connections in place.
+
+        The weights and delays of all the NetCons are set again from
+        self.net.params and from the connections of the drives, without
+        building the network again. The trials simulated next use them,
+        after state_init() has set the initial membrane potentials again.
+
+        Parameters
+        ----------
+        params : dict | None
+            New values of the parameters of the connections between cells
+            (e.g., {'gbar_L2Pyr_L2Pyr_ampa': 5e-4}), which are updated in
+            self.net.params first. The weights and delays of the drives are
+            read from net.external_drives[name]['conn'], their parameters
+            (e.g., 'gbar_evprox_1_L2Pyr_ampa') are only read when the drives
+            are added to the Network and cannot be passed.
+        """
+        if params is not None:
+            for key in params:
+                if key not in self.net.params or not any(
+                        fnmatch.fnmatch(key, pattern)
+                        for pattern in _CONNECTION_PARAMS):
+                    raise ValueError("params must contain parameters of the "
+                                     "connections between cells, got %s"
+                                     % key)
+            self.net.params.update(params)
+        nc_dicts = {'%s_%s_%s' % (connection['src_type'],
+                                  connection['target_type'],
+                                  connection['receptor']):
+                    connection['nc_dict']
+                    for connection in self._get_connections()}
+        for connection_name, ncs in self.ncs.items():
+            for nc, distance in zip(ncs,
+                                    self._nc_distances[connection_name]):
+                _set_weight_and_delay(nc, nc_dicts[connection_name],
+                                      distance)
+
+    def scale_connections(self, weights=None, delays=None):
+        """Rescale the weights and delays of connections in place.
+
+        Parameters
+        ----------
+        weights : dict | None
+            The factors of the weights by connection name (the keys of
+            self.ncs, e.g. 'L2Pyr_L2Pyr_ampa' or 'evprox1_L5_pyramidal_ampa').
+            The names may contain shell-style wildcards, e.g., 'evprox1_*'.
+        delays : dict | None
+            The factors of the delays by connection name, as for weights.
+        """
+        for attr, factors in (('weight', weights), ('delay', delays)):
+            if factors is None:
+                continue
+            for pattern, factor in factors.items():
+                names = fnmatch.filter(self.ncs, pattern)
+                if len(names) == 0:
+                    raise ValueError("No connection matches %s, got %s"
+                                     % (pattern, list(self.ncs)))
+                for name in names:
+                    for nc in self.ncs[name]:
+                        if attr == 'weight':
+                            nc.weight[0] *= factor
+                        else:
+                            nc.delay *= factor
+
+    def _update_drives(self, drives):
+        """Play the events of drives with other dynamics in place.
+
+        The events of each replica are drawn again from the dynamics of the
+        drive in self.net with the overrides, without building the network
+        again. The drives must not be generated by NEURON ('netstim').
+
+        Parameters
+        ----------
+        drives : dict of dict
+            The overrides of the dynamics of each drive by name, and of its
+            'seedcore'. A drive without overrides gets the events of its
+            dynamics in self.net back.
+        """
+        drive_cells = {drive_cell.gid: drive_cell for drive_cell in
+                       self._drive_cells}
+        for name, overrides in drives.items():
+            drive = dict(self.net.external_drives[name])
+            drive['dynamics'] = dict(drive['dynamics'])
+            for key, value in overrides.items():
+                if key == 'seedcore':
+                    drive['seedcore'] = value
+                else:
+                    drive['dynamics'][key] = value
+            gid_range = self.net.gid_ranges[name]
+            for replica, trial_idx in enumerate(self._trial_idxs):
+                offset = replica * self.net._n_gids
+                for gid_idx, cell_events in enumerate(
+                        self.net._get_drive_events(drive, trial_idx)):
+                    gid = gid_range[gid_idx] + offset
+                    # the VecStim plays its vector from the start at
+                    # h.finitialize()
+                    if gid in drive_cells:
+                        drive_cells[gid].nrn_eventvec.from_python(
+                            cell_events)
+                    elif gid in self._pattern_events:
+                        self._pattern_events[gid] = cell_events
+        if self._pattern_stim is not None:
+            self._play_pattern()
+
+    def _setup_imem(self, dipole_method):
+        """Prepare projecting the membrane currents after each step.
+
+        After each time step, NEURON calls _project_imem, which gathers the
+        membrane currents (i_membrane_) of the segments on this rank and
+        projects them onto the dipoles of the pyramidal cells if
+        dipole_method is 'imem', and onto the contacts of the extracellular
+        arrays.
+        """
+        from scipy.sparse import csr_matrix
+
+        compute_dipoles = dipole_method == 'imem'
+        segs, sects = list(), list()
+        # the dipole of a cell is the sum of its membrane currents times
+        # their position along the dipole axis, a sparse (cells x currents)
+        # projection
+        dipole_idx, dipole_z, dipole_rows = list(), list(), list()
+        self._imem_cells = list()
+        for cell in self.cells:
+            is_pyr = cell.celltype in ('L5_pyramidal', 'L2_pyramidal')
+            if not ((is_pyr and compute_dipoles) or self.net.rec_arrays):
+                continue
+            sec_list = h.SectionList()
+            sec_list.wholetree(sec=cell.soma)
+            for sect in sec_list:
+                sects.append(sect)
+                for seg in sect:
+                    if is_pyr and compute_dipoles:
+                        dipole_idx.append(len(segs))
+                        dipole_z.append(cell._get_dipole_z(seg))
+                        dipole_rows.append(len(self._imem_cells))
+                    segs.append(seg)
+            if is_pyr and compute_dipoles:
+                self._imem_cells.append(cell)
+
+        # currents injected by electrodes (tonic biases) are not part of
+        # i_membrane_ and enter the dipoles with the opposite sign
+        stims = list()
+        for row, cell in enumerate(self._imem_cells):
+            for stim in cell.tonic_biases:
+                dipole_idx.append(len(segs) + len(stims))
+                dipole_z.append(-cell._get_dipole_z(stim.get_segment()))
+                dipole_rows.append(row)
+                stims.append(stim)
+
+        n_times = self.net.cell_response.times.size
+        self._imem_segs = segs
+        self._imem_stims = stims
+        # the pointers to i_membrane_ stay valid through h.finitialize() as
+        # long as the sections do not change
+        ptrs = ([seg._ref_i_membrane_ for seg in segs] +
+                [stim._ref_i for stim in stims])
+        self._imem_ptrs = h.PtrVector(len(ptrs))
+        for idx, ptr in enumerate(ptrs):
+            self._imem_ptrs.pset(idx, ptr)
+        # the gathered currents are read through a view of their Vector,
+        # whose size never changes
+        self._imem_values = h.Vector(len(ptrs))
+        self._imem = self._imem_values.as_numpy()
+        if compute_dipoles:
+            self._imem_projection = csr_matrix(
+                (dipole_z, (dipole_rows, dipole_idx)),
+                shape=(len(self._imem_cells), len(ptrs)))
+            self._imem_dipoles = np.zeros((len(self._imem_cells), n_times))
+
+        if self.net.rec_arrays:
+            seg_starts, seg_ends = np.zeros((0, 3)), np.zeros((0, 3))
+            if len(sects) > 0:
+                seg_ends = [_get_segment_ends(sect) for sect in sects]
+                seg_starts = np.concatenate([ends[0] for ends in seg_ends])
+                seg_ends = np.concatenate([ends[1] for ends in seg_ends])
+            # the contacts of all arrays are stacked into one matrix
+            self._r_transfer = np.concatenate([_transfer_resistance(
+                seg_starts, seg_ends, rec_array.positions,
+                rec_array.conductivity, rec_array.method,
+                rec_array.min_distance)
+                for rec_array in self.net.rec_arrays.values()])
+            self._rec_array_voltages = np.zeros((len(self._r_transfer),
+                                                 n_times))
+
+        # the projections are only stored between _start_imem and
+        # _stop_imem, not during the warm-up
+        self._imem_step = None
+        self._imem_callback = self._project_imem
+        _CVODE.extra_scatter_gather(0, self._imem_callback)
+
+    def _project_imem(self):
+        """Project the membrane currents of the last time step.
+
+        NEURON calls it after each step, once the membrane currents are
+        updated.
+        """
+        step = self._imem_step
+        if step is None or step >= self.net.cell_response.times.size:
+            return
+        self._imem_ptrs.gather(self._imem_values)
+        if self._imem_dipoles is not None:
+            self._imem_dipoles[:, step] = self._imem_projection @ self._imem
+        if self._rec_array_voltages is not None:
+            self._rec_array_voltages[:, step] = \
+                self._r_transfer @ self._imem[:len(self._imem_segs)]
+        self._imem_step = step + 1
+
+    def _start_imem(self, step=1):
+        """Start projecting the membrane currents, call after finitialize.
+
+        The projections are stored from time sample step on.
+        """
+        # the membrane currents right after initialization do not balance,
+        # the first sample is 0 as recorded by the dipole mechanisms
+        self._imem_step = step
+
+    def _stop_imem(self):
+        """Stop projecting the membrane currents."""
+        self._imem_step = None
+        if self._imem_dipoles is not None:
+            for cell, cell_dipole in zip(self._imem_cells,
+                                         self._imem_dipoles):
+                cell.dipole.from_python(cell_dipole)
+
+    def _setup_grid_recordings(self):
+        """Record the cells with variable time steps.
+
+        The dipole mechanisms sum the axial currents of the segments after
+        each fixed time step. With variable time steps, the same sums are
+        computed from the membrane potentials of the nodes. These and the
+        somatic recordings are sampled at every step of each cell and
+        linearly interpolated at the times of the cell response.
+        """
+        record_gids = set(self._record_gids)
+        record_vsoma = self.net.params['record_vsoma']
+        record_isoma = self.net.params['record_isoma']
+        self._grid_cells = list()
+        # per cell: the time of its steps, the recorded variables with their
+        # vectors and the weights of the potentials of the nodes in its
+        # dipole (None if it has no dipole)
+        self._grid_tvecs = list()
+        self._grid_sources = list()
+        self._grid_vecs = list()
+        self._grid_weights = list()
+        for cell in self.cells:
+            weights = None
+            sources, vecs = list(), list()
+            if cell.celltype in ('L5_pyramidal', 'L2_pyramidal') and \
+                    self._record_dipole:
+                # the recording after each step is replaced by the samples
+                cell.dipole.play_remove()
+                weights = list()
+                for dpp in cell.dipole_pp:
+                    sect = dpp.get_segment().sec
+                    # the axial current between two successive nodes is the
+                    # difference of their potentials scaled by ztan / ri of
+                    # the mechanism at the second node
+                    mechs = [seg.dipole for seg in sect] + [dpp]
+                    coefs = np.array([mech.ztan / mech.ri for mech in mechs])
+                    sect_weights = np.zeros(len(coefs) + 1)
+                    sect_weights[:-1] += coefs
+                    sect_weights[1:] -= coefs
+                    weights.extend(sect_weights)
+                    for node in sect.allseg():
+                        sources.append((node, 'v'))
+                        vecs.append(h.Vector().record(node._ref_v, sec=sect))
+                weights = np.array(weights)
+            if cell.gid in record_gids:
+                if record_vsoma:
+                    sources.append((cell.soma(0.5), 'v'))
+                    vecs.append(cell.rec_v)
+                if record_isoma:
+                    for key in cell.rec_i:
+                        sources.append((cell.synapses[key], 'i'))
+                        vecs.append(cell.rec_i[key])
+            if not vecs:
+                continue
+            self._grid_cells.append(cell)
+            # with lvardt, each cell has its own steps
+            self._grid_tvecs.append(h.Vector().record(h._ref_t,
+                                                      sec=cell.soma))
+            self._grid_sources.append(sources)
+            self._grid_vecs.append(vecs)
+            self._grid_weights.append(weights)
+
+    def _start_grid_recordings(self):
+        """Interpolate the recordings regularly, call after finitialize."""
+        n_times = self.net.cell_response.times.size
+        n_samples = self.net.cell_response.soma_times.size
+        self._grid_data = list()
+        for weights, vecs in zip(self._grid_weights, self._grid_vecs):
+            n_series = len(vecs)
+            if weights is not None:
+                n_series -= weights.size
+            # the dipole is on the grid of the dipoles and the somatic
+            # recordings (series) on the grid of record_dt. steps holds the
+            # number of samples of each grid so far
+            self._grid_data.append(dict(
+                series=np.zeros((n_series, n_samples)),
+                dipole=None if weights is None else np.zeros(n_times),
+                steps=[0, 0], last=None))
+
+    def _flush_grid_recordings(self, final=False):
+        """Interpolate the samples of the steps so far on the grids.
+
+        The last sample of each cell is kept for the next interpolation. If
+        final, the current state is the last sample and the grids are
+        completed.
+        """
+        times = self.net.cell_response.times
+        soma_times = self.net.cell_response.soma_times
+        for cell_idx, data in enumerate(self._grid_data):
+            vecs = [self._grid_tvecs[cell_idx]] + self._grid_vecs[cell_idx]
+            n_samples = min(int(vec.size()) for vec in vecs)
+            samples = _pop_samples(vecs, n_samples)
+            if final:
+                state = [h.t] + [getattr(obj, name) for obj, name in
+                                 self._grid_sources[cell_idx]]
+                samples = np.vstack([samples, state])
+            weights = self._grid_weights[cell_idx]
+            if weights is not None:
+                # the potentials of the nodes are replaced by the dipole
+                n_nodes = weights.size
+                samples = np.column_stack(
+                    [samples[:, :1], samples[:, 1:n_nodes + 1] @ weights,
+                     samples[:, n_nodes + 1:]])
+            if data['last'] is not None:
+                samples = np.vstack([data['last'], samples])
+            if samples.shape[0] == 0:
+                continue
+            data['last'] = samples[-1:]
+
+            sample_times = samples[:, 0]
+            outputs = [(data['series'], soma_times, 1, 1)]
+            if weights is not None:
+                outputs = [(data['dipole'][np.newaxis], times, 0, 1),
+                           (data['series'], soma_times, 1, 2)]
+            for out, grid, step_idx, col in outputs:
+                start = data['steps'][step_idx]
+                stop = grid.size
+                if not final:
+                    stop = np.searchsorted(grid, sample_times[-1],
+                                           side='right')
+                for row in range(out.shape[0]):
+                    out[row, start:stop] = np.interp(
+                        grid[start:stop], sample_times,
+                        samples[:, col + row])
+                data['steps'][step_idx] = max(start, stop)
+
+    def _stop_grid_recordings(self):
+        """Copy the interpolated recordings into the recordings of the
+        cells."""
+        self._flush_grid_recordings(final=True)
+        for cell_idx, data in enumerate(self._grid_data):
+            cell = self._grid_cells[cell_idx]
+            if data['dipole'] is not None:
+                cell.dipole.from_python(data['dipole'])
+            n_vecs = len(self._grid_vecs[cell_idx])
+            soma_vecs = self._grid_vecs[cell_idx][n_vecs - len(
+                data['series']):]
+            for vec, series in zip(soma_vecs, data['series']):
+                vec.from_python(series)
+
+    def _get_recordings(self):
+        """Get the vectors that grow during the simulation on this rank."""
+        recordings = [self._spike_times, self._spike_gids]
+        for cell in self.cells:
+            recordings.append(cell.rec_v)
+            recordings.extend(cell.rec_i.values())
+            if hasattr(cell, 'dipole'):
+                recordings.append(cell.dipole)
+        return recordings
+
+    def _save_checkpoint(self):
+        """Save the state of the simulation on this rank.
+
+        Returns
+        -------
+        checkpoint : dict
+            The state of the cells and the event queue ('state'), the sizes
+            of the recordings ('sizes') and the next time sample of the
+            membrane current projections ('imem_step').
+        """
+        state = h.SaveState()
+        state.save()
+        return {'state': state,
+                'sizes': [int(vec.size()) for vec in self._get_recordings()],
+                'imem_step': getattr(self, '_imem_step', None)}
+
+    def _restore_checkpoint(self, checkpoint):
+        """Continue the simulation from a checkpoint.
+
+        The recordings made since the checkpoint are discarded.
+        """
+        checkpoint['state'].restore()
+        for vec, size in zip(self._get_recordings(), checkpoint['sizes']):
+            vec.resize(size)
+        if self._use_imem:
+            self._start_imem(checkpoint['imem_step'])
+
+    def _silence_drives(self, drive_names):
+        """Remove the events of drives from their artificial cells."""
+        for drive_cell in self._drive_cells:
+            if any(drive_cell.gid in self.net.gid_ranges[name]
+                   for name in drive_names):
+                drive_cell.nrn_eventvec.resize(0)
+        if self._pattern_stim is not None:
+            self._pattern_silenced.update(
+                gid for name in drive_names
+                for gid in self.net.gid_ranges[name])
+            self._play_pattern()
+
+    def _inject_drive_events(self, events):
+        """Deliver the events of silenced drives to their targets.
+
+        Parameters
+        ----------
+        events : dict of list
+            The event times of each drive cell for each drive name. The
+            events before the current time are skipped.
+        """
+        src_events = dict()
+        for name, drive_events in events.items():
+            gid_range = self.net.gid_ranges[name]
+            for gid_idx, cell_events in enumerate(drive_events):
+                src_events[gid_range[gid_idx]] = cell_events
+                # the spikes of the PatternStim are added from these events
+                if gid_range[gid_idx] in self._pattern_events:
+                    self._pattern_events[gid_range[gid_idx]] = cell_events
+
+        # the events that the solver has already delivered at the start of
+        # its last time step are skipped
+        t_start = h.t - h.dt / 2.
+        for gid, cell_events in src_events.items():
+            src_events[gid] = [event_time for event_time in cell_events
+                               if event_time > t_start]
+
+        # the targets receive the events as they would from the artificial
+        # cells, after the delay of each connection
+        for ncs in self.ncs.values():
+            for nc in ncs:
+                for event_time in src_events.get(int(nc.srcgid()), []):
+                    nc.event(event_time + nc.delay)
+
+        # record the spikes of the artificial cells on this rank
+        for drive_cell in self._drive_cells:
+            for event_time in src_events.get(drive_cell.gid, []):
+                if event_time <= h.tstop:
+                    self._spike_times.append(event_time)
+                    self._spike_gids.append(drive_cell.gid)
+
+    def _run_bbsavestate(self, method, work_dir):
+        """Save or restore the state of the cells on this rank by gid.
+
+        BBSaveState writes the binary state of each cell to the directory
+        binbufout and reads it from binbufin, both relative to the working
+        directory.
+        """
+        bbss = h.BBSaveState()
+        # the events of the drives are delivered by _inject_drive_events
+        for drive_cell in self._drive_cells:
+            bbss.ignore(drive_cell.nrn_vecstim)
+        if self._pattern_stim is not None:
+            bbss.ignore(self._pattern_stim)
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            getattr(bbss, method)()
+        finally:
+            os.chdir(cwd)
+            # the ignored objects are kept by address across instances of
+            # BBSaveState, which the objects of later networks may reuse
+            bbss.ignore()
+
+    def _get_checkpoint_key(self, trial_idx):
+        """Hash the parameters, options and structure of a trial of the
+        network."""
+        options = {key: value for key, value in self._options.items()
+                   if key != 'run_control'}
+        fingerprint = [self.net.params, options, self.net.external_drives,
+                       self.net.external_biases, self.net.pos_dict,
+                       self._gid_list, trial_idx, _get_nhosts(),
+                       h.nrnversion()]
+        return hashlib.md5(json.dumps(fingerprint, sort_keys=True,
+                                      default=str).encode()).hexdigest()
+
+    def _write_checkpoint(self, checkpoint_dir, trial_idx, chunk_idx):
+        """Save the state of a trial on this rank to a file.
+
+        The file holds the state of the cells and of the events queued for
+        them, the recordings so far and the membrane current projections. The
+        checkpoint of the previous chunk is removed once all ranks have
+        saved theirs.
+        """
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        fname_prefix = op.join(checkpoint_dir, 'checkpoint-trial%d-rank%d'
+                               % (trial_idx, _get_rank()))
+        fname = '%s-chunk%d.npz' % (fname_prefix, chunk_idx)
+        tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+
+        recordings = [vec.as_numpy() for vec in self._get_recordings()]
+        data = dict(key=self._get_checkpoint_key(trial_idx),
+                    sizes=[len(rec) for rec in recordings],
+                    recordings=np.concatenate(recordings))
+
+        work_dir = tempfile.mkdtemp(dir=checkpoint_dir)
+        state_dir = op.join(work_dir, 'binbufout')
+        os.mkdir(state_dir)
+        self._run_bbsavestate('save_test_bin', work_dir)
+        for state_fname in os.listdir(state_dir):
+            with open(op.join(state_dir, state_fname), 'rb') as state_file:
+                data['state_' + state_fname] = np.frombuffer(
+                    state_file.read(), dtype=np.uint8)
+        shutil.rmtree(work_dir)
+        if self._use_imem:
+            data['imem_step'] = self._imem_step
+            if self._imem_dipoles is not None:
+                data['imem_dipoles'] = self._imem_dipoles
+            if self._rec_array_voltages is not None:
+                data['rec_array_voltages'] = self._rec_array_voltages
+
+        # written under a temporary name so that a killed run never leaves
+        # a partial checkpoint
+        with open(tmp_fname, 'wb') as checkpoint_file:
+            np.savez(checkpoint_file, **data)
+        os.replace(tmp_fname, fname)
+
+        _PC.barrier()
+        prev_fname = '%s-chunk%d.npz' % (fname_prefix, chunk_idx - 1)
+        if op.exists(prev_fname):
+            os.remove(prev_fname)
+
+    def _stop_soma_recordings(self):
+        """Stop the somatic recordings, e.g., to keep their events out of
+        the queue."""
+        for cell in self.cells:
+            cell.rec_v.play_remove()
+            for rec_i in cell.rec_i.values():
+                rec_i.play_remove()
+
+    def _start_soma_recordings(self):
+        """Start the somatic recordings of the recorded cells again."""
+        record_gids = set(self._record_gids)
+        for cell in self.cells:
+            if cell.gid in record_gids:
+                cell.record_soma(self.net.params['record_vsoma'],
+                                 self.net.params['record_isoma'],
+                                 self._options['record_dt'])
+
+    def _find_checkpoint(self, checkpoint_dir, trial_idx):
+        """Find the last checkpoint of a trial saved by all ranks.
+
+        Returns
+        -------
+        chunk_idx : int
+            The index of the chunk that ends at the checkpoint, 0 if there
+            is no checkpoint of the trial.
+        """
+        fname_prefix = 'checkpoint-trial%d-rank%d-chunk' % (trial_idx,
+                                                            _get_rank())
+        chunks = list()
+        if op.isdir(checkpoint_dir):
+            chunks = [int(fname[len(fname_prefix):-len('.npz')])
+                      for fname in os.listdir(checkpoint_dir)
+                      if fname.startswith(fname_prefix) and
+                      fname.endswith('.npz')]
+        # a rank only removes its previous checkpoint once all the ranks
+        # have saved the next one
+        return int(_PC.allreduce(max(chunks, default=0), 3))
+
+    def _read_checkpoint(self, checkpoint_dir, trial_idx, chunk_idx):
+        """Continue a trial from a checkpoint.
+
+        Call after the trial is initialized with its drives silenced and its
+        somatic recordings stopped if they are sampled every record_dt ms,
+        as their events cannot be restored. The event queue must not hold
+        any other events than those of the network (e.g., no progress
+        messages).
+        """
+        fname = op.join(checkpoint_dir, 'checkpoint-trial%d-rank%d-chunk%d.npz'
+                        % (trial_idx, _get_rank(), chunk_idx))
+        data = np.load(fname)
+        if str(data['key']) != self._get_checkpoint_key(trial_idx):
+            raise ValueError('The checkpoint %s is from a different '
+                             'simulation' % fname)
+
+        # the ranks restore the events in transit between their cells from
+        # the states of all the cells
+        work_dir = op.join(checkpoint_dir, 'restore-trial%d' % trial_idx)
+        state_dir = op.join(work_dir, 'binbufin')
+        os.makedirs(state_dir, exist_ok=True)
+        for key in data.files:
+            if key.startswith('state_'):
+                with open(op.join(state_dir, key[len('state_'):]),
+                          'wb') as state_file:
+                    state_file.write(data[key].tobytes())
+        _PC.barrier()
+        self._run_bbsavestate('restore_test_bin', work_dir)
+        _PC.barrier()
+        if _get_rank() == 0:
+            shutil.rmtree(work_dir)
+
+        # the recordings sampled every record_dt ms start again from the
+        # current time, which they sample next. Depending on the round-off
+        # of h.t, the checkpoint may already hold that sample.
+        record_dt = self._options['record_dt']
+        if record_dt is not None:
+            self._start_soma_recordings()
+            h.frecord_init()
+        recordings = np.split(data['recordings'],
+                              np.cumsum(data['sizes'])[:-1])
+        for vec, rec in zip(self._get_recordings(), recordings):
+            vec.from_python(rec)
+        if record_dt is not None:
+            n_samples = int(round(h.t / record_dt))
+            for cell in self.cells:
+                for vec in [cell.rec_v] + list(cell.rec_i.values()):
+                    if vec.size() > n_samples:
+                        vec.resize(n_samples)
+        if self._use_imem:
+            self._imem_step = int(data['imem_step'])
+            if self._imem_dipoles is not None:
+                self._imem_dipoles[:] = data['imem_dipoles']
+            if self._rec_array_voltages is not None:
+                self._rec_array_voltages[:] = data['rec_array_voltages']
+
+        self._inject_drive_events({
+            name: drive['events'][trial_idx]
+            for name, drive in self.net.external_drives.items()})
+
+    def _start_stop_checks(self):
+        """Start the checks of the stop criteria of a trial, call after
+        _initialize_trial."""
+        n_times = self.net.cell_response.times.size
+        self._stop_checks = dict(
+            n_times=0, n_spikes=0, t=-np.inf,
+            dpl_data=np.zeros((2, n_times)) if self._record_dipole else None,
+            spikes=np.empty((0, 2)))
+
+    def _check_stop_criteria(self, criteria):
+        """Check whether any of the stop criteria is met on all ranks.
+
+        Only the samples of the dipoles and the spikes since the last check
+        are reduced to rank 0, which adds them to those of the earlier checks
+        of the trial.
+
+        Returns
+        -------
+        stop : bool
+            Whether the trial stops at the current time.
+        """
+        from .dipole import Dipole
+
+        checks = self._stop_checks
+        # the samples before the current time are complete on all ranks
+        n_times = int(round(h.t / h.dt))
+        new_times = slice(checks['n_times'], n_times)
+        dpl_data = None
+        if self._record_dipole:
+            dpl_data = np.zeros((2, n_times - checks['n_times']))
+            if self._imem_dipoles is not None:
+                cell_dipoles = zip(self._imem_cells, self._imem_dipoles)
+            else:
+                cell_dipoles = [(cell, cell.dipole.as_numpy()) for cell in
+                                self.cells if cell.celltype in
+                                ('L5_pyramidal', 'L2_pyramidal')]
+            for cell, cell_dipole in cell_dipoles:
+                row = 0 if cell.celltype == 'L2_pyramidal' else 1
+                dpl_data[row] += cell_dipole[new_times]
+            dpl_data = _reduce_to_root(dpl_data)
+
+        n_spikes = int(self._spike_times.size())
+        spikes = np.empty((n_spikes - checks['n_spikes'], 2))
+        spikes[:, 0] = self._spike_times.as_numpy()[checks['n_spikes']:]
+        spikes[:, 1] = self._spike_gids.as_numpy()[checks['n_spikes']:]
+        if self._pattern_stim is not None:
+            spikes = np.concatenate([spikes, self._get_pattern_spikes(
+                h.t, t_start=checks['t'])])
+        spikes = _gather_rows_to_root(spikes)
+
+        stop = False
+        if _get_rank() == 0:
+            dpl = None
+            if dpl_data is not None:
+                checks['dpl_data'][:, new_times] = dpl_data
+                dpl_L2, dpl_L5 = checks['dpl_data'][:, :n_times]
+                dpl = Dipole(self.net.cell_response.times[:n_times],
+                             np.c_[dpl_L2 + dpl_L5, dpl_L2, dpl_L5])
+            checks['spikes'] = np.concatenate([checks['spikes'], spikes])
+            spikes = checks['spikes']
+            stop = any(criterion(h.t, spikes[:, 0], spikes[:, 1].astype(int),
+                                 dpl) for criterion in criteria)
+        checks.update(n_times=n_times, n_spikes=n_spikes, t=h.t)
+        stop = _PC.allreduce(int(stop), 2) > 0
+        if stop:
+            self._stop_time = h.t
+        return stop
+
+    def _start_stream(self, stream_dir, trial_idx):
+        """Open the files that the recordings of a trial are appended to.
+
+        Each rank writes its own files. The spikes are stored as rows of
+        (time, gid) and the traces with one row per time sample.
+        """
+        os.makedirs(stream_dir, exist_ok=True)
+        fname_prefix = op.join(stream_dir, 'trial%d-rank%d-'
+                               % (trial_idx, _get_rank()))
+        self._stream = {
+            'fname_prefix': fname_prefix,
+            'files': {kind: open(fname_prefix + kind + '.bin', 'wb') for kind
+                      in ('spikes', 'dipoles', 'vsoma', 'isoma',
+                          'cell_dipoles')},
+            'n_times': 0,
+            'n_samples': 0}
+        self._set_soma_recordings(0)
+        self._cell_dipole_gids = list()
+        if self._options['record_cell_dipoles']:
+            self._cell_dipole_gids = [
+                cell.gid for cell in self.cells
+                if cell.celltype in ('L5_pyramidal', 'L2_pyramidal')]
+
+    def _flush_recordings(self):
+        """Append the recordings to the files of the stream and clear them.
+
+        The samples that some of the somatic recordings are still missing
+        are kept for the next flush.
+        """
+        stream = self._stream
+        files = stream['files']
+
+        spikes = np.empty((int(self._spike_times.size()), 2))
+        spikes[:, 0] = self._spike_times.as_numpy()
+        spikes[:, 1] = self._spike_gids.as_numpy()
+        files['spikes'].write(spikes.tobytes())
+        self._spike_times.resize(0)
+        self._spike_gids.resize(0)
+
+        # the dipoles are summed in the same order as by aggregate_data,
+        # the ranks without pyramidal cells write zeros up to the current
+        # time
+        n_times = int(round(h.t / h.dt)) + 1 - stream['n_times']
+        if self._record_dipole:
+            pyr_cells = [cell for cell in self.cells if cell.celltype in
+                         ('L5_pyramidal', 'L2_pyramidal')]
+            cell_dipoles = _pop_samples([cell.dipole for cell in pyr_cells],
+                                        n_times)
+            dipoles = np.zeros((n_times, 2))
+            for cell, cell_dipole in zip(pyr_cells, cell_dipoles.T):
+                col = 0 if cell.celltype == 'L2_pyramidal' else 1
+                dipoles[:, col] += cell_dipole
+            files['dipoles'].write(dipoles.tobytes())
+            if self._cell_dipole_gids:
+                files['cell_dipoles'].write(
+                    cell_dipoles.astype(np.float32).tobytes())
+        stream['n_times'] += n_times
+
+        recordings = list(self._vsoma.values()) + [
+            rec_i for gid in self._isoma for rec_i in
+            self._isoma[gid].values()]
+        n_samples = min([int(vec.size()) for vec in recordings], default=0)
+        vsoma = _pop_samples(recordings[:len(self._vsoma)], n_samples)
+        isoma = _pop_samples(recordings[len(self._vsoma):], n_samples)
+        files['vsoma'].write(vsoma.tobytes())
+        files['isoma'].write(isoma.tobytes())
+        stream['n_samples'] += n_samples
+
+    def _stop_stream(self):
+        """Append the last recordings to the files of the stream."""
+        n_samples = len(self.net.cell_response.soma_times)
+        self._set_soma_recordings(n_samples - self._stream['n_samples'])
+        self._flush_recordings()
+        for stream_file in self._stream['files'].values():
+            stream_file.close()
+
+    def _read_stream(self, n_vsoma, n_isoma):
+        """Map the files of a stream to arrays with one row per trace.
+
+        The dipoles and spikes are read into memory.
+        """
+        fname_prefix = self._stream['fname_prefix']
+        self._stream = None
+
+        def _map_rows(kind, n_rows, n_cols, dtype=np.float64):
+            if n_rows == 0:
+                return np.empty((0, n_cols), dtype=dtype)
+            return np.memmap(fname_prefix + kind + '.bin', dtype=dtype,
+                             mode='r', shape=(n_cols, n_rows)).T
+
+        n_times = self.net.cell_response.times.size
+        n_samples = len(self.net.cell_response.soma_times)
+        dpl_data = None
+        if self._record_dipole:
+            dpl_data = np.fromfile(fname_prefix + 'dipoles.bin').reshape(
+                n_times, 2).T.copy()
+        spikes = np.fromfile(fname_prefix + 'spikes.bin').reshape(-1, 2)
+        vsoma = _map_rows('vsoma', n_vsoma, n_samples)
+        isoma = _map_rows('isoma', n_isoma, n_samples)
+        cell_dipoles = _map_rows('cell_dipoles', len(self._cell_dipole_gids),
+                                 n_times, dtype=np.float32)
+        return dpl_data, spikes, vsoma, isoma, cell_dipoles
 
     # setup spike recording for this node
     def _record_spikes(self):
 
         # iterate through gids on this node and
         # set to record spikes in spike time vec and id vec
-        # agnostic to type of source, will sort that out later
-        for gid in self._gid_list:
+        # agnostic to type of source, will sort that out later. The spikes
+        # of the drives are their known event times, they can be left out.
+        gids = self._gid_list
+        if not self._options['record_drive_spikes']:
+            gids = [cell.gid for cell in self.cells]
+        for gid in gids:
             if _PC.gid_exists(gid):
                 _PC.spike_record(gid, self._spike_times, self._spike_gids)
 
     # aggregate recording all the somatic voltages for pyr
     def aggregate_data(self):
         """Aggregate somatic currents, voltages, and dipoles."""
+        n_times, n_samples = self._get_n_samples()
+        if self._record_dipole:
+            self._aggregate_dipoles(n_times)
+        self._set_soma_recordings(n_samples)
+
+    def _aggregate_dipoles(self, n_times):
+        """Sum the dipoles of the cells by cell type."""
+        # copy the dipole of each cell into one row of a matrix
+        pyr_cells = list()
+        if self._options['record_cell_dipoles']:
+            pyr_cells = [cell for cell in self.cells if
+                         cell.celltype in ('L5_pyramidal', 'L2_pyramidal')]
         for cell in self.cells:
             if cell.celltype in ('L5_pyramidal', 'L2_pyramidal'):
-                self.dipoles[cell.celltype].add(cell.dipole)
+                # the projections of the membrane currents are preallocated
+                # up to tstop
+                cell.dipole.resize(n_times)
+        self._cell_dipoles = np.empty((len(pyr_cells), n_times),
+                                      dtype=np.float32)
+        self._cell_dipole_gids = [cell.gid for cell in pyr_cells]
+        for row, cell in zip(self._cell_dipoles, pyr_cells):
+            row[:] = cell.dipole.as_numpy()
+
+        for dipoles in self._replica_dipoles:
+            for dpl in dipoles.values():
+                dpl.resize(n_times)
+                dpl.fill(0.)
+        for cell in self.cells:
+            if cell.celltype in ('L5_pyramidal', 'L2_pyramidal'):
+                replica, _ = self._split_gid(cell.gid)
+                self._replica_dipoles[replica][cell.celltype].add(cell.dipole)
+
+    def _get_n_samples(self):
+        """Get the number of samples of the dipoles and of the somatic
+        recordings, which end early if a stop criterion was met."""
+        times = self.net.cell_response.times
+        soma_times = self.net.cell_response.soma_times
+        if self._stop_time is None:
+            return times.size, len(soma_times)
+        n_times = int(round(self._stop_time / h.dt)) + 1
+        n_samples = np.searchsorted(soma_times, times[n_times - 1],
+                                    side='right')
+        return n_times, int(n_samples)
+
+    def _set_soma_recordings(self, n_samples):
+        """Collect the somatic recordings of the recorded cells by gid.
+
+        The recordings with less than n_samples samples get the current
+        state as their last sample.
+        """
+        record_gids = set(self._record_gids)
+        # new dicts, the data of a previous branch may still refer to the old
+        self._vsoma = dict()
+        self._isoma = dict()
+        for cell in self.cells:
+            if cell.gid not in record_gids:
+                continue
+            # when sampling every Dt ms, NEURON may not record at t == tstop
+            # because of round-off in t. The final state is that sample.
+            if self.net.params['record_vsoma']:
+                if cell.rec_v.size() < n_samples:
+                    cell.rec_v.append(cell.soma(0.5).v)
+                self._vsoma[cell.gid] = cell.rec_v
+            if self.net.params['record_isoma']:
+                for key, rec_i in cell.rec_i.items():
+                    if rec_i.size() < n_samples:
+                        rec_i.append(cell.synapses[key].i)
+                self._isoma[cell.gid] = cell.rec_i
+
+    def _gather_data(self):
+        """Gather the spikes and somatic recordings of all ranks on rank 0.
+
+        Each rank packs its data into contiguous arrays with one row per
+        spike or recorded trace, so that only the small row labels are
+        pickled. Call after aggregate_data().
+
+        Returns
+        -------
+        dpl_data : array, shape (n_replicas, 2, n_times) | None
+            The L2 and L5 dipoles of each replica summed over all ranks. None
+            if rank > 0 or if the dipoles are not recorded.
+        """
+        vsoma_labels = list(self._vsoma)
+        isoma_labels = [(gid, key) for gid in self._isoma
+                        for key in self._isoma[gid]]
+        if self._stream is not None:
+            dpl_data, spikes, vsoma, isoma, cell_dipoles = \
+                self._read_stream(len(vsoma_labels), len(isoma_labels))
+            if dpl_data is not None:
+                dpl_data = dpl_data[np.newaxis]
+        else:
+            # copy as as_numpy() shares memory with the h.Vector
+            dpl_data = None
+            if self._record_dipole:
+                dpl_data = np.array([[
+                    dipoles['L2_pyramidal'].as_numpy(),
+                    dipoles['L5_pyramidal'].as_numpy()]
+                    for dipoles in self._replica_dipoles])
+
+            spikes = np.empty((int(self._spike_times.size()), 2))
+            spikes[:, 0] = self._spike_times.as_numpy()
+            spikes[:, 1] = self._spike_gids.as_numpy()
+
+            _, n_samples = self._get_n_samples()
+            vsoma = np.empty((len(vsoma_labels), n_samples))
+            for row, gid in zip(vsoma, vsoma_labels):
+                row[:] = self._vsoma[gid].as_numpy()
+            isoma = np.empty((len(isoma_labels), n_samples))
+            for row, (gid, key) in zip(isoma, isoma_labels):
+                row[:] = self._isoma[gid][key].as_numpy()
+            cell_dipoles = self._cell_dipoles
+
+        if dpl_data is not None:
+            dpl_data = _reduce_to_root(dpl_data)
+        spikes = _gather_rows_to_root(spikes)
+        vsoma_labels = _gather_labels_to_root(vsoma_labels)
+        isoma_labels = _gather_labels_to_root(isoma_labels)
+        cell_dipole_gids = _gather_labels_to_root(self._cell_dipole_gids)
+        vsoma = _gather_rows_to_root(vsoma)
+        isoma = _gather_rows_to_root(isoma)
+        cell_dipoles = _gather_rows_to_root(cell_dipoles)
+
+        # the potentials of the extracellular arrays add up over the ranks
+        rec_array_voltages = None
+        if self._rec_array_voltages is not None:
+            n_times, _ = self._get_n_samples()
+            rec_array_voltages = _reduce_to_root(np.ascontiguousarray(
+                self._rec_array_voltages[:, :n_times]))
+
+        if _get_rank() != 0:
+            return None
+
+        # copies, the projections keep going into the same matrix
+        self._rec_arrays = dict()
+        contact_idx = 0
+        for name, rec_array in self.net.rec_arrays.items():
+            n_contacts = len(rec_array.positions)
+            self._rec_arrays[name] = rec_array_voltages[
+                contact_idx:contact_idx + n_contacts].copy()
+            contact_idx += n_contacts
+
+        order = np.argsort(cell_dipole_gids)
+        self._cell_dipole_gids = np.array(cell_dipole_gids, dtype=int)[order]
+        # indexing would copy the rows memory-mapped from a stream
+        if np.any(np.diff(order) < 0):
+            cell_dipoles = cell_dipoles[order]
+        self._cell_dipoles = cell_dipoles
+
+        self._all_spike_times = spikes[:, 0].copy()
+        self._all_spike_gids = spikes[:, 1].astype(int)
+        self._vsoma = dict(zip(vsoma_labels, vsoma))
+        self._isoma = dict()
+        for (gid, key), row in zip(isoma_labels, isoma):
+            self._isoma.setdefault(gid, dict())[key] = row
+        return dpl_data
 
-            self._vsoma[cell.gid] = cell.rec_v
-            self._isoma[cell.gid] = cell.rec_i
+    def _get_warmup_state(self, duration, cache_dir):
+        """Get the steady state of the network without its external drives.
 
-    def state_init(self):
-        """Initializes the state closer to baseline."""
+        The network is simulated with fixed steps for duration ms before the
+        trial, without the events of the external drives. The tonic biases
+        that start at 0 ms stay on for the whole warm-up. The state of each
+        rank is cached in cache_dir under a hash of the parameters and
+        structure of the network, of the sources of its mechanisms and of the
+        version of NEURON.
 
+        Parameters
+        ----------
+        duration : float
+            The duration (in ms) of the warm-up.
+        cache_dir : str | None
+            The directory of the cached states. If None, the state is not
+            cached.
+
+        Returns
+        -------
+        state : instance of h.SaveState
+            The state of the cells on this rank at the end of the warm-up.
+        """
+        params = {key: self.net.params[key] for key in self.net.params if
+                  any(fnmatch.fnmatch(key, pattern)
+                      for pattern in _WARMUP_PARAMS)}
+        options = {key: value for key, value in self._options.items() if
+                   any(fnmatch.fnmatch(key, pattern)
+                       for pattern in _WARMUP_OPTIONS)}
+        fingerprint = [params, options, self.net.external_biases,
+                       self.net.pos_dict,
+                       self._gid_list, self._use_imem, duration,
+                       _get_nhosts(), h.nrnversion(), _get_mod_hash()]
+        key = hashlib.md5(json.dumps(fingerprint, sort_keys=True,
+                                     default=str).encode()).hexdigest()
+        fname = None
+        if cache_dir is not None:
+            fname = op.join(cache_dir, 'warmup-%s-rank%d.dat'
+                            % (key, _get_rank()))
+
+        state = h.SaveState()
+        # all ranks must agree to either read or simulate the states
+        if fname is not None and _PC.allreduce(float(op.exists(fname)), 3):
+            state_file = h.File()
+            state_file.ropen(fname)
+            state.fread(state_file)
+            state_file.close()
+            return state
+
+        # the warm-up ends at 0 ms, so that the synapses never see the events
+        # of the trial as earlier than those of the warm-up. The tonic biases
+        # of the network are off on negative times, those that start at 0 ms
+        # are continued over the warm-up by temporary copies.
+        warmup_biases = list()
         for cell in self.cells:
-            seclist = h.SectionList()
-            seclist.wholetree(sec=cell.soma)
-            for sect in seclist:
-                for seg in sect:
-                    if cell.celltype == 'L2_pyramidal':
-                        seg.v = -71.46
-                    elif cell.celltype == 'L5_pyramidal':
-                        if sect.name() == 'L5Pyr_apical_1':
-                            seg.v = -71.32
-                        elif sect.name() == 'L5Pyr_apical_2':
-                            seg.v = -69.08
-                        elif sect.name() == 'L5Pyr_apical_tuft':
-                            seg.v = -67.30
-                        else:
-                            seg.v = -72.
-                    elif cell.celltype == 'L2_basket':
-                        seg.v = -64.9737
-                    elif cell.celltype == 'L5_basket':
-                        seg.v = -64.9737
-
-    def move_cells_to_pos(self):
-        """Move cells 3d positions to positions used for wiring."""
+            for bias in cell.tonic_biases:
+                if getattr(bias, 'del') > 0:
+                    continue
+                warmup_bias = h.IClamp(bias.get_segment())
+                setattr(warmup_bias, 'del', -duration)
+                warmup_bias.dur = duration
+                warmup_bias.amp = bias.amp
+                warmup_biases.append(warmup_bias)
+        for drive_cell in self._drive_cells:
+            drive_cell.nrn_vecstim.play()
+        if self._pattern_stim is not None:
+            self._play_pattern(silence_all=True)
+
+        # as in the steady state initialization of NEURON, the warm-up is
+        # integrated with fixed steps: CVODE does not stop at the onset of
+        # the biases at 0 ms when it starts from a negative time
+        cvode_active = _CVODE.active()
+        _CVODE.active(0)
+        h.finitialize()
+        # fcurrent() passes the new time on to the threads of NEURON
+        h.t = -duration
+        h.fcurrent()
+        _PC.psolve(0.)
+        state.save()
+
+        del warmup_biases
+        _CVODE.active(cvode_active)
+        for drive_cell in self._drive_cells:
+            drive_cell.nrn_vecstim.play(drive_cell.nrn_eventvec)
+        if self._pattern_stim is not None:
+            self._play_pattern()
+        self._spike_times.resize(0)
+        self._spike_gids.resize(0)
+        if fname is None:
+            return state
+
+        # written under a temporary name so that trials running in parallel
+        # never read a partial file
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+        state_file = h.File()
+        state_file.wopen(tmp_fname)
+        state.fwrite(state_file)
+        state_file.close()
+        os.replace(tmp_fname, fname)
+        return state
+
+    def state_init(self):
+        """Initializes the state closer to baseline.
+
+        The initial membrane potential of each section is given by the
+        parameter '<cell name>_<section>_v_init' (e.g. 'L5Pyr_apical1_v_init').
+        The potentials are resolved once per cell type into a table of the
+        sections of its cells, which is assigned a section at a time. The
+        nodes at the ends of the sections get the potentials they had in the
+        new cells of the build, so that a network that was simulated starts
+        from the same state as a new one.
+        """
+        v_tables = dict()
         for cell in self.cells:
-            cell.move_to_pos()
+            sections = dict(getattr(cell, 'dends', dict()), soma=cell.soma)
+            if cell.name not in v_tables:
+                v_tables[cell.name] = self._get_v_table(cell, sections)
+            v_sections, v_ends = v_tables[cell.name]
+            # assigning sect.v also sets the nodes at the ends of the
+            # section, the children go first so that a parent sets the
+            # nodes it shares with them
+            for key, v in v_sections:
+                sections[key].v = v
+            for key, x, v in v_ends:
+                sections[key](x).v = v
+
+    def _get_v_table(self, cell, sections):
+        """Resolve the initial membrane potentials of a cell type.
+
+        Parameters
+        ----------
+        cell : instance of _Cell
+            A cell of the type.
+        sections : dict
+            The sections of the cell by key (e.g. 'apical_1'), whose key
+            without underscores names the section in the parameters.
+
+        Returns
+        -------
+        v_sections : list of tuple
+            The key and the initial potential of each section, children
+            before their parents.
+        v_ends : list of tuple
+            The key of a section, the position (0 or 1) and the initial
+            potential of each node at the end of a section.
+        """
+        keys = {sect: key for key, sect in sections.items()}
+        sec_list = h.SectionList()
+        sec_list.wholetree(sec=cell.soma)
+        # wholetree lists parents before their children
+        sect_keys = [keys[sect] for sect in sec_list][::-1]
+        v_sections = [(key, self.net.params['%s_%s_v_init' % (
+            cell.name, key.replace('_', ''))]) for key in sect_keys]
+        # the ends are the node at 1 of each section and at 0 of the root,
+        # their potentials are read from the first cell of the type once
+        if cell.name not in self._v_ends:
+            ends = [(key, 1) for key in sect_keys] + [(sect_keys[-1], 0)]
+            self._v_ends[cell.name] = [(key, x, sections[key](x).v)
+                                       for key, x in ends]
+        return v_sections, self._v_ends[cell.name]
 
     def _clear_neuron_objects(self):
         """Clear up NEURON internal gid information.
@@ -658,26 +2323,57 @@ class NetworkBuilder(object):
                             del nc
 
         self._gid_list = list()
+        self._record_gids = list()
         self.cells = list()
-
-    def get_data_from_neuron(self):
-        """Get copies of spike data that are pickleable"""
-
-        vsoma_py = dict()
-        for gid, rec_v in self._vsoma.items():
-            vsoma_py[gid] = rec_v.to_python()
-
-        isoma_py = dict()
-        for gid, rec_i in self._isoma.items():
-            isoma_py[gid] = {key: rec_i.to_python()
-                             for key, rec_i in rec_i.items()}
+        self._pattern_gids = list()
+        self._pattern_events = dict()
+        self._pattern_stim = None
+        # the segments would keep the sections of the cells alive, and the
+        # projection of the membrane currents the NetworkBuilder
+        if getattr(self, '_imem_callback', None) is not None:
+            _CVODE.extra_scatter_gather_remove(self._imem_callback)
+            self._imem_callback = None
+        self._imem_segs = list()
+        self._imem_stims = list()
+        self._imem_cells = list()
+        self._imem_ptrs = None
+
+    def get_data_from_neuron(self, replica=0):
+        """Get copies of spike data that are pickleable
+
+        The data are NumPy arrays gathered on rank 0, which pickle as
+        contiguous buffers rather than lists of Python floats. With several
+        replicas, the data of one replica are returned with the gids of the
+        network.
+        """
 
         from copy import deepcopy
-        data = (self._all_spike_times.to_python(),
-                self._all_spike_gids.to_python(),
+        spike_times, spike_gids = self._all_spike_times, self._all_spike_gids
+        vsoma, isoma = self._vsoma, self._isoma
+        cell_dipoles = self._cell_dipoles
+        cell_dipole_gids = self._cell_dipole_gids
+        if self._n_replicas > 1:
+            offset = replica * self.net._n_gids
+            in_replica = spike_gids // self.net._n_gids == replica
+            spike_times = spike_times[in_replica]
+            spike_gids = spike_gids[in_replica] - offset
+            vsoma = {gid - offset: vsoma[gid] for gid in vsoma
+                     if self._split_gid(gid)[0] == replica}
+            isoma = {gid - offset: isoma[gid] for gid in isoma
+                     if self._split_gid(gid)[0] == replica}
+            cell_dipole_gids = np.asarray(cell_dipole_gids, dtype=int)
+            in_replica = cell_dipole_gids // self.net._n_gids == replica
+            cell_dipoles = cell_dipoles[in_replica]
+            cell_dipole_gids = cell_dipole_gids[in_replica] - offset
+        data = (spike_times,
+                spike_gids,
                 deepcopy(self.net.gid_ranges),
-                deepcopy(vsoma_py),
-                deepcopy(isoma_py))
+                vsoma,
+                isoma,
+                cell_dipoles,
+                cell_dipole_gids,
+                self._rec_arrays,
+                self._stop_time)
         return data
 
     def _clear_last_network_objects(self):
@@ -690,3 +2386,7 @@ class NetworkBuilder(object):
 
         self._clear_neuron_objects()
         _LAST_NETWORK = self
+
+        # the cells refer to themselves through their sections, so only the
+        # garbage collector frees the NEURON objects of the previous network
+        gc.collect()
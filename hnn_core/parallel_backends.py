@@ -19,49 +19,155 @@ from time import sleep
 _BACKEND = None
 
 
-def _clone_and_simulate(net, trial_idx):
+def _clone_and_simulate(net, trial_idx, n_replicas=1, sweep_group=None,
+                        options=None):
     """Run a simulation including building the network
 
     This is used by both backends. MPIBackend calls this in mpi_child.py, once
-    for each trial (blocking), and JoblibBackend calls this for each trial
-    (non-blocking)
+    for each batch of trials (blocking), and JoblibBackend calls this for each
+    batch of trials (non-blocking). The n_replicas trials from trial_idx on
+    are simulated together as replicas of the network, the data of each
+    trial is returned in a list. In a sweep, the batch is simulated for each
+    candidate of sweep_group with the weights of its connections and the
+    events of its drives, and the data of each trial is labelled by the
+    candidate and trial indices.
+    The options of the simulation are passed to NetworkBuilder.
     """
 
     # avoid relative lookups after being forked (Joblib)
     from hnn_core.network_builder import NetworkBuilder
     from hnn_core.network_builder import _simulate_single_trial
+    from hnn_core.network_builder import _simulate_branches
+
+    neuron_net = NetworkBuilder(net, trial_idx=trial_idx,
+                                n_replicas=n_replicas, options=options)
+    if neuron_net._options['branches']:
+        return [_simulate_branches(neuron_net, trial_idx)]
+    if sweep_group is not None:
+        sim_data = list()
+        for group_idx, (candidate_idx, weights, drives) in enumerate(
+                sweep_group):
+            neuron_net.update_connections(weights)
+            neuron_net._update_drives(drives)
+            if group_idx > 0:
+                neuron_net.state_init()
+            dpls = _simulate_single_trial(neuron_net, trial_idx)
+            sim_data.extend(((candidate_idx, trial_idx + replica),
+                             (dpl, neuron_net.get_data_from_neuron(replica)))
+                            for replica, dpl in enumerate(dpls))
+        return sim_data
+    dpls = _simulate_single_trial(neuron_net, trial_idx)
+
+    return [(dpl, neuron_net.get_data_from_neuron(replica))
+            for replica, dpl in enumerate(dpls)]
+
+
+def _get_trial_batches(n_trials, ensemble_size):
+    """Split the trials into batches of consecutive trials that are
+    simulated together, with ensemble_size trials per batch.
+
+    Returns
+    -------
+    batches : list of tuple
+        The index of the first trial and the number of trials of each batch.
+    """
+    return [(trial_idx, min(ensemble_size, n_trials - trial_idx))
+            for trial_idx in range(0, n_trials, ensemble_size)]
 
-    neuron_net = NetworkBuilder(net, trial_idx=trial_idx)
-    dpl = _simulate_single_trial(neuron_net, trial_idx)
-
-    spikedata = neuron_net.get_data_from_neuron()
 
-    return dpl, spikedata
+def _get_sim_jobs(net, n_trials, options):
+    """Get the batches of trials to simulate with the network of each.
 
+    Without a sweep, these are the batches of trials of net. In a sweep,
+    these are the batches of trials of the network of each group of
+    candidates in options['sweep'], for all the candidates of the group.
 
-def _gather_trial_data(sim_data, net, n_trials, postproc):
+    Returns
+    -------
+    jobs : generator of tuple
+        The arguments of _clone_and_simulate for each batch: the network,
+        the index of the first trial, the number of trials, the group of
+        candidates in a sweep (None otherwise) and the options.
+    """
+    batches = _get_trial_batches(n_trials, options['ensemble_size'])
+    if not options.get('sweep'):
+        for trial_idx, n_replicas in batches:
+            yield net, trial_idx, n_replicas, None, options
+        return
+    # the networks of the other groups are not passed to each job
+    job_options = dict(options, sweep=None)
+    for job_net, sweep_group in options['sweep']:
+        for trial_idx, n_replicas in batches:
+            yield job_net, trial_idx, n_replicas, sweep_group, job_options
+
+
+def _post_proc_dipole(dpl, params, warmup=None):
+    """Scale and smooth a Dipole with the parameters of its network."""
+    winsz = params['dipole_smooth_win'] / params['dt']
+    dpl.post_proc(params['N_pyr_x'], params['N_pyr_y'], winsz,
+                  params['dipole_scalefctr'], warmup)
+
+
+def _iter_sweep_data(sim_data, n_trials):
+    """Yield the index of each candidate of a sweep and the data of its
+    trials as soon as all of them are in sim_data."""
+    pending = dict()
+    for (candidate_idx, trial_idx), trial_data in sim_data:
+        candidate_data = pending.setdefault(candidate_idx, dict())
+        candidate_data[trial_idx] = trial_data
+        if len(candidate_data) == n_trials:
+            del pending[candidate_idx]
+            yield candidate_idx, [candidate_data[trial_idx]
+                                  for trial_idx in range(n_trials)]
+
+
+def _gather_trial_data(sim_data, net, n_trials, postproc, options):
     """Arrange data by trial
 
     To be called after simulate(). Returns list of Dipoles, one for each trial,
-    and saves spiking info in net (instance of Network).
+    and saves spiking info in net (instance of Network). The list is empty if
+    the dipoles were not recorded. If the trials were
+    simulated in branches, the data of the trials is only rearranged by
+    branch. In a sweep, the generator of the data of the trials of each
+    candidate is returned, without post-processing.
     """
+    if options.get('branches'):
+        return [[trial_data[branch_idx] for trial_data in sim_data]
+                for branch_idx in range(len(options['branches']))]
+    if options.get('sweep'):
+        return _iter_sweep_data(sim_data, n_trials)
+
     dpls = []
 
     for idx in range(n_trials):
-        dpls.append(sim_data[idx][0])
         spikedata = sim_data[idx][1]
-        net.cell_response._spike_times.append(spikedata[0])
-        net.cell_response._spike_gids.append(spikedata[1])
+        # CellResponse stores spikes as lists of lists
+        net.cell_response._spike_times.append(spikedata[0].tolist())
+        net.cell_response._spike_gids.append(spikedata[1].tolist())
         net.cell_response.update_types(net.gid_ranges)
         net.cell_response._vsoma.append(spikedata[3])
         net.cell_response._isoma.append(spikedata[4])
-
+        net.cell_response._cell_dipoles.append(spikedata[5])
+        net.cell_response._cell_dipole_gids = spikedata[6]
+        for name, voltages in spikedata[7].items():
+            net.rec_arrays[name]._voltages.append(voltages)
+        # the spikes of the drives are added from their events on request
+        drive_events = None
+        if not options['record_drive_spikes']:
+            t_end = spikedata[8]
+            if t_end is None:
+                t_end = net.params['tstop']
+            drive_events = ({name: (net.gid_ranges[name],
+                                    drive['events'][idx])
+                             for name, drive in net.external_drives.items()},
+                            t_end)
+        net.cell_response._drive_events.append(drive_events)
+
+        if sim_data[idx][0] is None:
+            continue
+        dpls.append(sim_data[idx][0])
         if postproc:
-            N_pyr_x = net.params['N_pyr_x']
-            N_pyr_y = net.params['N_pyr_y']
-            winsz = net.params['dipole_smooth_win'] / net.params['dt']
-            fctr = net.params['dipole_scalefctr']
-            dpls[-1].post_proc(N_pyr_x, N_pyr_y, winsz, fctr)
+            _post_proc_dipole(dpls[-1], net.params, options['warmup'])
 
     return dpls
 
@@ -121,9 +227,12 @@ class JoblibBackend(object):
                 self.n_jobs = 1
         if self.n_jobs == 1:
             my_func = func
-            parallel = list
+            parallel = iter
         else:
-            parallel = Parallel(self.n_jobs)
+            try:
+                parallel = Parallel(self.n_jobs, return_as='generator')
+            except TypeError:  # joblib < 1.3 returns all the results at once
+                parallel = Parallel(self.n_jobs)
             my_func = delayed(func)
 
         return parallel, my_func
@@ -141,7 +250,7 @@ class JoblibBackend(object):
 
         _BACKEND = self._old_backend
 
-    def simulate(self, net, n_trials, postproc=True):
+    def simulate(self, net, n_trials, postproc=True, options=None):
         """Simulate the HNN model
 
         Parameters
@@ -153,19 +262,35 @@ class JoblibBackend(object):
             Number of trials to simulate.
         postproc : bool
             If False, no postprocessing applied to the dipole
+        options : dict | None
+            The options of the simulation that are not parameters of the
+            network, as checked by simulate_dipole. If None, the defaults
+            of all the options.
 
         Returns
         -------
         dpl: list of Dipole
-            The Dipole results from each simulation trial
+            The Dipole results from each simulation trial. In a sweep, the
+            generator of the data of the trials of each candidate instead.
         """
 
+        from hnn_core.network_builder import _DEFAULT_OPTIONS
+
         dpls = []
+        if options is None:
+            options = _DEFAULT_OPTIONS
 
         parallel, myfunc = self._parallel_func(_clone_and_simulate)
-        sim_data = parallel(myfunc(net, idx) for idx in range(n_trials))
+        # the batches are simulated as their results are consumed, which
+        # lets a sweep store the data of each candidate as soon as it is done
+        sim_data = (trial_data for batch_data in
+                    parallel(myfunc(*job) for job in
+                             _get_sim_jobs(net, n_trials, options))
+                    for trial_data in batch_data)
+        if not options['sweep']:
+            sim_data = list(sim_data)
 
-        dpls = _gather_trial_data(sim_data, net, n_trials, postproc)
+        dpls = _gather_trial_data(sim_data, net, n_trials, postproc, options)
 
         return dpls
 
@@ -351,7 +476,7 @@ class MPIBackend(object):
         # unpickle the data
         return pickle.loads(data_pickled)
 
-    def simulate(self, net, n_trials, postproc=True):
+    def simulate(self, net, n_trials, postproc=True, options=None):
         """Simulate the HNN model in parallel on all cores
 
         Parameters
@@ -363,18 +488,30 @@ class MPIBackend(object):
             Number of trials to simulate.
         postproc: bool
             If False, no postprocessing applied to the dipole
+        options : dict | None
+            The options of the simulation that are not parameters of the
+            network, as checked by simulate_dipole. If None, the defaults
+            of all the options.
 
         Returns
         -------
         dpl: list of Dipole
-            The Dipole results from each simulation trial
+            The Dipole results from each simulation trial. In a sweep, the
+            generator of the data of the trials of each candidate instead.
         """
 
         # just use the joblib backend for a single core
         if self.n_procs == 1:
-            return JoblibBackend(n_jobs=1).simulate(net, postproc)
+            return JoblibBackend(n_jobs=1).simulate(net, n_trials, postproc,
+                                                    options)
+
+        from hnn_core.network_builder import _DEFAULT_OPTIONS
 
+        if options is None:
+            options = _DEFAULT_OPTIONS
         print("Running %d trials..." % (n_trials))
+        # the data of the previous simulation of this backend
+        self.proc_data_bytes = b''
         dpls = []
 
         # Split the command into shell arguments for passing to Popen
@@ -385,7 +522,7 @@ class MPIBackend(object):
 
         cmdargs = shlex.split(self.mpi_cmd_str, posix=use_posix)
 
-        pickled_net = base64.b64encode(pickle.dumps(net))
+        pickled_net = base64.b64encode(pickle.dumps((net, options)))
 
         # set some MPI environment variables
         my_env = os.environ.copy()
@@ -418,8 +555,11 @@ class MPIBackend(object):
         self.sel = selectors.DefaultSelector()
         self.sel.register(pipe_stdout_r, selectors.EVENT_READ,
                           self._read_stdout)
+        # the data is written to stderr after the output of the simulation,
+        # but it can be read before "end_of_sim" is read from stdout, so
+        # stderr is buffered until the end
         self.sel.register(pipe_stderr_r, selectors.EVENT_READ,
-                          self._read_stdout)
+                          self._read_stderr)
 
         data_len = 0
         completed = False
@@ -444,20 +584,14 @@ class MPIBackend(object):
                 callback = key.data
                 completion_signal = callback(key.fileobj, mask)
                 if completion_signal is not None:
-                    if completion_signal == "end_of_sim":
-                        # finishied receiving printable output
-                        # everything else received is data
-                        self.sel.unregister(pipe_stderr_r)
-                        self.sel.register(pipe_stderr_r, selectors.EVENT_READ,
-                                          self._read_stderr)
-                    elif isinstance(completion_signal, int):
+                    if isinstance(completion_signal, int):
                         data_len = completion_signal
                         self.sel.unregister(pipe_stdout_r)
                         completed = True
 
                         # there could still be data in stderr, so we return
                         # to waiting until the process ends
-                    else:
+                    elif completion_signal != "end_of_sim":
                         raise ValueError("Unrecognized signal received from "
                                          "MPI child")
 
@@ -471,11 +605,17 @@ class MPIBackend(object):
         os.close(pipe_stderr_r)
         os.close(pipe_stderr_w)
 
+        # the output to stderr precedes the data, if any
+        n_output_bytes = max(len(self.proc_data_bytes) - data_len, 0)
+        sys.stdout.write(self.proc_data_bytes[:n_output_bytes].decode(
+            errors='replace'))
+        self.proc_data_bytes = self.proc_data_bytes[n_output_bytes:]
+
         # if simulation failed, raise exception
         if proc.returncode != 0:
             raise RuntimeError("MPI simulation failed")
 
         sim_data = self._process_child_data(self.proc_data_bytes, data_len)
 
-        dpls = _gather_trial_data(sim_data, net, n_trials, postproc)
+        dpls = _gather_trial_data(sim_data, net, n_trials, postproc, options)
         return dpls
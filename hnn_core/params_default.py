@@ -166,8 +166,16 @@ def get_params_default(nprox=2, ndist=1):
         't0_pois': 0.,
         'T_pois': -1,
         'dt': 0.025,
+        # the integration method of the fixed time step: 0 for backward
+        # Euler, 2 for Crank-Nicolson (see NEURON's secondorder)
+        'secondorder': 0,
         'celsius': 37.0,
-        'threshold': 0.0  # firing threshold
+        'threshold': 0.0,  # firing threshold
+
+        # initial membrane potentials (mV) of the basket cells, those of the
+        # pyramidal cells are set with their cell-specific params
+        'L2Basket_soma_v_init': -64.9737,
+        'L5Basket_soma_v_init': -64.9737,
     }
 
     # grab cell-specific params and update p accordingly
@@ -278,6 +286,16 @@ def get_L2Pyr_params_default():
         'L2Pyr_dend_el_hh2': -65.,
         'L2Pyr_dend_gl_hh2': 4.26e-5,
         'L2Pyr_dend_gbar_km': 250.,
+
+        # Initial membrane potentials (mV)
+        'L2Pyr_soma_v_init': -71.46,
+        'L2Pyr_apicaltrunk_v_init': -71.46,
+        'L2Pyr_apical1_v_init': -71.46,
+        'L2Pyr_apicaltuft_v_init': -71.46,
+        'L2Pyr_apicaloblique_v_init': -71.46,
+        'L2Pyr_basal1_v_init': -71.46,
+        'L2Pyr_basal2_v_init': -71.46,
+        'L2Pyr_basal3_v_init': -71.46,
     }
 
 
@@ -358,4 +376,15 @@ def get_L5Pyr_params_default():
         'L5Pyr_dend_gbar_km': 200.,
         'L5Pyr_dend_gbar_cat': 2e-4,
         'L5Pyr_dend_gbar_ar': 1e-6,
+
+        # Initial membrane potentials (mV)
+        'L5Pyr_soma_v_init': -72.,
+        'L5Pyr_apicaltrunk_v_init': -72.,
+        'L5Pyr_apical1_v_init': -71.32,
+        'L5Pyr_apical2_v_init': -69.08,
+        'L5Pyr_apicaltuft_v_init': -67.30,
+        'L5Pyr_apicaloblique_v_init': -72.,
+        'L5Pyr_basal1_v_init': -72.,
+        'L5Pyr_basal2_v_init': -72.,
+        'L5Pyr_basal3_v_init': -72.,
     }
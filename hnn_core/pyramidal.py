@@ -16,6 +16,128 @@ from .params_default import (get_L2Pyr_params_default,
 # Units for e: mV
 # Units for gbar: S/cm^2 unless otherwise noted
 
+# The parameters and geometry shared by all cells of a type, resolved once
+# when the first cell of that type and nseg rule is created without
+# override_params.
+_PROTOTYPES = dict()
+
+
+def _get_nseg_d_lambda(L, diam, Ra, cm, d_lambda, d_lambda_freq):
+    """Get the number of segments of a section by the d_lambda rule.
+
+    The segments are at most d_lambda times the AC length constant of the
+    section at the frequency d_lambda_freq, as in NEURON's fixnseg.hoc.
+
+    Parameters
+    ----------
+    L : float
+        The length of the section (in um).
+    diam : float
+        The diameter of the section (in um).
+    Ra : float
+        The axial resistivity (in ohm-cm).
+    cm : float
+        The membrane capacitance (in uF/cm2).
+    d_lambda : float
+        The largest length of a segment as a fraction of the length constant.
+    d_lambda_freq : float
+        The frequency (in Hz) of the length constant.
+
+    Returns
+    -------
+    nseg : int
+        The number of segments, which is odd.
+    """
+    lambda_f = 1e5 * np.sqrt(diam / (4 * np.pi * d_lambda_freq * Ra * cm))
+    return int((L / (d_lambda * lambda_f) + 0.9) / 2) * 2 + 1
+
+
+def _collapse_in_parallel(dends):
+    """Collapse sibling sections into a single section.
+
+    The collapsed section has the mean length of the sections and their
+    total membrane area and axial conductance (Bush & Sejnowski, 1993). Its
+    diameter keeps the membrane area, hence the conductances and the
+    capacitance, and its axial resistivity keeps the axial conductance. For
+    identical sections with the same inputs, it is an exact equivalent
+    cylinder.
+
+    Parameters
+    ----------
+    dends : list of dict
+        The properties of the sections ('L', 'diam', 'cm' and 'Ra').
+
+    Returns
+    -------
+    dend : dict
+        The properties of the collapsed section.
+    """
+    L = np.mean([dend['L'] for dend in dends])
+    area = sum(dend['L'] * dend['diam'] for dend in dends)
+    g_axial = sum(dend['diam'] ** 2 / (dend['Ra'] * dend['L'])
+                  for dend in dends)
+    diam = area / L
+    return {'L': L, 'diam': diam,
+            'cm': sum(dend['cm'] * dend['L'] * dend['diam']
+                      for dend in dends) / area,
+            'Ra': diam ** 2 / (g_axial * L)}
+
+
+def _collapse_in_series(dends):
+    """Collapse a path of sections into a single section.
+
+    The collapsed section has the total length, membrane area and axial
+    resistance of the sections (Bush & Sejnowski, 1993). Its diameter keeps
+    the membrane area and its axial resistivity the axial resistance.
+
+    Parameters
+    ----------
+    dends : list of dict
+        The properties of the sections ('L', 'diam', 'cm' and 'Ra'), from
+        the first to the last.
+
+    Returns
+    -------
+    dend : dict
+        The properties of the collapsed section.
+    """
+    L = sum(dend['L'] for dend in dends)
+    area = sum(dend['L'] * dend['diam'] for dend in dends)
+    r_axial = sum(dend['Ra'] * dend['L'] / dend['diam'] ** 2
+                  for dend in dends)
+    diam = area / L
+    return {'L': L, 'diam': diam,
+            'cm': sum(dend['cm'] * dend['L'] * dend['diam']
+                      for dend in dends) / area,
+            'Ra': r_axial * diam ** 2 / L}
+
+
+def _fold_branch(dend, branch):
+    """Fold a side branch into the section it comes off.
+
+    The section keeps its length and axial resistance and gets the membrane
+    area of the branch, whose inputs it receives. The branch is taken to be
+    isopotential with the section.
+
+    Parameters
+    ----------
+    dend : dict
+        The properties of the section ('L', 'diam', 'cm' and 'Ra').
+    branch : dict
+        The properties of the branch.
+
+    Returns
+    -------
+    dend : dict
+        The properties of the section with the branch folded in.
+    """
+    area = dend['L'] * dend['diam'] + branch['L'] * branch['diam']
+    diam = area / dend['L']
+    return {'L': dend['L'], 'diam': diam,
+            'cm': (dend['cm'] * dend['L'] * dend['diam'] +
+                   branch['cm'] * branch['L'] * branch['diam']) / area,
+            'Ra': dend['Ra'] * diam ** 2 / dend['diam'] ** 2}
+
 
 class Pyr(_Cell):
     """Pyramidal neuron.
@@ -32,6 +154,16 @@ class Pyr(_Cell):
         Each cell in a network is uniquely identified by it's "global ID": GID.
         The GID is an integer from 0 to n_cells, or None if the cell is not
         yet attached to a network. Once the GID is set, it cannot be changed..
+    dipole_method : 'mechanism' | 'imem' | None
+        How the dipole of the cell is computed (see _Cell.insert_dipole). If
+        None, the cell has no dipole.
+    d_lambda : float | None
+        If None, the dendrites longer than 100 um have one segment per 50 um
+        (rounded to odd) and the others a single segment. Otherwise, the
+        segments of each dendrite are at most d_lambda times its AC length
+        constant at d_lambda_freq (the d_lambda rule, e.g. 0.1).
+    d_lambda_freq : float
+        The frequency (in Hz) of the length constant of the d_lambda rule.
 
     Attributes
     ----------
@@ -51,19 +183,13 @@ class Pyr(_Cell):
         The synapses that the cell can use for connections.
     """
 
-    def __init__(self, pos, celltype, override_params=None, gid=None):
-
-        if celltype == 'L5_pyramidal':
-            p_all_default = get_L5Pyr_params_default()
-        elif celltype == 'L2_pyramidal':
-            p_all_default = get_L2Pyr_params_default()
-        else:
-            raise ValueError(f'Unknown pyramidal cell type: {celltype}')
+    def __init__(self, pos, celltype, override_params=None, gid=None,
+                 dipole_method='mechanism', d_lambda=None,
+                 d_lambda_freq=100.):
 
-        p_all = p_all_default
-        if override_params is not None:
-            assert isinstance(override_params, dict)
-            p_all = compare_dictionaries(p_all_default, override_params)
+        self._prototype = self._get_prototype(celltype, override_params,
+                                              d_lambda, d_lambda_freq)
+        p_all = self._prototype['p_all']
 
         # Get somatic, dendritic, and synapse properties
         soma_props = self._get_soma_props(pos, p_all)
@@ -80,8 +206,8 @@ class Pyr(_Cell):
         self.list_dend = []
         self.celltype = celltype
 
-        p_dend = self._get_dend_props(p_all)
-        p_syn = self._get_syn_props(p_all)
+        p_dend = self._prototype['p_dend']
+        p_syn = self._prototype['p_syn']
 
         # Geometry
         # dend Cm and dend Ra set using soma Cm and soma Ra
@@ -94,8 +220,9 @@ class Pyr(_Cell):
         self.set_biophysics(p_all)
 
         # insert dipole
-        yscale = self.secs()[3]
-        self.insert_dipole(yscale)
+        if dipole_method is not None:
+            yscale = self._prototype['secs'][3]
+            self.insert_dipole(yscale, method=dipole_method)
 
         # create synapses
         self._synapse_create(p_syn)
@@ -103,6 +230,87 @@ class Pyr(_Cell):
         # insert iclamp
         self.list_IClamp = []
 
+    def _get_prototype(self, celltype, override_params, d_lambda=None,
+                       d_lambda_freq=100.):
+        """Get the parameters and geometry of the cell type.
+
+        Parameters
+        ----------
+        celltype : str
+            Either 'L2_pyramidal' or 'L5_pyramidal'
+        override_params : dict or None
+            Parameters to override the default set. The prototype of the cell
+            type is cached and shared by all its cells if None.
+        d_lambda : float | None
+            The d_lambda rule of the number of segments (see Pyr).
+        d_lambda_freq : float
+            The frequency (in Hz) of the d_lambda rule.
+
+        Returns
+        -------
+        prototype : dict
+            The resolved parameters ('p_all'), the dendritic ('p_dend') and
+            synaptic ('p_syn') properties, the section geometry ('secs') and
+            the number of segments of each dendrite ('nseg').
+        """
+        key = (type(self), celltype, d_lambda,
+               d_lambda_freq if d_lambda else None)
+        if override_params is None and key in _PROTOTYPES:
+            return _PROTOTYPES[key]
+
+        if celltype == 'L5_pyramidal':
+            p_all_default = get_L5Pyr_params_default()
+        elif celltype == 'L2_pyramidal':
+            p_all_default = get_L2Pyr_params_default()
+        else:
+            raise ValueError(f'Unknown pyramidal cell type: {celltype}')
+
+        p_all = p_all_default
+        if override_params is not None:
+            assert isinstance(override_params, dict)
+            p_all = compare_dictionaries(p_all_default, override_params)
+
+        # the dendritic and synaptic properties are named after the cell
+        self.name = self._get_soma_props(None, p_all)['name']
+        p_dend = self._get_dend_props(p_all)
+        nseg = {dend_name: self._get_nseg(dend, d_lambda, d_lambda_freq)
+                for dend_name, dend in p_dend.items()}
+
+        prototype = {'p_all': p_all, 'p_dend': p_dend,
+                     'p_syn': self._get_syn_props(p_all),
+                     'secs': self.secs(), 'nseg': nseg}
+        if override_params is None:
+            _PROTOTYPES[key] = prototype
+        return prototype
+
+    def _get_nseg(self, dend, d_lambda=None, d_lambda_freq=100.):
+        """Get the number of segments of a dendrite.
+
+        Parameters
+        ----------
+        dend : dict
+            The properties of the dendrite ('L', 'diam', 'cm' and 'Ra').
+        d_lambda : float | None
+            The d_lambda rule of the number of segments (see Pyr).
+        d_lambda_freq : float
+            The frequency (in Hz) of the d_lambda rule.
+
+        Returns
+        -------
+        nseg : int
+            The number of segments, which is odd.
+        """
+        if d_lambda is not None:
+            return _get_nseg_d_lambda(dend['L'], dend['diam'], dend['Ra'],
+                                      dend['cm'], d_lambda, d_lambda_freq)
+        nseg = 1
+        if dend['L'] > 100.:
+            nseg = int(dend['L'] / 50.)
+            # make dend.nseg odd for all sections
+            if not nseg % 2:
+                nseg += 1
+        return nseg
+
     def set_geometry(self, p_dend):
         """Define shape of the neuron and connect sections.
 
@@ -118,7 +326,7 @@ class Pyr(_Cell):
             * cm: membrane capacitance in micro-Farads
             * Ra: axial resistivity in ohm-cm
         """
-        sec_pts, sec_lens, sec_diams, _, topology = self.secs()
+        sec_pts, sec_lens, sec_diams, _, topology = self._prototype['secs']
 
         # Connects sections of THIS cell together.
         for connection in topology:
@@ -130,12 +338,15 @@ class Pyr(_Cell):
             child_loc = connection[3]
             child_sec.connect(parent_sec, parent_loc, child_loc)
 
-        # Neuron shape based on Jones et al., 2009
+        # Neuron shape based on Jones et al., 2009. The points are created at
+        # the position of the cell, changing the length of a section scales
+        # its points from the first one.
+        dx, dy, dz = self._get_offset(sec_pts['soma'][0])
         for sec in [self.soma] + self.list_dend:
             h.pt3dclear(sec=sec)
             sec_name = sec.name().split('_', 1)[1]
             for pt in sec_pts[sec_name]:
-                h.pt3dadd(pt[0], pt[1], pt[2], 1, sec=sec)
+                h.pt3dadd(pt[0] + dx, pt[1] + dy, pt[2] + dz, 1, sec=sec)
             sec.L = sec_lens[sec_name]
             sec.diam = sec_diams[sec_name]
 
@@ -146,12 +357,7 @@ class Pyr(_Cell):
             self.dends[key].diam = p_dend[key]['diam']
             self.dends[key].Ra = p_dend[key]['Ra']
             self.dends[key].cm = p_dend[key]['cm']
-            # set dend nseg
-            if p_dend[key]['L'] > 100.:
-                self.dends[key].nseg = int(p_dend[key]['L'] / 50.)
-                # make dend.nseg odd for all sections
-                if not self.dends[key].nseg % 2:
-                    self.dends[key].nseg += 1
+            self.dends[key].nseg = self._prototype['nseg'][key]
 
     def create_dends(self, p_dend_props):
         """Create dendrites."""
@@ -160,7 +366,7 @@ class Pyr(_Cell):
         # self.name + '_' + key
         for key in p_dend_props:
             self.dends[key] = h.Section(
-                name=self.name + '_' + key)  # create dend
+                cell=self, name=self.name + '_' + key)  # create dend
         # apical: 0--4; basal: 5--7
         self.list_dend = [self.dends[key] for key in
                           ['apical_trunk', 'apical_oblique', 'apical_1',
@@ -258,6 +464,19 @@ class Pyr(_Cell):
             }
         }
 
+    def _get_synapse_segs(self):
+        """Get the segments of the dendritic synapses.
+
+        Returns
+        -------
+        segs : dict
+            The segment of each section location of sect_loc.
+        """
+        return {'apicaloblique': self.dends['apical_oblique'](0.5),
+                'basal2': self.dends['basal_2'](0.5),
+                'basal3': self.dends['basal_3'](0.5),
+                'apicaltuft': self.dends['apical_tuft'](0.5)}
+
     def _synapse_create(self, p_syn):
         """Creates synapses onto this cell."""
         # Somatic synapses
@@ -267,25 +486,11 @@ class Pyr(_Cell):
                                                       **p_syn['gabab'])
 
         # Dendritic synapses
-        self.synapses['apicaloblique_ampa'] = self.syn_create(
-            self.dends['apical_oblique'](0.5), **p_syn['ampa'])
-        self.synapses['apicaloblique_nmda'] = self.syn_create(
-            self.dends['apical_oblique'](0.5), **p_syn['nmda'])
-
-        self.synapses['basal2_ampa'] = self.syn_create(
-            self.dends['basal_2'](0.5), **p_syn['ampa'])
-        self.synapses['basal2_nmda'] = self.syn_create(
-            self.dends['basal_2'](0.5), **p_syn['nmda'])
-
-        self.synapses['basal3_ampa'] = self.syn_create(
-            self.dends['basal_3'](0.5), **p_syn['ampa'])
-        self.synapses['basal3_nmda'] = self.syn_create(
-            self.dends['basal_3'](0.5), **p_syn['nmda'])
-
-        self.synapses['apicaltuft_ampa'] = self.syn_create(
-            self.dends['apical_tuft'](0.5), **p_syn['ampa'])
-        self.synapses['apicaltuft_nmda'] = self.syn_create(
-            self.dends['apical_tuft'](0.5), **p_syn['nmda'])
+        for loc, seg in self._get_synapse_segs().items():
+            self.synapses[loc + '_ampa'] = self.syn_create(seg,
+                                                           **p_syn['ampa'])
+            self.synapses[loc + '_nmda'] = self.syn_create(seg,
+                                                           **p_syn['nmda'])
 
         if self.name == 'L5Pyr':
             self.synapses['apicaltuft_gabaa'] = self.syn_create(
@@ -305,6 +510,15 @@ class L2Pyr(Pyr):
         Each cell in a network is uniquely identified by it's "global ID": GID.
         The GID is an integer from 0 to n_cells, or None if the cell is not
         yet attached to a network. Once the GID is set, it cannot be changed.
+    dipole_method : 'mechanism' | 'imem' | None
+        How the dipole of the cell is computed (see _Cell.insert_dipole). If
+        None, the cell has no dipole.
+    d_lambda : float | None
+        The d_lambda rule of the number of segments of the dendrites (see
+        Pyr). If None, one segment per 50 um of the dendrites longer than
+        100 um.
+    d_lambda_freq : float
+        The frequency (in Hz) of the length constant of the d_lambda rule.
 
     Attributes
     ----------
@@ -319,8 +533,12 @@ class L2Pyr(Pyr):
         The synapses that the cell can use for connections.
     """
 
-    def __init__(self, pos=None, override_params=None, gid=None):
-        Pyr.__init__(self, pos, 'L2_pyramidal', override_params, gid=gid)
+    def __init__(self, pos=None, override_params=None, gid=None,
+                 dipole_method='mechanism', d_lambda=None,
+                 d_lambda_freq=100.):
+        Pyr.__init__(self, pos, 'L2_pyramidal', override_params, gid=gid,
+                     dipole_method=dipole_method, d_lambda=d_lambda,
+                     d_lambda_freq=d_lambda_freq)
 
     def _get_soma_props(self, pos, p_all):
         """Hardcoded somatic properties."""
@@ -444,6 +662,15 @@ class L5Pyr(Pyr):
         Each cell in a network is uniquely identified by it's "global ID": GID.
         The GID is an integer from 0 to n_cells, or None if the cell is not
         yet attached to a network. Once the GID is set, it cannot be changed.
+    dipole_method : 'mechanism' | 'imem' | None
+        How the dipole of the cell is computed (see _Cell.insert_dipole). If
+        None, the cell has no dipole.
+    d_lambda : float | None
+        The d_lambda rule of the number of segments of the dendrites (see
+        Pyr). If None, one segment per 50 um of the dendrites longer than
+        100 um.
+    d_lambda_freq : float
+        The frequency (in Hz) of the length constant of the d_lambda rule.
 
     Attributes
     ----------
@@ -458,10 +685,14 @@ class L5Pyr(Pyr):
         The synapses that the cell can use for connections.
     """
 
-    def __init__(self, pos=None, override_params=None, gid=None):
+    def __init__(self, pos=None, override_params=None, gid=None,
+                 dipole_method='mechanism', d_lambda=None,
+                 d_lambda_freq=100.):
         """Get default L5Pyr params and update them with
             corresponding params in p."""
-        Pyr.__init__(self, pos, 'L5_pyramidal', override_params, gid=gid)
+        Pyr.__init__(self, pos, 'L5_pyramidal', override_params, gid=gid,
+                     dipole_method=dipole_method, d_lambda=d_lambda,
+                     d_lambda_freq=d_lambda_freq)
 
     def secs(self):
         """The geometry of the default sections in the Neuron."""
@@ -614,11 +845,164 @@ class L5Pyr(Pyr):
         # and set gbar_ar depending on h.distance(seg.x), which returns
         # distance from the soma to this point on the CURRENTLY ACCESSED
         # SECTION!!!
-        h.distance(sec=self.soma)
+        # The values only depend on the geometry, they are computed for the
+        # first cell of the prototype.
+        if 'gbar_ar' not in self._prototype:
+            h.distance(sec=self.soma)
+            gbar_ar = dict()
+            for key in self.dends:
+                self.dends[key].push()
+                gbar_ar[key] = [1e-6 * np.exp(3e-3 * h.distance(seg.x))
+                                for seg in self.dends[key]]
+                h.pop_section()
+            self._prototype['gbar_ar'] = gbar_ar
 
         for key in self.dends:
-            self.dends[key].push()
-            for seg in self.dends[key]:
-                seg.gbar_ar = 1e-6 * np.exp(3e-3 * h.distance(seg.x))
+            for seg, gbar in zip(self.dends[key],
+                                 self._prototype['gbar_ar'][key]):
+                seg.gbar_ar = gbar
+
+
+class _PyrReduced(object):
+    """Collapse the dendritic trees of a pyramidal cell.
+
+    The side branches are collapsed into the main paths of the apical and
+    basal trees (Bush & Sejnowski, 1993): 'apical_oblique' is folded into
+    'apical_trunk', and 'basal_2' and 'basal_3' are collapsed in parallel,
+    then in series with 'basal_1', into 'basal_1'. The collapsed sections
+    keep the membrane area and the axial resistance of the trees and the
+    extent of the dendrites along the dipole axis. Unless d_lambda is given,
+    the dendrites are segmented by the d_lambda rule with d_lambda=1.: no
+    segment is longer than the length constant.
+
+    The synapses of the folded sections are created on the sections they
+    are folded into, the synapse keys and the section locations are the
+    ones of the full cell.
+    """
+
+    def _collapse_dends(self, dends):
+        """Collapse the properties of the dendrites."""
+        dends['apical_trunk'] = _fold_branch(dends['apical_trunk'],
+                                             dends.pop('apical_oblique'))
+        dends['basal_1'] = _collapse_in_series([
+            dends['basal_1'],
+            _collapse_in_parallel([dends.pop('basal_2'),
+                                   dends.pop('basal_3')])])
+        return dends
+
+    def _get_dend_props(self, p_all):
+        """Returns the collapsed dendritic properties."""
+        return self._collapse_dends(super()._get_dend_props(p_all))
+
+    def _get_nseg(self, dend, d_lambda=None, d_lambda_freq=100.):
+        """Get the number of segments of a dendrite, no segment is longer
+        than the length constant without d_lambda."""
+        if d_lambda is None:
+            d_lambda = 1.
+        return super()._get_nseg(dend, d_lambda, d_lambda_freq)
+
+    def secs(self):
+        """The geometry of the collapsed sections in the neuron."""
+        sec_pts, sec_lens, sec_diams, sec_scales, topology = super().secs()
+        dends = self._collapse_dends({
+            key: {'L': sec_lens[key], 'diam': sec_diams[key], 'cm': 1.,
+                  'Ra': 1.} for key in sec_lens if key != 'soma'})
+        # the collapsed basal dendrite ends between the ends of the basal
+        # dendrites, its extent along the dipole axis is theirs
+        extent = (sec_scales['basal_1'] * sec_lens['basal_1'] +
+                  sec_scales['basal_2'] * sec_lens['basal_2'])
+        sec_pts['basal_1'] = [sec_pts['basal_1'][0],
+                              np.mean([sec_pts['basal_2'][1],
+                                       sec_pts['basal_3'][1]],
+                                      axis=0).tolist()]
+        sec_scales['basal_1'] = extent / dends['basal_1']['L']
+        for key in ('apical_oblique', 'basal_2', 'basal_3'):
+            for sec_props in (sec_pts, sec_lens, sec_diams, sec_scales):
+                del sec_props[key]
+        for key, dend in dends.items():
+            sec_lens[key] = dend['L']
+            sec_diams[key] = dend['diam']
+        topology = [connection for connection in topology
+                    if connection[2] in sec_lens]
+        return sec_pts, sec_lens, sec_diams, sec_scales, topology
+
+    def _get_synapse_segs(self):
+        """Get the segments of the dendritic synapses."""
+        return {'apicaloblique': self.dends['apical_trunk'](0.5),
+                'basal2': self.dends['basal_1'](0.5),
+                'basal3': self.dends['basal_1'](0.5),
+                'apicaltuft': self.dends['apical_tuft'](0.5)}
+
+
+class L2PyrReduced(_PyrReduced, L2Pyr):
+    """Layer 2 pyramidal cell with collapsed dendrites.
+
+    A drop-in replacement for L2Pyr that trades fidelity for speed: the
+    oblique dendrite is folded into the apical trunk, the basal dendrites
+    are collapsed into 'basal_1' and no segment is longer than the length
+    constant, for 5 segments instead of 32. The biophysics, the synapse keys
+    and the section locations ('proximal' and 'distal') are the ones of
+    L2Pyr, the synapses of 'basal2' and 'basal3' are both on 'basal_1'.
 
-            h.pop_section()
+    In networks of the bundled parameter files, the time steps are about 3
+    to 5 times faster than with L2Pyr and L5Pyr, the RMSE of the dipoles of
+    each layer is 8 to 18% of their peak and the numbers of spikes of the
+    pyramidal cells differ by up to 30% (see benchmarks/bench_reduced.py).
+    Use them to explore parameters, not to fit data.
+
+    Parameters
+    ----------
+    pos : tuple
+        Coordinates of cell soma in xyz-space
+    override_params : dict or None (optional)
+        Parameters specific to L2 pyramidal neurons to override the default set
+    gid : int or None (optional)
+        Each cell in a network is uniquely identified by it's "global ID": GID.
+        The GID is an integer from 0 to n_cells, or None if the cell is not
+        yet attached to a network. Once the GID is set, it cannot be changed.
+    dipole_method : 'mechanism' | 'imem' | None
+        How the dipole of the cell is computed (see _Cell.insert_dipole). If
+        None, the cell has no dipole.
+    d_lambda : float | None
+        The d_lambda rule of the number of segments of the dendrites (see
+        Pyr). If None, d_lambda=1.
+    d_lambda_freq : float
+        The frequency (in Hz) of the length constant of the d_lambda rule.
+    """
+
+
+class L5PyrReduced(_PyrReduced, L5Pyr):
+    """Layer 5 pyramidal cell with collapsed dendrites.
+
+    A drop-in replacement for L5Pyr that trades fidelity for speed: the
+    oblique dendrite is folded into the apical trunk, the basal dendrites
+    are collapsed into 'basal_1' and no segment is longer than the length
+    constant, for 10 segments instead of 55. The biophysics, the synapse keys
+    and the section locations ('proximal' and 'distal') are the ones of
+    L5Pyr, the synapses of 'basal2' and 'basal3' are both on 'basal_1'.
+
+    In networks of the bundled parameter files, the time steps are about 3
+    to 5 times faster than with L2Pyr and L5Pyr, the RMSE of the dipoles of
+    each layer is 8 to 18% of their peak and the numbers of spikes of the
+    pyramidal cells differ by up to 30% (see benchmarks/bench_reduced.py).
+    Use them to explore parameters, not to fit data.
+
+    Parameters
+    ----------
+    pos : tuple
+        Coordinates of cell soma in xyz-space
+    override_params : dict or None (optional)
+        Parameters specific to L5 pyramidal neurons to override the default set
+    gid : int or None (optional)
+        Each cell in a network is uniquely identified by it's "global ID": GID.
+        The GID is an integer from 0 to n_cells, or None if the cell is not
+        yet attached to a network. Once the GID is set, it cannot be changed.
+    dipole_method : 'mechanism' | 'imem' | None
+        How the dipole of the cell is computed (see _Cell.insert_dipole). If
+        None, the cell has no dipole.
+    d_lambda : float | None
+        The d_lambda rule of the number of segments of the dendrites (see
+        Pyr). If None, d_lambda=1.
+    d_lambda_freq : float
+        The frequency (in Hz) of the length constant of the d_lambda rule.
+    """
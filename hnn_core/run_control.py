@@ -0,0 +1,151 @@
+"""Control of long simulations that are run in chunks."""
+
+import os.path as op
+
+
+def _check_interval(interval, name):
+    """Check that an interval between two chunks is a positive number."""
+    if not isinstance(interval, (int, float)):
+        raise TypeError("%s must be float, got %s"
+                        % (name, type(interval).__name__))
+    if interval <= 0:
+        raise ValueError("%s must be positive, got %s" % (name, interval))
+
+
+class RunControl(object):
+    """How the trials of a simulation are run in chunks.
+
+    The solver stops at the end of every chunk, where the state of each
+    trial can be saved, its recordings moved to the disk or its activity
+    checked. Pass an instance to simulate_dipole.
+
+    Parameters
+    ----------
+    checkpoint_dir : str | None
+        The directory where the state of each trial is saved every
+        checkpoint_interval ms, so that a simulation that is killed can be
+        resumed with resume_from. Each MPI process saves its own files. If
+        None and resume_from is given, the checkpoints are saved in
+        resume_from. If both are None, there are no checkpoints.
+    checkpoint_interval : float
+        The time (in ms) between checkpoints. Must be an integer multiple of
+        net.params['dt'] and of record_dt.
+    resume_from : str | None
+        The checkpoint_dir of a simulation that was interrupted. Each trial
+        continues from its last checkpoint, or starts anew if there is
+        none. The simulation must be identical to the interrupted one,
+        including the number of MPI processes. The results are identical to
+        those of an uninterrupted simulation up to round-off.
+    stream_dir : str | None
+        The directory where the recordings are streamed to. If not None,
+        the recordings of every stream_interval ms are appended to the files
+        of each trial and MPI process in stream_dir and cleared, so that the
+        memory used by the recordings does not grow with the duration of the
+        simulation. The recordings are then memory-mapped from these files
+        if the trials are simulated in a single process. The streamed
+        recordings are not part of the checkpoints, so stream_dir cannot be
+        combined with checkpoint_dir or resume_from.
+    stream_interval : float
+        The time (in ms) between writes to stream_dir. Must be an integer
+        multiple of net.params['dt'] and of record_dt.
+    stop_criteria : list of callable | None
+        Criteria that stop the simulation of a trial early, e.g., when its
+        activity runs away or dies out. Every stop_check_interval ms, each
+        criterion is called as ``criterion(t, spike_times, spike_gids, dpl)``
+        with the current time (in ms), the spikes of all cells so far and
+        the Dipole so far, before post-processing. If any criterion returns
+        True, the trial stops: its Dipole and somatic recordings end at the
+        current time and its Dipole has stopped_early set to True. With
+        MPIBackend, the criteria must be picklable (e.g., functions defined
+        in a module). The criteria need the recordings since the start of
+        the trial, so they cannot be combined with stream_dir.
+    stop_check_interval : float
+        The time (in ms) between evaluations of stop_criteria.
+
+    Attributes
+    ----------
+    checkpoint_dir : str | None
+        The directory of the checkpoints.
+    checkpoint_interval : float
+        The time (in ms) between checkpoints.
+    resume_from : str | None
+        The directory of the checkpoints the trials continue from.
+    stream_dir : str | None
+        The directory the recordings are streamed to.
+    stream_interval : float
+        The time (in ms) between writes to stream_dir.
+    stop_criteria : list of callable
+        The criteria that stop a trial early.
+    stop_check_interval : float
+        The time (in ms) between evaluations of stop_criteria.
+    """
+
+    def __init__(self, checkpoint_dir=None, checkpoint_interval=1000.,
+                 resume_from=None, stream_dir=None, stream_interval=1000.,
+                 stop_criteria=None, stop_check_interval=10.):
+        for name, directory in (('checkpoint_dir', checkpoint_dir),
+                                ('resume_from', resume_from),
+                                ('stream_dir', stream_dir)):
+            if directory is not None and not isinstance(directory, str):
+                raise TypeError("%s must be str or None, got %s"
+                                % (name, type(directory).__name__))
+        if resume_from is not None and not op.isdir(resume_from):
+            raise ValueError("resume_from must be an existing directory, "
+                             "got %s" % resume_from)
+        if stop_criteria is None:
+            stop_criteria = list()
+        if not isinstance(stop_criteria, list) or \
+                not all(callable(criterion) for criterion in stop_criteria):
+            raise TypeError("stop_criteria must be list of callable or None, "
+                            "got %s" % (stop_criteria,))
+        _check_interval(checkpoint_interval, 'checkpoint_interval')
+        _check_interval(stream_interval, 'stream_interval')
+        _check_interval(stop_check_interval, 'stop_check_interval')
+
+        if checkpoint_dir is None:
+            checkpoint_dir = resume_from
+        if stream_dir is not None and (checkpoint_dir is not None or
+                                       len(stop_criteria) > 0):
+            raise ValueError("stream_dir cannot be combined with "
+                             "checkpoint_dir, resume_from or stop_criteria")
+
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.resume_from = resume_from
+        self.stream_dir = stream_dir
+        self.stream_interval = stream_interval
+        self.stop_criteria = stop_criteria
+        self.stop_check_interval = stop_check_interval
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        modes = list()
+        if self.checkpoint_dir is not None:
+            modes.append('checkpoints every %s ms' % self.checkpoint_interval)
+        if self.resume_from is not None:
+            modes.append('resumed')
+        if self.stream_dir is not None:
+            modes.append('streamed every %s ms' % self.stream_interval)
+        if self.stop_criteria:
+            modes.append('%d stop criteria every %s ms'
+                         % (len(self.stop_criteria),
+                            self.stop_check_interval))
+        return '<%s | %s>' % (class_name, ', '.join(modes) or 'single run')
+
+    def _get_intervals(self):
+        """Get the interval (in ms) of each action at the end of a chunk.
+
+        Returns
+        -------
+        intervals : dict
+            The interval of 'checkpoint', 'stream' and 'stop' if they are
+            used.
+        """
+        intervals = dict()
+        if self.checkpoint_dir is not None:
+            intervals['checkpoint'] = self.checkpoint_interval
+        if self.stream_dir is not None:
+            intervals['stream'] = self.stream_interval
+        if self.stop_criteria:
+            intervals['stop'] = self.stop_check_interval
+        return intervals
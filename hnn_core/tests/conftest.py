@@ -6,6 +6,8 @@ https://pytest.org/en/stable/example/simple.html#incremental-testing-test-steps
 from typing import Dict, Tuple
 import pytest
 
+import multiprocessing
+import os
 import os.path as op
 import hnn_core
 from hnn_core import read_params, Network, simulate_dipole
@@ -70,6 +72,37 @@ def pytest_runtest_setup(item):
                 pytest.xfail("previous test failed ({})".format(test_name))
 
 
+@pytest.fixture
+def two_mpi_procs(monkeypatch):
+    """Let MPIBackend(n_procs=2) start two MPI processes on any machine.
+
+    The processes oversubscribe the cores of machines with a single core.
+    """
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: {0, 1},
+                        raising=False)
+    monkeypatch.setattr(multiprocessing, 'cpu_count', lambda: 1)
+
+
+@pytest.fixture
+def reduced_params():
+    """Get the parameters of a small network with early drives.
+
+    The pyramidal cells of each layer are on a grid of 3 x 3 and the evoked
+    drives arrive in the first 20 ms of trials of tstop ms.
+    """
+    def _reduced_params(tstop=40):
+        hnn_core_root = op.dirname(hnn_core.__file__)
+        params = read_params(op.join(hnn_core_root, 'param', 'default.json'))
+        params.update({'N_pyr_x': 3,
+                       'N_pyr_y': 3,
+                       'tstop': tstop,
+                       't_evprox_1': 5,
+                       't_evdist_1': 10,
+                       't_evprox_2': 20})
+        return params
+    return _reduced_params
+
+
 @pytest.fixture(scope='module')
 def run_hnn_core_fixture():
     def _run_hnn_core_fixture(backend=None, n_procs=None, n_jobs=1,
@@ -1,9 +1,13 @@
+import numpy as np
+from numpy.testing import assert_allclose
 import pytest
 
 import matplotlib
 
 from hnn_core.network_builder import load_custom_mechanisms
 from hnn_core.cell import _ArtificialCell, _Cell
+from hnn_core.pyramidal import L2Pyr, L5Pyr, L2PyrReduced, L5PyrReduced
+from hnn_core.basket import L2Basket
 
 matplotlib.use('agg')
 
@@ -41,6 +45,8 @@ def test_cell():
 
     with pytest.raises(TypeError, match='secloc must be instance of'):
         cell.syn_create(0.5, e=0., tau1=0.5, tau2=5.)
+    with pytest.raises(ValueError, match="method must be 'mechanism' or"):
+        cell.insert_dipole(dict(), method='axial')
 
 
 def test_artificial_cell():
@@ -74,3 +80,110 @@ def test_artificial_cell():
     with pytest.raises(ValueError,  # test init checks gid
                        match='gid must be an integer'):
         cell = _ArtificialCell(event_times, threshold, gid='one')
+
+
+def test_pyramidal_prototype():
+    """Test that pyramidal cells share the prototype of their type."""
+    load_custom_mechanisms()
+    cell_1, cell_2 = L5Pyr(gid=0), L5Pyr(gid=1)
+    assert cell_1._prototype is cell_2._prototype
+    assert L2Pyr()._prototype is not cell_1._prototype
+    for key in cell_1.dends:
+        assert cell_1.dends[key].nseg == cell_2.dends[key].nseg
+        assert ([seg.gbar_ar for seg in cell_1.dends[key]] ==
+                [seg.gbar_ar for seg in cell_2.dends[key]])
+
+    # overridden parameters are not cached
+    cell_3 = L5Pyr(override_params={'L5Pyr_apical1_L': 1000.})
+    assert cell_3._prototype is not cell_1._prototype
+    assert cell_3.dends['apical_1'].L == pytest.approx(1000.)
+    assert cell_3.dends['apical_1'].nseg == 21
+    assert L5Pyr()._prototype is cell_1._prototype
+    assert cell_1.dends['apical_1'].L == pytest.approx(680.)
+
+
+def test_pyramidal_d_lambda():
+    """Test the d_lambda rule of the number of segments."""
+    load_custom_mechanisms()
+    cell = L5Pyr()
+    cell_d_lambda = L5Pyr(d_lambda=0.1)
+    assert cell_d_lambda._prototype is not cell._prototype
+    assert L5Pyr(d_lambda=0.1)._prototype is cell_d_lambda._prototype
+    assert L5Pyr(d_lambda=0.1, d_lambda_freq=10.)._prototype is not \
+        cell_d_lambda._prototype
+    for dend in cell_d_lambda.dends.values():
+        assert dend.nseg % 2 == 1
+        # the length constant at 100 Hz (in um)
+        lambda_f = 1e5 * (dend.diam / (4 * np.pi * 100. * dend.Ra *
+                                       dend.cm)) ** 0.5
+        assert dend.L / dend.nseg <= 0.1 * lambda_f
+    # the segments grow with d_lambda and shrink with the frequency
+    n_segs = [sum(dend.nseg for dend in L5Pyr(**kwargs).dends.values())
+              for kwargs in (dict(d_lambda=0.3), dict(d_lambda=0.1),
+                             dict(d_lambda=0.1, d_lambda_freq=1000.))]
+    assert n_segs[0] < n_segs[1] < n_segs[2]
+
+
+def test_pyramidal_reduced():
+    """Test the pyramidal cells with collapsed dendrites."""
+    load_custom_mechanisms()
+    for PyramidalCell, ReducedCell in ((L2Pyr, L2PyrReduced),
+                                       (L5Pyr, L5PyrReduced)):
+        cell = PyramidalCell()
+        cell_reduced = ReducedCell()
+        assert cell_reduced._prototype is not cell._prototype
+        assert ReducedCell()._prototype is cell_reduced._prototype
+        assert cell_reduced.name == cell.name
+        assert cell_reduced.celltype == cell.celltype
+        assert cell_reduced.sect_loc == cell.sect_loc
+        assert sorted(cell_reduced.synapses) == sorted(cell.synapses)
+        # each synapse is created once
+        assert len(set(map(id, cell_reduced.synapses.values()))) == \
+            len(cell_reduced.synapses)
+        assert cell_reduced.synapses['basal3_ampa'].get_segment() == \
+            cell_reduced.dends['basal_1'](0.5)
+        for key in ('apical_oblique', 'basal_2', 'basal_3'):
+            assert key not in cell_reduced.dends
+        n_segs = [sum(sect.nseg for sect in c.get_sections())
+                  for c in (cell, cell_reduced, ReducedCell(d_lambda=0.1))]
+        assert n_segs[1] < n_segs[0] / 5
+        assert n_segs[1] < n_segs[2]
+        # the membrane area and the axial resistance are kept
+        areas = [sum(seg.area() for sect in c.get_sections() for seg in sect)
+                 for c in (cell, cell_reduced)]
+        assert areas[1] == pytest.approx(areas[0])
+
+        def get_r_axial(c, key):
+            # the resistance between the nodes of the dendrite
+            return sum(seg.ri() for seg in list(c.dends[key].allseg())[1:])
+        r_basal = get_r_axial(cell, 'basal_1') + 1. / (
+            1. / get_r_axial(cell, 'basal_2') +
+            1. / get_r_axial(cell, 'basal_3'))
+        assert get_r_axial(cell_reduced, 'basal_1') == pytest.approx(r_basal)
+        assert get_r_axial(cell_reduced, 'apical_trunk') == \
+            pytest.approx(get_r_axial(cell, 'apical_trunk'))
+        # and the extent of the basal dendrites along the dipole axis
+        sec_scales = [c._prototype['secs'][3] for c in (cell, cell_reduced)]
+        extent = (sec_scales[0]['basal_1'] * cell.dends['basal_1'].L +
+                  sec_scales[0]['basal_2'] * cell.dends['basal_2'].L)
+        assert sec_scales[1]['basal_1'] * cell_reduced.dends['basal_1'].L == \
+            pytest.approx(extent)
+
+
+def test_cell_position():
+    """Test that the cells are created at their position."""
+    load_custom_mechanisms()
+
+    def get_points(cell):
+        return np.array([[sect.x3d(idx), sect.y3d(idx), sect.z3d(idx)]
+                         for sect in cell.get_sections()
+                         for idx in range(sect.n3d())])
+
+    for cell_class in (L5Pyr, L2Basket):
+        cell = cell_class(pos=(2, 3, 150))
+        assert_allclose(get_points(cell)[0], (200., 150., 300.))
+        # the points are those of a cell at the origin, translated
+        cell_origin = cell_class(pos=(0, 0, 0))
+        assert_allclose(get_points(cell),
+                        get_points(cell_origin) + (200., 150., 300.),
+                        atol=1e-3)
@@ -2,13 +2,15 @@ import os.path as op
 
 import matplotlib
 import numpy as np
-from numpy.testing import assert_allclose
+from numpy.testing import assert_allclose, assert_array_equal
 import pytest
 
 import hnn_core
-from hnn_core import read_params, read_dipole, average_dipoles, Network
+from hnn_core import (read_params, read_dipole, average_dipoles, Network,
+                      RunControl)
 from hnn_core.viz import plot_dipole
-from hnn_core.dipole import Dipole, simulate_dipole
+from hnn_core.dipole import (Dipole, simulate_dipole, simulate_branches,
+                             simulate_sweep, _rebuild_network)
 from hnn_core.parallel_backends import requires_mpi4py
 
 matplotlib.use('agg')
@@ -46,6 +48,17 @@ def test_dipole(tmpdir, run_hnn_core_fixture):
                        "average of 2 trials"):
         dipole_avg = average_dipoles([dipole_avg, dipole_read])
 
+    # after a warm-up, only the offset of the L5 dipole at its end is removed
+    times = np.arange(0., 100., 0.025)
+    data = np.random.random((len(times), 3))
+    dipole = Dipole(times, data.copy())
+    dipole.baseline_renormalize(params['N_pyr_x'], params['N_pyr_y'],
+                                warmup=1000.)
+    for layer, col in (('L2', 1), ('L5', 2)):
+        offset = data[:, col] - dipole.data[layer]
+        assert_allclose(offset, offset[0])
+    assert_allclose(dipole.data['agg'], dipole.data['L2'] + dipole.data['L5'])
+
     # test postproc
     dpls_raw, net = run_hnn_core_fixture(backend='joblib', n_jobs=1,
                                          reduced=True, record_isoma=True,
@@ -81,6 +94,15 @@ def test_dipole_simulation():
         simulate_dipole(net, n_trials=1, record_vsoma=0)
     with pytest.raises(TypeError, match="record_isoma must be bool, got int"):
         simulate_dipole(net, n_trials=1, record_vsoma=False, record_isoma=0)
+    with pytest.raises(TypeError, match="d_lambda must be float, got str"):
+        simulate_dipole(net, n_trials=1, d_lambda='0.1')
+    with pytest.raises(ValueError, match="d_lambda_freq must be positive"):
+        simulate_dipole(net, n_trials=1, d_lambda=0.1, d_lambda_freq=0.)
+    with pytest.raises(ValueError, match="pyramidal_model must be 'full' or "
+                       "'reduced', got simple"):
+        simulate_dipole(net, n_trials=1, pyramidal_model='simple')
+    with pytest.raises(TypeError, match="unexpected keyword argument 'sweep'"):
+        simulate_dipole(net, n_trials=1, sweep=[])
 
     # test Network.copy() returns 'bare' network after simulating
     simulate_dipole(net, n_trials=1)
@@ -88,6 +110,111 @@ def test_dipole_simulation():
     assert len(net_copy.external_drives['evprox1']['events']) == 0
     assert len(net_copy.cell_response.vsoma) == 0
 
+    # test selective and decimated somatic recordings
+    with pytest.raises(ValueError, match="record_dt must be an integer "
+                       "multiple of the simulation time step"):
+        simulate_dipole(net, n_trials=1, record_vsoma=True, record_dt=0.03)
+    with pytest.raises(ValueError, match="cell type must be one of"):
+        simulate_dipole(net, n_trials=1, record_vsoma=True,
+                        record_gids='L4_pyramidal')
+    with pytest.raises(ValueError, match="does not belong to a cell"):
+        simulate_dipole(net, n_trials=1, record_vsoma=True,
+                        record_gids=[net.n_cells])
+    with pytest.raises(ValueError, match="number of cells to record from"):
+        simulate_dipole(net, n_trials=1, record_vsoma=True,
+                        record_gids={'L5_pyramidal': 10})
+
+    gid = net.gid_ranges['L5_pyramidal'][0]
+    net_full = net.copy()
+    simulate_dipole(net_full, n_trials=1, record_vsoma=True,
+                    record_isoma=True, record_gids=[gid])
+    assert list(net_full.cell_response.vsoma[0].keys()) == [gid]
+    assert list(net_full.cell_response.isoma[0].keys()) == [gid]
+    assert isinstance(net_full.cell_response.vsoma[0][gid], np.ndarray)
+    assert isinstance(net_full.cell_response.spike_times[0], list)
+
+    net_decim = net.copy()
+    simulate_dipole(net_decim, n_trials=1, record_vsoma=True,
+                    record_isoma=True, record_gids=['L2_basket', gid],
+                    record_dt=0.5)
+    record_gids = list(net.gid_ranges['L2_basket']) + [gid]
+    assert sorted(net_decim.cell_response.vsoma[0].keys()) == record_gids
+    soma_times = net_decim.cell_response.soma_times
+    assert_allclose(soma_times, net_decim.cell_response.times[::20])
+    vsoma_full = np.array(net_full.cell_response.vsoma[0][gid])
+    vsoma_decim = np.array(net_decim.cell_response.vsoma[0][gid])
+    assert len(vsoma_decim) == len(soma_times)
+    assert_allclose(vsoma_decim, vsoma_full[::20])
+    isoma_decim = net_decim.cell_response.isoma[0][gid]['soma_gabaa']
+    assert len(isoma_decim) == len(soma_times)
+
+    net_sample = net.copy()
+    simulate_dipole(net_sample, n_trials=1, record_vsoma=True,
+                    record_gids={'L5_pyramidal': 2})
+    sampled_gids = list(net_sample.cell_response.vsoma[0].keys())
+    assert len(sampled_gids) == 2
+    assert all(gid in net.gid_ranges['L5_pyramidal'] for gid in sampled_gids)
+    assert len(net_sample.cell_response.isoma[0]) == 0
+
+    # test recording of the dipole of each pyramidal cell
+    with pytest.raises(TypeError, match="record_cell_dipoles must be bool"):
+        simulate_dipole(net, n_trials=1, record_cell_dipoles=1)
+    with pytest.raises(ValueError, match="No cell dipoles were recorded"):
+        net_full.cell_response.sum_cell_dipoles({'all': [gid]})
+
+    net_dcell = net.copy()
+    dpls = simulate_dipole(net_dcell, n_trials=1, postproc=False,
+                           record_cell_dipoles=True)
+    cell_response = net_dcell.cell_response
+    pyr_gids = (list(net.gid_ranges['L2_pyramidal']) +
+                list(net.gid_ranges['L5_pyramidal']))
+    assert_array_equal(cell_response.cell_dipole_gids, sorted(pyr_gids))
+    assert cell_response.cell_dipoles[0].dtype == np.float32
+    assert cell_response.cell_dipoles[0].shape == (len(pyr_gids),
+                                                   len(cell_response.times))
+    group_dipoles = cell_response.sum_cell_dipoles(
+        {'L5': net.gid_ranges['L5_pyramidal'],
+         'L2': net.gid_ranges['L2_pyramidal']})
+    for layer in ('L2', 'L5'):
+        dpl_layer = dpls[0].data[layer]
+        assert group_dipoles[layer].shape == (1, len(cell_response.times))
+        assert_allclose(group_dipoles[layer][0], dpl_layer, rtol=1e-5,
+                        atol=1e-5 * np.abs(dpl_layer).max())
+    with pytest.raises(ValueError, match="is not a recorded pyramidal cell"):
+        cell_response.sum_cell_dipoles({'basket': net.gid_ranges['L2_basket']})
+    assert_array_equal(cell_response[gid].cell_dipole_gids, [gid])
+
+    # test that the membrane current dipoles match the dipole mechanisms
+    with pytest.raises(ValueError, match="dipole_method must be"):
+        simulate_dipole(net, n_trials=1, dipole_method='axial')
+    net_bias = net.copy()
+    net_bias.add_tonic_bias(cell_type='L5_pyramidal', amplitude=0.5, t0=2,
+                            T=15)
+    net_mech = net_bias.copy()
+    dpls_mech = simulate_dipole(net_mech, n_trials=1, postproc=False)
+    dpls_imem = simulate_dipole(net_bias.copy(), n_trials=1, postproc=False,
+                                dipole_method='imem')
+    for layer in ('agg', 'L2', 'L5'):
+        dpl_layer = dpls_mech[0].data[layer]
+        assert_allclose(dpls_imem[0].data[layer], dpl_layer, rtol=0,
+                        atol=1e-6 * np.abs(dpl_layer).max())
+
+    # the cells with collapsed dendrites approximate the full ones, the
+    # dipole of the L2 cells, which barely spike, is the least accurate
+    dpls_reduced = simulate_dipole(net_bias, n_trials=1, postproc=False,
+                                   pyramidal_model='reduced')
+    for layer in ('agg', 'L5'):
+        dpl_layer = dpls_mech[0].data[layer]
+        rmse = np.sqrt(np.mean((dpls_reduced[0].data[layer] -
+                                dpl_layer) ** 2))
+        assert rmse < 0.15 * np.abs(dpl_layer).max()
+    for cell_type in ('L2_pyramidal', 'L5_pyramidal'):
+        n_spikes = [np.isin(n.cell_response.spike_gids[0],
+                            list(n.gid_ranges[cell_type])).sum()
+                    for n in (net_mech, net_bias)]
+        assert n_spikes[0] > 0
+        assert abs(n_spikes[1] - n_spikes[0]) <= 0.2 * n_spikes[0]
+
     # Test raster plot with no spikes
     params['tstop'] = 0.1
     net = Network(params)
@@ -95,6 +222,216 @@ def test_dipole_simulation():
     net.cell_response.plot_spikes_raster()
 
 
+def test_dipole_branches(reduced_params):
+    """Test simulating branches from their shared prefix."""
+    params = reduced_params()
+    net = Network(params, add_drives_from_params=True)
+    with pytest.raises(TypeError, match="branches must be list of dict"):
+        simulate_branches(net, {'evprox2': {'mu': 20.}})
+    with pytest.raises(TypeError, match="branches must be list of dict"):
+        simulate_branches(net, ['evprox2'])
+    with pytest.raises(ValueError, match="Unknown drive blah"):
+        simulate_branches(net, [{'blah': {'mu': 20.}}])
+    with pytest.raises(ValueError, match="Unknown dynamics blah"):
+        simulate_branches(net, [{'evprox2': {'blah': 20.}}])
+    with pytest.raises(ValueError, match="streaming and stop criteria of "
+                       "run_control are not supported with branches"):
+        simulate_branches(net, [{'evprox2': {'mu': 20.}}],
+                          run_control=RunControl(stream_dir='.'))
+    with pytest.raises(ValueError, match="solver='cvode' is not supported"):
+        simulate_branches(net, [{'evprox2': {'mu': 20.}}], solver='cvode')
+
+    branches = [{'evprox2': {'mu': 20.}},
+                {'evprox2': {'mu': 30.}, 'evdist1': {'mu': 15.}}]
+    branch_nets, branch_dpls = simulate_branches(net, branches, n_trials=2,
+                                                 record_vsoma=True)
+    assert 'branches' not in net.params
+    assert len(branch_nets) == len(branch_dpls) == 2
+    assert branch_nets[1].external_drives['evdist1']['dynamics']['mu'] == 15.
+
+    # each branch is identical to a simulation of its own network
+    for branch_net, dpls in zip(branch_nets, branch_dpls):
+        net_branch = branch_net.copy()
+        dpls_branch = simulate_dipole(net_branch, n_trials=2,
+                                      record_vsoma=True)
+        for trial_idx in range(2):
+            assert_array_equal(dpls[trial_idx].data['agg'],
+                               dpls_branch[trial_idx].data['agg'])
+            spikes = sorted(zip(
+                branch_net.cell_response.spike_times[trial_idx],
+                branch_net.cell_response.spike_gids[trial_idx]))
+            spikes_branch = sorted(zip(
+                net_branch.cell_response.spike_times[trial_idx],
+                net_branch.cell_response.spike_gids[trial_idx]))
+            assert spikes == spikes_branch
+            vsoma = branch_net.cell_response.vsoma[trial_idx]
+            for gid, vsoma_branch in \
+                    net_branch.cell_response.vsoma[trial_idx].items():
+                assert_array_equal(vsoma[gid], vsoma_branch)
+
+
+def test_dipole_spikes_only(tmpdir, reduced_params):
+    """Test simulating the spikes without the dipoles."""
+    params = reduced_params(tstop=25)
+    net = Network(params, add_drives_from_params=True)
+    with pytest.raises(TypeError, match="record_dipole must be bool, got int"):
+        simulate_dipole(net, n_trials=1, record_dipole=0)
+    with pytest.raises(ValueError, match="record_dipole=False cannot be "
+                       "combined with record_cell_dipoles=True"):
+        simulate_dipole(net, n_trials=1, record_dipole=False,
+                        record_cell_dipoles=True)
+    with pytest.raises(ValueError, match="record_dipole=False cannot be "
+                       "combined with"):
+        simulate_dipole(net, n_trials=1, record_dipole=False,
+                        dipole_method='imem')
+
+    net_dipole = net.copy()
+    simulate_dipole(net_dipole, n_trials=1, record_vsoma=True)
+    # the dipole mechanisms do not change the dynamics of the cells
+    spike_times = net_dipole.cell_response.spike_times
+    vsoma = net_dipole.cell_response.vsoma
+    stream_dir = str(tmpdir.join('stream'))
+    for run_control in (None, RunControl(stream_dir=stream_dir,
+                                         stream_interval=10.)):
+        net_spikes = net.copy()
+        dpls = simulate_dipole(net_spikes, n_trials=1, record_vsoma=True,
+                               record_dipole=False, run_control=run_control)
+        assert dpls == []
+        assert net_spikes.cell_response.spike_times == spike_times
+        for gid in vsoma[0]:
+            assert_array_equal(net_spikes.cell_response.vsoma[0][gid],
+                               vsoma[0][gid])
+
+    # the stop criteria get no Dipole
+    dpls_seen = list()
+
+    def stop_after_first_check(t, spike_times, spike_gids, dpl):
+        dpls_seen.append(dpl)
+        return True
+
+    net_stop = net.copy()
+    simulate_dipole(net_stop, n_trials=1, record_dipole=False,
+                    run_control=RunControl(
+                        stop_criteria=[stop_after_first_check]))
+    assert dpls_seen == [None]
+    assert len(net_stop.cell_response.spike_times[0]) < \
+        len(spike_times[0])
+
+
+def test_dipole_sweep(tmpdir, reduced_params):
+    """Test simulating the trials of the candidates of a sweep together."""
+    params = reduced_params()
+    net = Network(params, add_drives_from_params=True)
+    with pytest.raises(TypeError, match="overrides must be dict of list or "
+                       "list of dict, got dict of float"):
+        simulate_sweep(net, {'N_pyr_x': 4.})
+    with pytest.raises(ValueError, match="must contain at least one"):
+        simulate_sweep(net, [])
+    with pytest.raises(ValueError, match="Unknown parameter or drive"):
+        simulate_sweep(net, [{'foo': 1}])
+    with pytest.raises(ValueError, match="Unknown dynamics foo of drive"):
+        simulate_sweep(net, [{'evprox1': {'foo': 1}}])
+    with pytest.raises(ValueError, match="tstop cannot be swept"):
+        simulate_sweep(net, [{'tstop': 30.}])
+    for key in ('gbar_evprox_1_L2Pyr_ampa', 't_evprox_1',
+                'L5Pyr_Pois_lamtha'):
+        with pytest.raises(ValueError, match="%s cannot be swept, it is "
+                           "only read when the Network" % key):
+            simulate_sweep(net, [{key: net.params[key]}])
+    for key in ('L2Pyr_soma_gkbar_hh2', 'L5Pyr_apicaltrunk_L',
+                'L5Pyr_ampa_tau1'):
+        with pytest.raises(ValueError, match="%s cannot be swept, the cells "
+                           "are built from their default parameters" % key):
+            simulate_sweep(net, [{key: net.params[key]}])
+    with pytest.raises(ValueError, match="streaming of run_control are not "
+                       "supported with sweeps"):
+        simulate_sweep(net, [{'N_pyr_x': 4}], run_control=RunControl(
+            stream_dir=str(tmpdir.join('stream'))))
+    with pytest.raises(ValueError, match="record_gids cannot be combined"):
+        simulate_sweep(net, [{'N_pyr_x': 4}], record_gids='L2_basket')
+
+    # a new grid of cells, the other candidates share their build and
+    # differ in the weights and the events of the drives, the last one gets
+    # those of net back
+    overrides = [{'N_pyr_x': 4},
+                 {'evprox1': {'mu': 15., 'seedcore': 4},
+                  'gbar_L2Pyr_L2Pyr_ampa': 0.},
+                 {'evprox1': {'mu': 15., 'seedcore': 4}},
+                 dict()]
+    sweep = simulate_sweep(net, overrides, n_trials=2, ensemble_size=2,
+                           sweep_dir=str(tmpdir.join('sweep')))
+    assert 'sweep' not in net.params
+    assert_array_equal(sweep['candidate'], [0, 0, 1, 1, 2, 2, 3, 3])
+    assert_array_equal(sweep['trial'], [0, 1, 0, 1, 0, 1, 0, 1])
+    assert_array_equal(sweep['N_pyr_x'], [4, 4, 3, 3, 3, 3, 3, 3])
+    assert_array_equal(sweep['evprox1.mu'],
+                       [5., 5., 15., 15., 15., 15., 5., 5.])
+    assert_array_equal(sweep['evprox1.seedcore'], [2, 2, 4, 4, 4, 4, 2, 2])
+    gbar = net.params['gbar_L2Pyr_L2Pyr_ampa']
+    assert_array_equal(sweep['gbar_L2Pyr_L2Pyr_ampa'],
+                       [gbar, gbar, 0., 0., gbar, gbar, gbar, gbar])
+    assert_array_equal(np.load(str(tmpdir.join('sweep', 'dipole.agg.npy'))),
+                       sweep['dipole.agg'])
+
+    params_grid = params.copy()
+    params_grid['N_pyr_x'] = 4
+    net_grid = Network(params_grid, add_drives_from_params=True)
+    net_drive = net.copy()
+    net_drive.external_drives['evprox1']['dynamics']['mu'] = 15.
+    net_drive.external_drives['evprox1']['seedcore'] = 4
+    net_weights = net_drive.copy()
+    net_weights.params['gbar_L2Pyr_L2Pyr_ampa'] = 0.
+    for candidate_idx, candidate_net in enumerate((net_grid, net_weights,
+                                                   net_drive, net.copy())):
+        dpls = simulate_dipole(candidate_net, n_trials=2)
+        for trial_idx, dpl in enumerate(dpls):
+            row = 2 * candidate_idx + trial_idx
+            for layer in ('agg', 'L2', 'L5'):
+                assert_array_equal(sweep['dipole.%s' % layer][row],
+                                   dpl.data[layer])
+            spike_types = candidate_net.cell_response.spike_types[trial_idx]
+            for cell_type in net.cellname_list:
+                assert sweep['n_spikes.%s' % cell_type][row] == \
+                    spike_types.count(cell_type)
+
+    # the drives are attached to a new grid with their own arguments
+    net.add_evoked_drive('evdelays', mu=10., sigma=1., numspikes=1,
+                         location='proximal',
+                         weights_ampa={'L2_pyramidal': 1e-3},
+                         weights_nmda={'L5_pyramidal': 1e-3},
+                         space_constant=10.,
+                         synaptic_delays={'L2_pyramidal': 0.5,
+                                          'L5_pyramidal': 2.})
+    net_grid = _rebuild_network(net, params_grid)
+    for name, drive in net.external_drives.items():
+        for cell_type, conn in drive['conn'].items():
+            conn_grid = net_grid.external_drives[name]['conn'][cell_type]
+            for key in ('location', 'ampa', 'nmda'):
+                assert conn_grid[key] == conn[key]
+
+
+def test_dipole_sweep_keys(reduced_params):
+    """Test that each kind of override of a sweep changes the results."""
+    params = reduced_params()
+    net = Network(params, add_drives_from_params=True)
+    overrides = [dict(),
+                 {'N_pyr_x': 4},
+                 {'N_pyr_y': 4},
+                 {'gbar_L5Pyr_L5Pyr_ampa': 0.},
+                 {'L5Pyr_soma_v_init': -70.},
+                 {'celsius': 30.},
+                 {'threshold': -40.},
+                 {'secondorder': 2},
+                 {'dipole_scalefctr': 1.},
+                 {'dipole_smooth_win': 0},
+                 {'evprox1': {'sigma': 5.}},
+                 {'evprox1': {'seedcore': 4}}]
+    sweep = simulate_sweep(net, overrides, n_trials=1)
+    for row in range(1, len(overrides)):
+        assert not np.allclose(sweep['dipole.agg'][row],
+                               sweep['dipole.agg'][0]), overrides[row]
+
+
 @requires_mpi4py
 def test_cell_response_backends(run_hnn_core_fixture):
     """Test cell_response outputs across backends."""
@@ -119,8 +456,19 @@ def test_cell_response_backends(run_hnn_core_fixture):
     assert len(mpi_net.cell_response.vsoma[trial_idx][gid]) == n_times
     assert len(mpi_net.cell_response.isoma[
                trial_idx][gid]['soma_gabaa']) == n_times
-    assert mpi_net.cell_response.vsoma == joblib_net.cell_response.vsoma
-    assert mpi_net.cell_response.isoma == joblib_net.cell_response.isoma
+    for trial_idx in range(n_trials):
+        mpi_vsoma = mpi_net.cell_response.vsoma[trial_idx]
+        joblib_vsoma = joblib_net.cell_response.vsoma[trial_idx]
+        assert mpi_vsoma.keys() == joblib_vsoma.keys()
+        for gid in joblib_vsoma:
+            assert_array_equal(mpi_vsoma[gid], joblib_vsoma[gid])
+        mpi_isoma = mpi_net.cell_response.isoma[trial_idx]
+        joblib_isoma = joblib_net.cell_response.isoma[trial_idx]
+        assert mpi_isoma.keys() == joblib_isoma.keys()
+        for gid in joblib_isoma:
+            for syn_key in joblib_isoma[gid]:
+                assert_array_equal(mpi_isoma[gid][syn_key],
+                                   joblib_isoma[gid][syn_key])
 
     # Test if spike time falls within depolarization window above v_thresh
     v_thresh = 0.0
@@ -70,6 +70,15 @@ def test_add_drives():
         net.add_poisson_drive('tonic_drive', location='distal',
                               rate_constant={'L2_pyramidal': 10.,
                                              'bogus_celltype': 20.})
+    with pytest.raises(ValueError,
+                       match="event_generator must be 'python' or 'netstim'"):
+        net.add_poisson_drive('tonic_drive', location='distal',
+                              rate_constant=10., event_generator='neuron')
+    with pytest.raises(ValueError,
+                       match='seedcore must be non-negative with'):
+        net.add_poisson_drive('tonic_drive', location='distal',
+                              rate_constant=10., event_generator='netstim',
+                              seedcore=-1)
     # bursty
     with pytest.raises(ValueError,
                        match='End time of bursty drive cannot be negative'):
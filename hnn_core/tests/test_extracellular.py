@@ -0,0 +1,99 @@
+import numpy as np
+from numpy.testing import assert_allclose
+import pytest
+from neuron import h
+
+from hnn_core import Network, simulate_dipole
+from hnn_core.extracellular import (ExtracellularArray, _get_segment_ends,
+                                    _transfer_resistance)
+
+
+def test_extracellular_array():
+    """Test extracellular array object and transfer resistances."""
+    with pytest.raises(ValueError, match="positions must be of shape"):
+        ExtracellularArray([(0., 0.)])
+    with pytest.raises(ValueError, match="conductivity must be a positive"):
+        ExtracellularArray([(0., 0., 0.)], conductivity=0.)
+    with pytest.raises(ValueError, match="method must be 'psa' or 'lsa'"):
+        ExtracellularArray([(0., 0., 0.)], method='csd')
+    with pytest.raises(ValueError, match="min_distance must be a positive"):
+        ExtracellularArray([(0., 0., 0.)], min_distance=-1.)
+
+    # a short line source equals a point source at its center
+    seg_starts = np.array([[0., -0.5, 0.], [10., -0.5, 0.]])
+    seg_ends = np.array([[0., 0.5, 0.], [10., 0.5, 0.]])
+    positions = np.array([[0., 1000., 0.], [500., 0., 0.]])
+    r_psa = _transfer_resistance(seg_starts, seg_ends, positions, 0.3,
+                                 'psa', 0.5)
+    r_lsa = _transfer_resistance(seg_starts, seg_ends, positions, 0.3,
+                                 'lsa', 0.5)
+    assert r_psa.shape == (2, 2)
+    assert_allclose(r_psa[0, 0], 1e3 / (4 * np.pi * 0.3 * 1000.))
+    assert_allclose(r_lsa, r_psa, rtol=1e-6)
+    # contacts on a segment are at min_distance
+    r_psa = _transfer_resistance(seg_starts, seg_ends, seg_starts, 0.3,
+                                 'psa', 0.5)
+    assert_allclose(r_psa[0, 0], 1e3 / (4 * np.pi * 0.3 * 0.5))
+
+    # the segments are placed along the 3D points
+    sect = h.Section(name='dend')
+    sect.nseg = 2
+    sect.pt3dadd(0., 0., 0., 1.)
+    sect.pt3dadd(0., 10., 0., 1.)
+    sect.pt3dadd(0., 10., 30., 1.)
+    seg_starts, seg_ends = _get_segment_ends(sect)
+    assert_allclose(seg_starts, [[0., 0., 0.], [0., 10., 10.]])
+    assert_allclose(seg_ends, [[0., 10., 10.], [0., 10., 30.]])
+    sect.pt3dclear()
+    with pytest.raises(ValueError, match="needs at least 2 3D points"):
+        _get_segment_ends(sect)
+    sect.pt3dadd(0., 0., 0., 1.)
+    sect.pt3dadd(0., 0., 0., 1.)
+    with pytest.raises(ValueError, match="and a positive length"):
+        _get_segment_ends(sect)
+
+    # the CSD of a quadratic potential is constant
+    depths = np.arange(5) * 100.
+    rec_array = ExtracellularArray([(0., depth, 0.) for depth in depths])
+    rec_array._voltages.append(np.tile(depths[:, None] ** 2, (1, 3)))
+    csd = rec_array.csd()
+    assert len(csd) == 1
+    assert_allclose(csd[0], -1e3 * 0.3 * 2.)
+    rec_array = ExtracellularArray([(0., 0., 0.), (0., 10., 0.),
+                                    (0., 30., 0.)])
+    with pytest.raises(ValueError, match="must be evenly spaced"):
+        rec_array.csd()
+
+
+def test_extracellular_simulation(reduced_params):
+    """Test recording of extracellular potentials."""
+    params = reduced_params(tstop=25)
+    net = Network(params, add_drives_from_params=True)
+    positions = [(100., depth, 500.) for depth in range(-500, 2000, 100)]
+    net.add_electrode_array('shank', positions)
+    net.add_electrode_array('shank_lsa', positions, method='lsa')
+    # far away from the cells only the dipole remains
+    net.add_electrode_array('far', [(100., 1e5, 100.)])
+    with pytest.raises(ValueError, match="Electrode array shank already"):
+        net.add_electrode_array('shank', positions)
+    with pytest.raises(TypeError, match="name must be str"):
+        net.add_electrode_array(1, positions)
+
+    dpls = simulate_dipole(net, n_trials=1, postproc=False)
+    voltages = net.rec_arrays['shank'].voltages
+    assert len(voltages) == 1
+    assert voltages[0].shape == (len(positions), len(net.cell_response.times))
+    assert_allclose(net.rec_arrays['shank'].times, net.cell_response.times)
+    assert np.all(voltages[0][:, 0] == 0.)
+    assert np.abs(voltages[0]).max() > 0.
+    # the contacts are more than 300 um from the nearest cell
+    assert_allclose(net.rec_arrays['shank_lsa'].voltages[0], voltages[0],
+                    rtol=0, atol=0.05 * np.abs(voltages[0]).max())
+
+    # potential of a dipole along the y-axis, fAm -> uV
+    far = net.rec_arrays['far'].voltages[0][0]
+    dpl_far = dpls[0].data['agg'] * 1e-15 / (4 * np.pi * 0.3 * 0.1 ** 2) * 1e6
+    assert np.corrcoef(far, dpl_far)[0, 1] > 0.9
+
+    net_copy = net.copy()
+    assert len(net_copy.rec_arrays['shank'].voltages) == 0
@@ -4,12 +4,13 @@ from copy import deepcopy
 import os.path as op
 from glob import glob
 import numpy as np
-from numpy.testing import assert_allclose
+from numpy.testing import assert_allclose, assert_array_equal
 import pytest
 
 import hnn_core
 from hnn_core import read_params, Network, CellResponse, read_spikes
-from hnn_core.network_builder import NetworkBuilder
+from hnn_core.network_builder import (NetworkBuilder, _simulate_single_trial,
+                                      _DEFAULT_OPTIONS)
 
 
 def test_network():
@@ -162,6 +163,82 @@ def test_network():
     n_conn = len(net.gid_ranges['L5_basket'])
     assert len(network_builder.ncs['extgauss_L5Basket_gabaa']) == n_conn
 
+    # the initial membrane potentials are set from the params
+    l5_pyr = network_builder.cells[net.gid_ranges['L5_pyramidal'][0]]
+    assert l5_pyr.soma(0.5).v == params['L5Pyr_soma_v_init']
+    assert l5_pyr.dends['apical_tuft'](0.5).v == -67.30
+    net.params['L5Pyr_apical*_v_init'] = -60.
+    network_builder.state_init()
+    assert l5_pyr.soma(0.5).v == params['L5Pyr_soma_v_init']
+    for sect_name in ['apical_1', 'apical_2', 'apical_tuft']:
+        assert all(seg.v == -60. for seg in l5_pyr.dends[sect_name])
+
+
+def test_network_builder_connections():
+    """Test updating the connections of a built network in place."""
+    hnn_core_root = op.dirname(hnn_core.__file__)
+    params_fname = op.join(hnn_core_root, 'param', 'default.json')
+    params = read_params(params_fname)
+    params.update({'N_pyr_x': 3, 'N_pyr_y': 3, 'tstop': 25.})
+    net = Network(params, add_drives_from_params=True)
+    net._instantiate_drives(n_trials=1)
+    net.params.update({'record_vsoma': False, 'record_isoma': False})
+
+    def get_connections(network_builder):
+        return {name: [(nc.weight[0], nc.delay) for nc in ncs]
+                for name, ncs in network_builder.ncs.items()}
+
+    network_builder = NetworkBuilder(net)
+    connections = get_connections(network_builder)
+    with pytest.raises(ValueError, match='No connection matches foo'):
+        network_builder.scale_connections(weights={'foo': 2.})
+    network_builder.scale_connections(weights={'evprox1_*': 2.},
+                                      delays={'L2Pyr_L2Pyr_*': 0.5})
+    connections_scaled = get_connections(network_builder)
+    for name, nc_params in connections.items():
+        weight_factor = 2. if name.startswith('evprox1_') else 1.
+        delay_factor = 0.5 if name.startswith('L2Pyr_L2Pyr_') else 1.
+        assert connections_scaled[name] == [
+            (weight * weight_factor, delay * delay_factor)
+            for weight, delay in nc_params]
+
+    # the weights of new parameters are those of a new build
+    network_builder.update_connections({'gbar_L2Pyr_L2Pyr_ampa': 1e-3,
+                                        'gbar_L5Basket_L5Pyr_gabaa': 0.})
+    assert net.params['gbar_L2Pyr_L2Pyr_ampa'] == 1e-3
+    connections_updated = get_connections(network_builder)
+    assert connections_updated['L2Pyr_L2Pyr_ampa'] != \
+        connections['L2Pyr_L2Pyr_ampa']
+    assert connections_updated == get_connections(NetworkBuilder(net))
+    for key in ('gbar_evprox_1_L2Pyr_ampa', 'foo'):
+        with pytest.raises(ValueError, match="params must contain parameters "
+                           "of the connections between cells, got %s" % key):
+            network_builder.update_connections({key: 0.})
+
+
+def test_network_builder_pyramidal_model(reduced_params):
+    """Test that the reduced pyramidal cells get the inputs of the full
+    ones."""
+    net = Network(reduced_params(tstop=25), add_drives_from_params=True)
+    net._instantiate_drives(n_trials=1)
+
+    def get_inputs(network_builder):
+        # the source, target, synapse key and weight of each NetCon
+        syn_keys = {syn.hname(): (cell.gid, key)
+                    for cell in network_builder.cells
+                    for key, syn in cell.synapses.items()}
+        return {name: sorted((nc.srcgid(),) + syn_keys[nc.syn().hname()] +
+                             (nc.weight[0],) for nc in ncs)
+                for name, ncs in network_builder.ncs.items()}
+
+    inputs = [get_inputs(NetworkBuilder(net, options=dict(
+        _DEFAULT_OPTIONS, pyramidal_model=pyramidal_model)))
+        for pyramidal_model in ('full', 'reduced')]
+    assert inputs[1] == inputs[0]
+    # each proximal input reaches the synapses of both basal dendrites
+    assert any(syn_key == 'basal3_ampa' for nc_inputs in inputs[1].values()
+               for _, _, syn_key, _ in nc_inputs)
+
 
 def test_tonic_biases():
     """Test tonic biases."""
@@ -353,3 +430,17 @@ def test_cell_response(tmpdir):
                       'L5_pyramidal': range(4, 6), 'L5_basket': range(6, 8)}
         cell_response = read_spikes(tmpdir.join('spk_*.txt'),
                                     gid_ranges=gid_ranges)
+
+
+def test_network_builder_state_init(reduced_params):
+    """Test that a simulated network is initialized as a new one."""
+    params = reduced_params(tstop=25.)
+    net = Network(params, add_drives_from_params=True)
+
+    network_builder = NetworkBuilder(net)
+    dpl = _simulate_single_trial(network_builder, 0)[0]
+    # the nodes at the ends of the sections keep their last potential
+    # unless state_init resets them
+    network_builder.state_init()
+    dpl_again = _simulate_single_trial(network_builder, 0)[0]
+    assert_array_equal(dpl.data['agg'], dpl_again.data['agg'])
@@ -0,0 +1,404 @@
+import os
+import subprocess
+import sys
+from textwrap import dedent
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+import pytest
+
+from hnn_core import Network, RunControl, simulate_dipole, simulate_branches
+from hnn_core import network_builder
+from hnn_core.parallel_backends import requires_mpi4py
+
+
+@requires_mpi4py
+def test_gather_rows_to_root(tmpdir):
+    """Test gathering the rows of two ranks in several rounds."""
+    script = dedent("""
+        from mpi4py import MPI
+        from neuron import h
+        h.nrnmpi_init()
+        import numpy as np
+        from hnn_core import network_builder
+
+        network_builder._create_parallel_context()
+        # two rows of each rank per round
+        network_builder._MPI_MAX_COUNT = 12
+        rank = network_builder._get_rank()
+
+        def _get_rows(rank, n_rows, dtype):
+            return (rank * 100 + np.arange(n_rows * 3)).reshape(
+                n_rows, 3).astype(dtype)
+
+        for n_rows, dtype in (((5, 8), float), ((0, 3), np.float32),
+                              ((1, 1), float), ((0, 0), float)):
+            rows = network_builder._gather_rows_to_root(
+                _get_rows(rank, n_rows[rank], dtype))
+            if rank == 0:
+                expected = np.concatenate([_get_rows(0, n_rows[0], dtype),
+                                           _get_rows(1, n_rows[1], dtype)])
+                assert rows.dtype == expected.dtype
+                np.testing.assert_array_equal(rows, expected)
+            else:
+                assert rows is None
+        if rank == 0:
+            print('gathered')
+    """)
+    # mpiexec may be missing or refuse to start, e.g. as root without
+    # OMPI_ALLOW_RUN_AS_ROOT
+    mpi_cmd = ['mpiexec', '--oversubscribe', '-np', '2', sys.executable]
+    try:
+        proc = subprocess.run(mpi_cmd + ['-c', 'pass'], capture_output=True,
+                              text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired) as err:
+        pytest.skip('mpiexec cannot start: %s' % err)
+    if proc.returncode != 0:
+        pytest.skip('mpiexec cannot start: %s' % proc.stderr.strip())
+
+    fname = tmpdir.join('gather_rows.py')
+    fname.write(script)
+    proc = subprocess.run(mpi_cmd + [str(fname)], capture_output=True,
+                          text=True, timeout=300)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert 'gathered' in proc.stdout
+
+
+def test_warmup(tmpdir, monkeypatch, reduced_params):
+    """Test starting the trials from a cached warm-up state."""
+    params = reduced_params(tstop=25)
+    net = Network(params, add_drives_from_params=True)
+    with pytest.raises(TypeError, match="warmup must be float or None"):
+        simulate_dipole(net, n_trials=1, warmup='100')
+    with pytest.raises(ValueError, match="warmup must be positive"):
+        simulate_dipole(net, n_trials=1, warmup=0.)
+    with pytest.raises(TypeError, match="warmup_dir must be str or None"):
+        simulate_dipole(net, n_trials=1, warmup=100., warmup_dir=1)
+
+    gid = net.gid_ranges['L5_pyramidal'][0]
+    warmup_dir = str(tmpdir.join('warmup'))
+    net_warm = net.copy()
+    dpls_warm = simulate_dipole(net_warm, n_trials=2, record_vsoma=True,
+                                warmup=50., warmup_dir=warmup_dir)
+    assert len(os.listdir(warmup_dir)) == 1
+    for trial_idx in range(2):
+        vsoma = net_warm.cell_response.vsoma[trial_idx][gid]
+        assert vsoma[0] != params['L5Pyr_soma_v_init']
+    # the drives are still delivered after the warm-up
+    assert len(net_warm.cell_response.spike_times[0]) > 0
+
+    # the second simulation starts from the cached state
+    net_cached = net.copy()
+    dpls_cached = simulate_dipole(net_cached, n_trials=1, record_vsoma=True,
+                                  warmup=50., warmup_dir=warmup_dir)
+    assert len(os.listdir(warmup_dir)) == 1
+    assert_array_equal(dpls_cached[0].data['agg'], dpls_warm[0].data['agg'])
+    assert_array_equal(net_cached.cell_response.vsoma[0][gid],
+                       net_warm.cell_response.vsoma[0][gid])
+
+    # without a directory, the warm-up is not cached
+    net_uncached = net.copy()
+    dpls_uncached = simulate_dipole(net_uncached, n_trials=1, warmup=50.)
+    assert_array_equal(dpls_uncached[0].data['agg'],
+                       dpls_warm[0].data['agg'])
+
+    # the states of other mechanisms are not reused
+    monkeypatch.setattr(network_builder, '_get_mod_hash', lambda: 'other')
+    simulate_dipole(net.copy(), n_trials=1, warmup=50.,
+                    warmup_dir=warmup_dir)
+    assert len(os.listdir(warmup_dir)) == 2
+
+    # the cells spiking during the warm-up do not disturb the trials
+    net_bias = net.copy()
+    net_bias.add_tonic_bias(cell_type='L5_pyramidal', amplitude=1., t0=0,
+                            T=25)
+    for solver in ('fixed', 'cvode'):
+        simulate_dipole(net_bias, n_trials=1, warmup=50., solver=solver)
+        assert gid in net_bias.cell_response.spike_gids[0]
+
+
+def test_solver(reduced_params):
+    """Test simulating with variable time steps."""
+    params = reduced_params(tstop=30)
+    net = Network(params, add_drives_from_params=True)
+    with pytest.raises(ValueError, match="solver must be 'fixed', 'cvode'"):
+        simulate_dipole(net, solver='euler')
+    with pytest.raises(TypeError, match="cvode_atol must be float"):
+        simulate_dipole(net, solver='cvode', cvode_atol='1e-3')
+    with pytest.raises(ValueError, match="cvode_rtol must be non-negative"):
+        simulate_dipole(net, solver='cvode', cvode_rtol=-1.)
+    with pytest.raises(ValueError, match="cannot both be zero"):
+        simulate_dipole(net, solver='cvode', cvode_atol=0.)
+    with pytest.raises(ValueError, match="requires dipole_method"):
+        simulate_dipole(net, solver='cvode', dipole_method='imem')
+    with pytest.raises(ValueError, match="cannot be combined"):
+        simulate_dipole(net, solver='lvardt',
+                        run_control=RunControl(stream_dir='.'))
+
+    dpls = simulate_dipole(net, n_trials=1, record_vsoma=True,
+                           record_dt=0.5, postproc=False)
+    net_lvardt = net.copy()
+    dpls_lvardt = simulate_dipole(net_lvardt, n_trials=1, record_vsoma=True,
+                                  record_dt=0.5, postproc=False,
+                                  solver='lvardt', cvode_atol=1e-4)
+    # the solutions differ by the error of the fixed time step, mostly in
+    # the timing of spikes
+    assert_array_equal(dpls_lvardt[0].times, dpls[0].times)
+    for layer in ('L2', 'L5', 'agg'):
+        data = dpls[0].data[layer]
+        rmse = np.sqrt(np.mean((dpls_lvardt[0].data[layer] - data) ** 2))
+        assert rmse < 0.1 * np.abs(data).max()
+    vsoma = net.cell_response.vsoma[0]
+    for gid, vsoma_lvardt in net_lvardt.cell_response.vsoma[0].items():
+        assert len(vsoma_lvardt) == len(net.cell_response.soma_times)
+        assert_allclose(vsoma_lvardt[0], vsoma[gid][0])
+
+
+def test_secondorder(reduced_params):
+    """Test simulating with Crank-Nicolson and a larger time step."""
+    params = reduced_params(tstop=30)
+    assert params['secondorder'] == 0
+    net = Network(params, add_drives_from_params=True)
+    net.params['secondorder'] = 3
+    with pytest.raises(ValueError, match="must be 0, 1 or 2, got 3"):
+        simulate_dipole(net)
+    net.params['secondorder'] = 2
+    with pytest.raises(ValueError, match="requires solver='fixed'"):
+        simulate_dipole(net, solver='lvardt')
+
+    dpls = simulate_dipole(net.copy(), n_trials=1)
+    params.update({'dt': 0.05, 'secondorder': 2})
+    net_fast = Network(params, add_drives_from_params=True)
+    dpls_fast = simulate_dipole(net_fast, n_trials=1)
+    assert_allclose(dpls_fast[0].times, dpls[0].times[::2])
+    # the dipoles of Crank-Nicolson oscillate with a period of two time
+    # steps, the smoothing window of the post-processing removes it
+    for layer in ('L2', 'L5', 'agg'):
+        data = dpls[0].data[layer][::2]
+        rmse = np.sqrt(np.mean((dpls_fast[0].data[layer] - data) ** 2))
+        assert rmse < 0.01 * np.abs(data).max()
+
+
+def test_drive_spikes(reduced_params):
+    """Test leaving the spikes of the drives out of the recordings."""
+    params = reduced_params(tstop=25)
+    net = Network(params, add_drives_from_params=True)
+    with pytest.raises(TypeError, match="record_drive_spikes must be bool, "
+                       "got str"):
+        simulate_dipole(net, n_trials=1, record_drive_spikes='no')
+
+    net_all = net.copy()
+    dpls = simulate_dipole(net_all, n_trials=2, postproc=False)
+    net_cells = net.copy()
+    dpls_cells = simulate_dipole(net_cells, n_trials=2, postproc=False,
+                                 record_drive_spikes=False)
+    cell_gids = [gid for name in net.cellname_list
+                 for gid in net.gid_ranges[name]]
+    cell_response = net_cells.cell_response
+    for trial_idx in range(2):
+        assert_array_equal(dpls_cells[trial_idx].data['agg'],
+                           dpls[trial_idx].data['agg'])
+        assert set(cell_response.spike_gids[trial_idx]) <= set(cell_gids)
+        assert len(cell_response.spike_gids[trial_idx]) < \
+            len(net_all.cell_response.spike_gids[trial_idx])
+
+    # the spikes of the drives are their events up to the end of the trial
+    cell_response.add_drive_spikes()
+    for trial_idx in range(2):
+        spikes = sorted(zip(cell_response.spike_times[trial_idx],
+                            cell_response.spike_gids[trial_idx],
+                            cell_response.spike_types[trial_idx]))
+        spikes_all = sorted(zip(net_all.cell_response.spike_times[trial_idx],
+                                net_all.cell_response.spike_gids[trial_idx],
+                                net_all.cell_response.spike_types[trial_idx]))
+        assert spikes == spikes_all
+        assert np.all(np.diff(cell_response.spike_times[trial_idx]) >= 0)
+    # the spikes of the drives are only added once
+    cell_response.add_drive_spikes()
+    assert len(cell_response.spike_times[1]) == len(spikes_all)
+
+    # a stopped trial ends early
+    def stop_at_12ms(t, spike_times, spike_gids, dpl):
+        return t > 11.
+
+    net_stop = net.copy()
+    run_control = RunControl(stop_criteria=[stop_at_12ms],
+                             stop_check_interval=6.)
+    simulate_dipole(net_stop, n_trials=1, record_drive_spikes=False,
+                    run_control=run_control)
+    net_stop.cell_response.add_drive_spikes()
+    spike_times = net_stop.cell_response.spike_times[0]
+    assert 0 < max(spike_times) <= 12. + 1e-6
+
+
+def test_netstim_drives(reduced_params):
+    """Test Poisson drives whose events are generated by NEURON."""
+    params = reduced_params(tstop=60)
+    net = Network(params, legacy_mode=False)
+    rates = {'L2_basket': 50., 'L2_pyramidal': 50., 'L5_basket': 100.,
+             'L5_pyramidal': 100.}
+    weights = {cell_type: 1e-3 for cell_type in rates}
+    net.add_poisson_drive('poisson', tstart=10., tstop=40.,
+                          rate_constant=rates, location='distal',
+                          weights_ampa=weights, event_generator='netstim')
+    with pytest.raises(ValueError, match="The drives with event_generator="
+                       "'netstim' \\(poisson\\) cannot be combined"):
+        simulate_dipole(net, n_trials=1, record_drive_spikes=False)
+    with pytest.raises(ValueError, match="cannot be combined with "
+                       "record_drive_spikes=False, warmup"):
+        simulate_dipole(net, n_trials=1, warmup=10.)
+    with pytest.raises(ValueError, match="are not supported with branches"):
+        simulate_branches(net, [{'poisson': {'tstart': 20.}}])
+
+    def get_drive_spikes(net, trial_idx):
+        spike_times = np.array(net.cell_response.spike_times[trial_idx])
+        spike_gids = np.array(net.cell_response.spike_gids[trial_idx])
+        is_drive = np.in1d(spike_gids, net.gid_ranges['poisson'])
+        return spike_times[is_drive], spike_gids[is_drive]
+
+    net_1 = net.copy()
+    dpls_1 = simulate_dipole(net_1, n_trials=2, postproc=False)
+    # the events are not stored in the network
+    assert all(len(cell_events) == 0 for trial_events in
+               net_1.external_drives['poisson']['events']
+               for cell_events in trial_events)
+    net_2 = net.copy()
+    dpls_2 = simulate_dipole(net_2, n_trials=2, postproc=False)
+    n_drive_cells = len(net.gid_ranges['poisson'])
+    for trial_idx in range(2):
+        spike_times, spike_gids = get_drive_spikes(net_1, trial_idx)
+        assert np.all((spike_times > 10.) & (spike_times < 40.))
+        # about 30 ms * 50-100 Hz = 1.5-3 events per drive cell
+        assert n_drive_cells < len(spike_times) < 4 * n_drive_cells
+        # the events of a trial are reproducible
+        assert_array_equal(dpls_1[trial_idx].data['agg'],
+                           dpls_2[trial_idx].data['agg'])
+        assert_array_equal(spike_times, get_drive_spikes(net_2, trial_idx)[0])
+    # the trials have their own events
+    assert not np.array_equal(get_drive_spikes(net_1, 0)[0],
+                              get_drive_spikes(net_1, 1)[0])
+
+
+def test_patternstim(reduced_params):
+    """Test delivering the events of the drives with a PatternStim."""
+    params = reduced_params()
+    net = Network(params, add_drives_from_params=True)
+    # a drive that is not cell-specific shares its drive cell
+    weights = {'L2_pyramidal': 1e-3, 'L5_pyramidal': 1e-3}
+    net.add_bursty_drive('bursty', tstart=5., burst_rate=100., burst_std=1.,
+                         location='distal', weights_ampa=weights)
+    with pytest.raises(ValueError, match="drive_method must be 'vecstim' or "
+                       "'patternstim', got blah"):
+        simulate_dipole(net, n_trials=1, drive_method='blah')
+
+    # the VecStims may deliver their events off by round-off
+    def get_spikes(net, trial_idx):
+        return np.array(sorted(zip(net.cell_response.spike_times[trial_idx],
+                                   net.cell_response.spike_gids[trial_idx])))
+
+    net_vecstim = net.copy()
+    dpls_vecstim = simulate_dipole(net_vecstim, n_trials=2,
+                                   record_vsoma=True)
+    net_pattern = net.copy()
+    dpls_pattern = simulate_dipole(net_pattern, n_trials=2,
+                                   record_vsoma=True,
+                                   drive_method='patternstim')
+    for trial_idx in range(2):
+        assert_array_equal(dpls_pattern[trial_idx].data['agg'],
+                           dpls_vecstim[trial_idx].data['agg'])
+        # including the spikes of the drives
+        assert_allclose(get_spikes(net_pattern, trial_idx),
+                        get_spikes(net_vecstim, trial_idx), rtol=0,
+                        atol=1e-12)
+        vsoma = net_vecstim.cell_response.vsoma[trial_idx]
+        for gid, vsoma_pattern in \
+                net_pattern.cell_response.vsoma[trial_idx].items():
+            assert_array_equal(vsoma[gid], vsoma_pattern)
+
+    # the spikes of a stopped trial and of the drives added later
+    def stop_at_20ms(t, spike_times, spike_gids, dpl):
+        return t > 19.
+
+    net_pattern = net.copy()
+    run_control = RunControl(stop_criteria=[stop_at_20ms],
+                             stop_check_interval=5.)
+    simulate_dipole(net_pattern, n_trials=1, drive_method='patternstim',
+                    record_drive_spikes=False, run_control=run_control)
+    net_pattern.cell_response.add_drive_spikes()
+    spikes = get_spikes(net_vecstim, 0)
+    assert_allclose(get_spikes(net_pattern, 0),
+                    spikes[spikes[:, 0] <= 20. + 1e-6], rtol=0, atol=1e-12)
+
+    # the branches continue from a state without the events of the
+    # PatternStim
+    branches = [{'evprox2': {'mu': 20.}}, {'evprox2': {'mu': 30.}}]
+    branch_dpls = dict()
+    for drive_method in ('vecstim', 'patternstim'):
+        _, branch_dpls[drive_method] = simulate_branches(
+            net, branches, n_trials=1, drive_method=drive_method)
+    for dpls_vecstim, dpls_pattern in zip(branch_dpls['vecstim'],
+                                          branch_dpls['patternstim']):
+        assert_array_equal(dpls_pattern[0].data['agg'],
+                           dpls_vecstim[0].data['agg'])
+
+
+def test_ensemble(tmpdir, reduced_params):
+    """Test simulating trials together as replicas of the network."""
+    params = reduced_params()
+    net = Network(params, add_drives_from_params=True)
+    with pytest.raises(TypeError, match="ensemble_size must be int, got "
+                       "float"):
+        simulate_dipole(net, n_trials=2, ensemble_size=2.)
+    with pytest.raises(ValueError, match="ensemble_size must be positive, "
+                       "got 0"):
+        simulate_dipole(net, n_trials=2, ensemble_size=0)
+    with pytest.raises(ValueError, match="ensemble_size > 1 cannot be "
+                       "combined with"):
+        simulate_dipole(net, n_trials=2, ensemble_size=2,
+                        run_control=RunControl(
+                            stream_dir=str(tmpdir.join('stream'))))
+    with pytest.raises(ValueError, match="ensemble_size > 1 cannot be "
+                       "combined with"):
+        simulate_dipole(net, n_trials=2, ensemble_size=2, solver='cvode')
+
+    gid = net.gid_ranges['L5_pyramidal'][0]
+    kwargs = dict(record_vsoma=True, record_gids=['L2_basket', gid],
+                  record_cell_dipoles=True)
+    net_single = net.copy()
+    dpls_single = simulate_dipole(net_single, n_trials=3, **kwargs)
+    # a batch of two trials and a batch of one
+    net_ensemble = net.copy()
+    dpls_ensemble = simulate_dipole(net_ensemble, n_trials=3,
+                                    ensemble_size=2, **kwargs)
+    cell_response = net_single.cell_response
+    cell_response_ensemble = net_ensemble.cell_response
+    assert len(dpls_ensemble) == 3
+    assert_array_equal(cell_response_ensemble.cell_dipole_gids,
+                       cell_response.cell_dipole_gids)
+    for trial_idx in range(3):
+        assert_array_equal(dpls_ensemble[trial_idx].data['agg'],
+                           dpls_single[trial_idx].data['agg'])
+        assert cell_response_ensemble.spike_times[trial_idx] == \
+            cell_response.spike_times[trial_idx]
+        assert cell_response_ensemble.spike_gids[trial_idx] == \
+            cell_response.spike_gids[trial_idx]
+        vsoma = cell_response.vsoma[trial_idx]
+        assert list(cell_response_ensemble.vsoma[trial_idx]) == list(vsoma)
+        for gid, vsoma_ensemble in \
+                cell_response_ensemble.vsoma[trial_idx].items():
+            assert_array_equal(vsoma_ensemble, vsoma[gid])
+        assert_array_equal(cell_response_ensemble.cell_dipoles[trial_idx],
+                           cell_response.cell_dipoles[trial_idx])
+    # the trials have their own events
+    assert not np.array_equal(dpls_ensemble[0].data['agg'],
+                              dpls_ensemble[1].data['agg'])
+
+    # the replicas are allocated in contiguous order without the dipole
+    # mechanisms
+    net_imem = net.copy()
+    dpls_imem = simulate_dipole(net_imem, n_trials=2, ensemble_size=2,
+                                dipole_method='imem',
+                                drive_method='patternstim')
+    for dpl_imem, dpl in zip(dpls_imem, dpls_single):
+        assert_allclose(dpl_imem.data['agg'], dpl.data['agg'], rtol=1e-6,
+                        atol=1e-8)
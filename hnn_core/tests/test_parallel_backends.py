@@ -1,5 +1,4 @@
 import os.path as op
-from os import environ
 import io
 from contextlib import redirect_stdout
 from multiprocessing import cpu_count
@@ -10,7 +9,7 @@ import pytest
 from mne.utils import _fetch_file
 
 import hnn_core
-from hnn_core import read_params
+from hnn_core import read_params, Network, simulate_dipole
 from hnn_core import MPIBackend
 from hnn_core.parallel_backends import requires_mpi4py
 
@@ -123,10 +122,11 @@ class TestParallelBackends():
 # there are no dependencies if this unit tests fails; no need to be in
 # class marked incremental
 @requires_mpi4py
-def test_mpi_failure(run_hnn_core_fixture):
+def test_mpi_failure(run_hnn_core_fixture, monkeypatch):
     """Test that an MPI failure is handled and messages are printed"""
-    # this MPI paramter will cause a MPI job to fail
-    environ["OMPI_MCA_btl"] = "self"
+    # this MPI paramter will cause a MPI job to fail, it is unset after the
+    # test even if the test fails
+    monkeypatch.setenv("OMPI_MCA_btl", "self")
 
     with pytest.warns(UserWarning) as record:
         with io.StringIO() as buf, redirect_stdout(buf):
@@ -141,4 +141,46 @@ def test_mpi_failure(run_hnn_core_fixture):
     assert len(record) == 1
     assert record[0].message.args[0] == expected_string
 
-    del environ["OMPI_MCA_btl"]
+
+@requires_mpi4py
+def test_mpi_gather(two_mpi_procs, reduced_params):
+    """Test gathering the recordings of two MPI processes."""
+    params = reduced_params(tstop=25.)
+    net = Network(params, add_drives_from_params=True)
+    kwargs = dict(n_trials=2, record_vsoma=True, record_isoma=True,
+                  record_cell_dipoles=True, postproc=False)
+
+    net_joblib = net.copy()
+    dpls_joblib = simulate_dipole(net_joblib, **kwargs)
+    net_mpi = net.copy()
+    with MPIBackend(n_procs=2) as backend:
+        assert backend.n_procs == 2
+        dpls_mpi = simulate_dipole(net_mpi, **kwargs)
+
+    response_joblib = net_joblib.cell_response
+    response_mpi = net_mpi.cell_response
+    for trial_idx in range(2):
+        # the dipoles of the ranks are summed in another order
+        for layer in ('agg', 'L2', 'L5'):
+            assert_allclose(dpls_mpi[trial_idx].data[layer],
+                            dpls_joblib[trial_idx].data[layer], rtol=1e-12,
+                            atol=1e-12)
+        # the spikes of each rank follow each other
+        spikes_joblib = sorted(zip(response_joblib.spike_times[trial_idx],
+                                   response_joblib.spike_gids[trial_idx]))
+        spikes_mpi = sorted(zip(response_mpi.spike_times[trial_idx],
+                                response_mpi.spike_gids[trial_idx]))
+        assert len(spikes_mpi) > 0
+        assert spikes_mpi == spikes_joblib
+        vsoma_joblib = response_joblib.vsoma[trial_idx]
+        vsoma_mpi = response_mpi.vsoma[trial_idx]
+        assert sorted(vsoma_mpi) == sorted(vsoma_joblib)
+        for gid in vsoma_joblib:
+            assert_array_equal(vsoma_mpi[gid], vsoma_joblib[gid])
+            for key in response_joblib.isoma[trial_idx][gid]:
+                assert_array_equal(response_mpi.isoma[trial_idx][gid][key],
+                                   response_joblib.isoma[trial_idx][gid][key])
+    assert_array_equal(response_mpi.cell_dipoles,
+                       response_joblib.cell_dipoles)
+    assert_array_equal(response_mpi.cell_dipole_gids,
+                       response_joblib.cell_dipole_gids)
@@ -0,0 +1,232 @@
+import os
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+import pytest
+
+from hnn_core import Network, RunControl, MPIBackend, simulate_dipole
+from hnn_core.parallel_backends import requires_mpi4py
+
+
+def _stop_after_35(t, spike_times, spike_gids, dpl):
+    """Stop a trial at the first check after 35 ms."""
+    return t > 35.
+
+
+def _get_spikes(net, trial_idx=0):
+    """Get the (time, gid) of the spikes of a trial in time order."""
+    return sorted(zip(net.cell_response.spike_times[trial_idx],
+                      net.cell_response.spike_gids[trial_idx]))
+
+
+def test_checkpoint(tmpdir, reduced_params):
+    """Test resuming a simulation from its checkpoints."""
+    params = reduced_params(tstop=60)
+    net = Network(params, add_drives_from_params=True)
+    checkpoint_dir = str(tmpdir.join('checkpoints'))
+    with pytest.raises(TypeError, match="resume_from must be str"):
+        RunControl(resume_from=1)
+    with pytest.raises(ValueError, match="resume_from must be an existing"):
+        RunControl(resume_from=checkpoint_dir)
+    with pytest.raises(TypeError, match="checkpoint_dir must be str"):
+        RunControl(checkpoint_dir=1)
+    with pytest.raises(TypeError, match="checkpoint_interval must be float"):
+        RunControl(checkpoint_dir=checkpoint_dir, checkpoint_interval='20')
+    with pytest.raises(TypeError, match="run_control must be RunControl"):
+        simulate_dipole(net, run_control={'checkpoint_dir': checkpoint_dir})
+    with pytest.raises(ValueError, match="checkpoint_interval must be an"):
+        simulate_dipole(net, record_dt=0.5, run_control=RunControl(
+            checkpoint_dir=checkpoint_dir, checkpoint_interval=20.25))
+
+    dpls = simulate_dipole(net, n_trials=1, record_vsoma=True,
+                           record_dt=0.5)
+
+    # the last checkpoint is at 40 ms, where the second run continues
+    net_checkpoint = net.copy()
+    dpls_checkpoint = simulate_dipole(
+        net_checkpoint, n_trials=1, record_vsoma=True, record_dt=0.5,
+        run_control=RunControl(checkpoint_dir=checkpoint_dir,
+                               checkpoint_interval=20.))
+    assert os.listdir(checkpoint_dir) == ['checkpoint-trial0-rank0-chunk2.npz']
+    net_resume = net.copy()
+    run_control = RunControl(resume_from=checkpoint_dir,
+                             checkpoint_interval=20.)
+    assert repr(run_control) == ('<RunControl | checkpoints every 20.0 ms, '
+                                 'resumed>')
+    dpls_resume = simulate_dipole(net_resume, n_trials=1, record_vsoma=True,
+                                  record_dt=0.5, run_control=run_control)
+    for net_run, dpls_run in ((net_checkpoint, dpls_checkpoint),
+                              (net_resume, dpls_resume)):
+        assert_array_equal(dpls[0].data['agg'], dpls_run[0].data['agg'])
+        assert (sorted(zip(net.cell_response.spike_times[0],
+                           net.cell_response.spike_gids[0])) ==
+                sorted(zip(net_run.cell_response.spike_times[0],
+                           net_run.cell_response.spike_gids[0])))
+        for gid, vsoma in net.cell_response.vsoma[0].items():
+            assert_array_equal(vsoma, net_run.cell_response.vsoma[0][gid])
+
+    net_other = net.copy()
+    net_other.params['gbar_L2Pyr_L2Pyr_ampa'] *= 2
+    with pytest.raises(ValueError, match="is from a different simulation"):
+        simulate_dipole(net_other, n_trials=1, record_vsoma=True,
+                        record_dt=0.5, run_control=run_control)
+
+
+def test_stream(tmpdir, reduced_params):
+    """Test streaming the recordings to the disk."""
+    params = reduced_params()
+    net = Network(params, add_drives_from_params=True)
+    stream_dir = str(tmpdir.join('stream'))
+    with pytest.raises(TypeError, match="stream_dir must be str"):
+        RunControl(stream_dir=1)
+    with pytest.raises(TypeError, match="stream_interval must be float"):
+        RunControl(stream_dir=stream_dir, stream_interval='10')
+    with pytest.raises(ValueError, match="cannot be combined"):
+        RunControl(stream_dir=stream_dir, checkpoint_dir=stream_dir)
+    with pytest.raises(ValueError, match="stream_interval must be an"):
+        simulate_dipole(net, record_dt=0.5, run_control=RunControl(
+            stream_dir=stream_dir, stream_interval=10.25))
+    with pytest.raises(ValueError, match="stream_dir requires"):
+        simulate_dipole(net, dipole_method='imem',
+                        run_control=RunControl(stream_dir=stream_dir))
+
+    kwargs = dict(n_trials=1, record_vsoma=True, record_isoma=True,
+                  record_dt=0.5, record_cell_dipoles=True)
+    dpls = simulate_dipole(net, **kwargs)
+    net_stream = net.copy()
+    run_control = RunControl(stream_dir=stream_dir, stream_interval=10.)
+    dpls_stream = simulate_dipole(net_stream, run_control=run_control,
+                                  **kwargs)
+    assert 'trial0-rank0-vsoma.bin' in os.listdir(stream_dir)
+    assert_array_equal(dpls[0].data['agg'], dpls_stream[0].data['agg'])
+    cell_response = net.cell_response
+    cell_response_stream = net_stream.cell_response
+    assert cell_response.spike_times == cell_response_stream.spike_times
+    assert cell_response.spike_gids == cell_response_stream.spike_gids
+    for gid, vsoma in cell_response.vsoma[0].items():
+        assert isinstance(cell_response_stream.vsoma[0][gid], np.memmap)
+        assert_array_equal(vsoma, cell_response_stream.vsoma[0][gid])
+    for gid, isoma in cell_response.isoma[0].items():
+        for key, rec_i in isoma.items():
+            assert_array_equal(rec_i,
+                               cell_response_stream.isoma[0][gid][key])
+    assert_array_equal(cell_response._cell_dipoles[0],
+                       cell_response_stream._cell_dipoles[0])
+
+
+def test_stop_criteria(reduced_params):
+    """Test stopping a simulation early."""
+    params = reduced_params()
+    net = Network(params, add_drives_from_params=True)
+    with pytest.raises(TypeError, match="stop_criteria must be list of"):
+        RunControl(stop_criteria=lambda *args: True)
+    with pytest.raises(TypeError, match="stop_check_interval must be"):
+        RunControl(stop_criteria=[], stop_check_interval='10')
+    with pytest.raises(ValueError, match="stop_check_interval must be pos"):
+        RunControl(stop_criteria=[], stop_check_interval=0.)
+    with pytest.raises(ValueError, match="cannot be combined"):
+        RunControl(stop_criteria=[lambda *args: True], stream_dir='.')
+
+    dpls = simulate_dipole(net, n_trials=1, record_vsoma=True,
+                           postproc=False)
+    assert not dpls[0].stopped_early
+
+    checks = list()
+
+    def stop_after_15(t, spike_times, spike_gids, dpl):
+        checks.append((t, sorted(spike_times), dpl.data['agg']))
+        assert len(spike_times) == len(spike_gids)
+        assert np.all(spike_times <= t)
+        assert dpl.times[-1] < t
+        return t > 15.
+
+    net_stop = net.copy()
+    run_control = RunControl(stop_criteria=[stop_after_15],
+                             stop_check_interval=10.)
+    dpls_stop = simulate_dipole(net_stop, n_trials=1, record_vsoma=True,
+                                postproc=False, run_control=run_control)
+    assert dpls_stop[0].stopped_early
+    assert_allclose([t for t, _, _ in checks], [10., 20.])
+    # each check adds the data since the last one to those of the earlier
+    _, spike_times, dpl_agg = checks[-1]
+    assert_array_equal(dpl_agg, dpls[0].data['agg'][:len(dpl_agg)])
+    assert spike_times == sorted(t for t in net.cell_response.spike_times[0]
+                                 if t <= 20.)
+    n_times = len(dpls_stop[0].times)
+    assert_allclose(dpls_stop[0].times[-1], 20.)
+    assert_array_equal(dpls_stop[0].data['agg'], dpls[0].data['agg'][:n_times])
+    vsoma = net.cell_response.vsoma[0]
+    for gid, vsoma_stop in net_stop.cell_response.vsoma[0].items():
+        assert_array_equal(vsoma_stop, vsoma[gid][:n_times])
+    assert sorted(net_stop.cell_response.spike_times[0]) == \
+        sorted(t for t in net.cell_response.spike_times[0] if t <= 20.)
+
+
+def test_stop_criteria_checkpoint(tmpdir, reduced_params):
+    """Test resuming a trial that stopped early from its checkpoints."""
+    params = reduced_params(tstop=60)
+    net = Network(params, add_drives_from_params=True)
+    checkpoint_dir = str(tmpdir.join('checkpoints'))
+    kwargs = dict(n_trials=1, record_vsoma=True, record_dt=0.5)
+
+    # the trial stops at 40 ms, before its checkpoint at 40 ms is saved
+    net_stop = net.copy()
+    dpls_stop = simulate_dipole(net_stop, run_control=RunControl(
+        checkpoint_dir=checkpoint_dir, checkpoint_interval=20.,
+        stop_criteria=[_stop_after_35], stop_check_interval=10.), **kwargs)
+    assert dpls_stop[0].stopped_early
+    assert_allclose(dpls_stop[0].times[-1], 40.)
+    assert os.listdir(checkpoint_dir) == ['checkpoint-trial0-rank0-chunk1.npz']
+
+    # the resumed trial continues from 20 ms and stops at the same time
+    net_resume = net.copy()
+    dpls_resume = simulate_dipole(net_resume, run_control=RunControl(
+        resume_from=checkpoint_dir, checkpoint_interval=20.,
+        stop_criteria=[_stop_after_35], stop_check_interval=10.), **kwargs)
+    assert dpls_resume[0].stopped_early
+    assert_array_equal(dpls_resume[0].data['agg'], dpls_stop[0].data['agg'])
+    assert _get_spikes(net_resume) == _get_spikes(net_stop)
+    for gid, vsoma in net_stop.cell_response.vsoma[0].items():
+        assert_array_equal(net_resume.cell_response.vsoma[0][gid], vsoma)
+
+
+@requires_mpi4py
+def test_run_control_mpi(tmpdir, two_mpi_procs, reduced_params):
+    """Test the checkpoints and the streaming of two MPI processes."""
+    params = reduced_params(tstop=60)
+    net = Network(params, add_drives_from_params=True)
+    checkpoint_dir = str(tmpdir.join('checkpoints'))
+    stream_dir = str(tmpdir.join('stream'))
+    kwargs = dict(n_trials=1, record_vsoma=True, record_dt=0.5,
+                  postproc=False)
+    dpls = simulate_dipole(net, **kwargs)
+
+    # the same backend runs the three simulations
+    runs = list()
+    with MPIBackend(n_procs=2) as backend:
+        assert backend.n_procs == 2
+        for run_control_kwargs in (
+                dict(checkpoint_dir=checkpoint_dir, checkpoint_interval=20.),
+                dict(resume_from=checkpoint_dir, checkpoint_interval=20.),
+                dict(stream_dir=stream_dir, stream_interval=10.)):
+            net_run = net.copy()
+            dpls_run = simulate_dipole(
+                net_run, run_control=RunControl(**run_control_kwargs),
+                **kwargs)
+            runs.append((net_run, dpls_run))
+            if 'checkpoint_dir' in run_control_kwargs:
+                # each process saves its own state
+                assert sorted(os.listdir(checkpoint_dir)) == [
+                    'checkpoint-trial0-rank%d-chunk2.npz' % rank
+                    for rank in range(2)]
+    assert 'trial0-rank1-vsoma.bin' in os.listdir(stream_dir)
+
+    for net_run, dpls_run in runs:
+        # the dipoles of the ranks are summed in another order
+        assert_allclose(dpls_run[0].data['agg'], dpls[0].data['agg'],
+                        rtol=1e-12, atol=1e-12)
+        assert _get_spikes(net_run) == _get_spikes(net)
+        vsoma_run = net_run.cell_response.vsoma[0]
+        assert sorted(vsoma_run) == sorted(net.cell_response.vsoma[0])
+        for gid, vsoma in net.cell_response.vsoma[0].items():
+            assert_array_equal(vsoma_run[gid], vsoma)